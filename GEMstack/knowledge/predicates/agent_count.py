@@ -19,6 +19,9 @@ class AgentCountPredicate(PredicateBase):
 
     def value_type(self):
         return int
+
+    def inputs(self):
+        return ['agents']
     
     def value(self, state : AllState):
         if self.agent_type is None:
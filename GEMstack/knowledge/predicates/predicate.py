@@ -12,12 +12,18 @@ this by implementing the name() method.
 
 To serialize and deserialize, use the `serialize_predicate` and
 `deserialize_predciate` functions.
+
+To evaluate many predicates on each step, use a `PredicateEvaluator`, which
+evaluates shared subpredicates once and only re-evaluates predicates whose
+inputs have changed.
 """
 
 from __future__ import annotations
 from types import UnionType
 from ...state import AllState
-from typing import Callable,List,Dict,Any
+from typing import Callable,List,Dict,Any,Optional,Tuple,Union
+import json
+import operator
 
 
 class PredicateBase:
@@ -48,6 +54,15 @@ class PredicateBase:
 
     def value(self, state: AllState) -> Any:
         return NotImplementedError()
+
+    def inputs(self) -> Optional[List[str]]:
+        """Returns the names of the AllState items that value() reads, e.g.,
+        ['vehicle','agents'].  Default None, meaning it may read any item.
+
+        PredicateEvaluator only re-evaluates a predicate when one of its
+        inputs has changed, so the value must not depend on anything else.
+        """
+        return None
     
     def __eq__(self, rhs) -> PredicateBase:
         return EqPredicate(self,rhs)
@@ -93,9 +108,13 @@ class UpdatingPredicateBase(PredicateBase):
 class LambdaPredicate(PredicateBase):
     """A predicate that calls a user-defined function.  Note that
     because we can't serialize functions, this predicate cannot
-    be serialized."""
-    def __init__(self, f : Callable[[AllState],Any]):
+    be serialized.
+
+    If given, inputs lists the AllState items that f reads.
+    """
+    def __init__(self, f : Callable[[AllState],Any], inputs : Optional[List[str]] = None):
         self.f = f
+        self._inputs = inputs
 
     @classmethod
     def name(cls) -> str:
@@ -104,6 +123,9 @@ class LambdaPredicate(PredicateBase):
     def args(self) -> list:
         return [self.f]
 
+    def inputs(self) -> Optional[List[str]]:
+        return self._inputs
+
     def value(self, state: AllState) -> Any:
         return self.f(state)
 
@@ -386,6 +408,8 @@ def deserialize_predicates(l : List[Dict[str,Any]]) -> List[PredicateBase]:
 
 def pprint(predicate: PredicateBase) -> str:
     """Pretty prints a predicate."""
+    if not isinstance(predicate,PredicateBase):
+        return repr(predicate)
     if isinstance(predicate,AndPredicate):
         return 'and('+', '.join(pprint(p) for p in predicate.predicates)+')'
     elif isinstance(predicate,OrPredicate):
@@ -403,4 +427,166 @@ def pprint(predicate: PredicateBase) -> str:
     elif isinstance(predicate,LEPredicate):
         return pprint(predicate.lhs)+' <= '+pprint(predicate.rhs)
     else:
-        return predicate.name()+'('+', '.join(pprint(a) for a in predicate.args())+')'
\ No newline at end of file
+        return predicate.name()+'('+', '.join(pprint(a) for a in predicate.args())+')'
+
+def predicate_key(predicate : PredicateBase) -> tuple:
+    """Returns a hashable key that is the same for predicates of the same
+    type with the same arguments.  Functions and other arguments that can't
+    be converted to JSON are compared by identity."""
+    return (type(predicate),predicate.name(),tuple(_arg_key(a) for a in predicate.args()))
+
+
+def _arg_key(a : Any):
+    if isinstance(a,PredicateBase):
+        return predicate_key(a)
+    if callable(a):
+        return ('object',id(a))
+    try:
+        return ('json',json.dumps(a,sort_keys=True))
+    except (TypeError,ValueError):
+        return ('object',id(a))
+
+
+_COMPARISONS = {EqPredicate:operator.eq, GTPredicate:operator.gt, GEPredicate:operator.ge,
+                LTPredicate:operator.lt, LEPredicate:operator.le}
+
+
+class _PredicateNode:
+    __slots__ = ('predicate','kind','children','inputs','stamp','value')
+
+    def __init__(self, predicate, kind, children, inputs):
+        self.predicate = predicate
+        self.kind = kind                # 'and', 'or', 'not', 'compare', or 'leaf'
+        self.children = children        # node indices, or (is_node, index or constant) for comparisons
+        self.inputs = inputs            # sorted AllState item names, or None for all items
+        self.stamp = None
+        self.value = None
+
+
+class PredicateEvaluator:
+    """Evaluates a set of predicates on successive states, e.g., once per
+    step of the behavior logic.
+
+    The predicates are compiled into a DAG in which subpredicates of the same
+    type with the same arguments are a single node, so each is evaluated at
+    most once per state.  and / or / not and comparisons are evaluated by the
+    evaluator, with the same short-circuiting, and other predicates by
+    calling value().
+
+    Each node's value is cached along with the versions (see
+    AllState.version) of the items it reads, as given by inputs(), and is
+    only recomputed when one of them has changed.  Nodes that may read any
+    item are recomputed whenever the state's generation changes.
+
+    The evaluator assumes it is given successive generations of one AllState
+    or snapshots of it.  Call reset() before evaluating a different state.
+    States without versions are evaluated from scratch.
+    """
+    def __init__(self, predicates : Union[List[PredicateBase],Dict[str,PredicateBase]] = None):
+        self.nodes = []             # type: List[_PredicateNode]
+        self.names = dict()         # type: Dict[str,int]
+        self.evaluations = 0        # number of calls to leaf predicates' value()
+        self._keys = dict()         # type: Dict[tuple,int]
+        self._generation = -1
+        if isinstance(predicates,dict):
+            for name,p in predicates.items():
+                self.add(p,name)
+        elif predicates is not None:
+            for p in predicates:
+                self.add(p)
+
+    def add(self, predicate : PredicateBase, name : Optional[str] = None) -> int:
+        """Adds a predicate, by default named pprint(predicate), and returns
+        its node index."""
+        i = self._compile(predicate)
+        self.names[name if name is not None else pprint(predicate)] = i
+        return i
+
+    def _compile(self, predicate : PredicateBase) -> int:
+        key = predicate_key(predicate)
+        i = self._keys.get(key)
+        if i is not None:
+            return i
+        if isinstance(predicate,(AndPredicate,OrPredicate)):
+            kind = 'and' if isinstance(predicate,AndPredicate) else 'or'
+            children = [self._compile(p) for p in predicate.predicates]
+            inputs = self._union([self.nodes[c].inputs for c in children])
+        elif isinstance(predicate,NotPredicate):
+            kind = 'not'
+            children = [self._compile(predicate.predicate)]
+            inputs = self.nodes[children[0]].inputs
+        elif type(predicate) in _COMPARISONS:
+            kind = 'compare'
+            children = [(True,self._compile(a)) if isinstance(a,PredicateBase) else (False,a) for a in (predicate.lhs,predicate.rhs)]
+            inputs = self._union([self.nodes[c].inputs if is_node else () for is_node,c in children])
+        else:
+            kind = 'leaf'
+            children = []
+            inputs = predicate.inputs()
+            inputs = tuple(sorted(set(inputs))) if inputs is not None else None
+        self.nodes.append(_PredicateNode(predicate,kind,children,inputs))
+        self._keys[key] = len(self.nodes)-1
+        return len(self.nodes)-1
+
+    @staticmethod
+    def _union(inputs : List[Optional[tuple]]) -> Optional[tuple]:
+        if any(i is None for i in inputs):
+            return None
+        return tuple(sorted(set(sum(inputs,()))))
+
+    def reset(self) -> None:
+        """Forgets all cached values."""
+        for node in self.nodes:
+            node.stamp = None
+            node.value = None
+        self._generation = -1
+
+    def value(self, predicate : Union[str,PredicateBase], state : AllState) -> Any:
+        """Returns the value of a predicate, given by name or as a
+        predicate, which is added if it hasn't been already."""
+        if isinstance(predicate,str):
+            i = self.names[predicate]
+        else:
+            i = self._compile(predicate)
+        return self._value(i,state,self._versioned(state))
+
+    def evaluate(self, state : AllState) -> Dict[str,Any]:
+        """Returns the values of all named predicates."""
+        versioned = self._versioned(state)
+        return dict((name,self._value(i,state,versioned)) for name,i in self.names.items())
+
+    def _versioned(self, state : AllState) -> bool:
+        generation = getattr(state,'generation',None)
+        if generation is None or not hasattr(state,'version'):
+            return False
+        if generation < self._generation:
+            #not a later generation of the same state
+            self.reset()
+        self._generation = generation
+        return True
+
+    def _value(self, i : int, state : AllState, versioned : bool) -> Any:
+        node = self.nodes[i]
+        stamp = None
+        if versioned:
+            if node.inputs is None:
+                stamp = state.generation
+            else:
+                stamp = tuple(state.version(name) for name in node.inputs)
+            if stamp == node.stamp:
+                return node.value
+        if node.kind == 'and':
+            value = all(self._value(c,state,versioned) for c in node.children)
+        elif node.kind == 'or':
+            value = any(self._value(c,state,versioned) for c in node.children)
+        elif node.kind == 'not':
+            value = not self._value(node.children[0],state,versioned)
+        elif node.kind == 'compare':
+            lhs,rhs = [self._value(c,state,versioned) if is_node else c for is_node,c in node.children]
+            value = _COMPARISONS[type(node.predicate)](lhs,rhs)
+        else:
+            self.evaluations += 1
+            value = node.predicate.value(state)
+        node.stamp = stamp
+        node.value = value
+        return value
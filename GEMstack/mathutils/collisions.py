@@ -2,16 +2,16 @@
 
 Uses the `shapely` package for all 2D collision detection. 
 
-The `CollisionDetector2D` class provides a convenience wrapper to store
-multiple objects in a scene and perform collision queries. 
-
-TODO: collision acceleration?
+The `CollisionDetector2D` class stores multiple objects in a scene and
+performs collision queries, using a shapely STRtree to only test objects
+whose bounding boxes are nearby.
 """
 
 from .transforms import vector2_dist
 import shapely
 import math
-from typing import Tuple, List, Iterator, Optional
+import numpy as np
+from typing import Tuple, List, Iterator, Optional, Set
 
 def point_in_circle_2d(point : Tuple[float,float], center : Tuple[float,float], radius : float) -> bool:
     """Returns true if the given point is inside a circle.
@@ -168,114 +168,298 @@ def polygon_polygon_distance_2d(poly1 : List[Tuple[float,float]], poly2 : List[T
     return shapely.Polygon(poly1).distance(shapely.Polygon(poly2))
 
 
+def _polygon_array(polygon) -> np.ndarray:
+    return np.asarray(polygon,dtype=float)[:,:2]
+
+def stack_polygons(polygons) -> np.ndarray:
+    """Stacks polygons into an m x k x 2 array, padding polygons with fewer
+    vertices by repeating their last vertex."""
+    if isinstance(polygons,np.ndarray):
+        return polygons[...,:2].astype(float)
+    k = max(len(p) for p in polygons)
+    res = np.empty((len(polygons),k,2))
+    for i,p in enumerate(polygons):
+        p = _polygon_array(p)
+        res[i,:len(p)] = p
+        res[i,len(p):] = p[-1]
+    return res
+
+def points_in_polygon_2d(points, polygon : List[Tuple[float,float]]) -> np.ndarray:
+    """Returns a boolean array indicating whether each of the n x 2 points is
+    strictly inside the polygon, like point_in_polygon_2d.  Uses a
+    winding-number test, so the polygon needn't be convex.
+    """
+    p = np.asarray(points,dtype=float)[...,:2].reshape(-1,2)[:,np.newaxis,:]
+    a = _polygon_array(polygon)
+    b = np.roll(a,-1,axis=0)
+    cross = (b[:,0]-a[:,0])*(p[...,1]-a[:,1]) - (b[:,1]-a[:,1])*(p[...,0]-a[:,0])
+    up = (a[:,1] <= p[...,1]) & (p[...,1] < b[:,1]) & (cross > 0)
+    down = (b[:,1] <= p[...,1]) & (p[...,1] < a[:,1]) & (cross < 0)
+    winding = up.sum(axis=1) - down.sum(axis=1)
+    on_boundary = ((cross == 0) & (np.minimum(a[:,0],b[:,0]) <= p[...,0]) & (p[...,0] <= np.maximum(a[:,0],b[:,0]))
+                   & (np.minimum(a[:,1],b[:,1]) <= p[...,1]) & (p[...,1] <= np.maximum(a[:,1],b[:,1]))).any(axis=1)
+    return (winding != 0) & ~on_boundary
+
+def _points_segments_distance(p : np.ndarray, a : np.ndarray, b : np.ndarray) -> np.ndarray:
+    """Distances from points p (... x 2) to segments a->b (... x 2), with
+    broadcasting."""
+    v = b - a
+    u = p - a
+    vlen2 = (v*v).sum(axis=-1)
+    t = np.clip((u*v).sum(axis=-1)/np.where(vlen2 > 0,vlen2,1.0),0.0,1.0)
+    d = u - v*t[...,np.newaxis]
+    return np.sqrt((d*d).sum(axis=-1))
+
+def points_polygon_distance_2d(points, polygon : List[Tuple[float,float]]) -> np.ndarray:
+    """Returns the distances from each of the n x 2 points to the polygon,
+    like point_polygon_distance_2d (0 inside the polygon)."""
+    p = np.asarray(points,dtype=float)[...,:2].reshape(-1,2)
+    a = _polygon_array(polygon)
+    b = np.roll(a,-1,axis=0)
+    d = _points_segments_distance(p[:,np.newaxis,:],a,b).min(axis=1)
+    d[points_in_polygon_2d(p,polygon)] = 0.0
+    return d
+
+def _convex_projections(polys : np.ndarray, axes : np.ndarray) -> Tuple[np.ndarray,np.ndarray]:
+    #polys: m x k x 2, axes: m x j x 2 -> min and max, each m x j
+    proj = np.einsum('mkd,mjd->mjk',polys,axes)
+    return proj.min(axis=2),proj.max(axis=2)
+
+def polygons_intersect_polygon_2d(polygon : List[Tuple[float,float]], polygons) -> np.ndarray:
+    """Returns a boolean array indicating whether each of the given polygons
+    intersects (or touches) `polygon`, like polygon_intersects_polygon_2d.
+
+    Uses the separating axis test, so all polygons must be convex, e.g.,
+    rectangles and vehicle footprints.  polygons may be an m x k x 2 array
+    or a list of polygons.
+    """
+    A = _polygon_array(polygon)
+    B = stack_polygons(polygons)
+    return polygon_pairs_intersect_2d(np.broadcast_to(A,(len(B),)+A.shape),B)
+
+def polygon_pairs_intersect_2d(polygons1, polygons2) -> np.ndarray:
+    """Returns a boolean array indicating whether polygons1[i] intersects (or
+    touches) polygons2[i], for each i.  Like polygons_intersect_polygon_2d,
+    all polygons must be convex.  Useful for testing many (footprint, obstacle)
+    pairs at once.
+    """
+    A = stack_polygons(polygons1)
+    B = stack_polygons(polygons2)
+    m = len(B)
+    if m == 0:
+        return np.zeros(0,dtype=bool)
+    def normals(P):
+        e = np.roll(P,-1,axis=-2) - P
+        return np.stack((-e[...,1],e[...,0]),axis=-1)
+    separated = np.zeros(m,dtype=bool)
+    for axes in (normals(A),normals(B)):
+        amin,amax = _convex_projections(A,axes)
+        bmin,bmax = _convex_projections(B,axes)
+        separated |= ((amax < bmin) | (bmax < amin)).any(axis=1)
+    return ~separated
+
+def polygons_polygon_distance_2d(polygon : List[Tuple[float,float]], polygons) -> np.ndarray:
+    """Returns the distances from each of the given convex polygons to the
+    convex `polygon`, like polygon_polygon_distance_2d (0 if they
+    intersect)."""
+    A = _polygon_array(polygon)
+    B = stack_polygons(polygons)
+    if len(B) == 0:
+        return np.zeros(0)
+    A1 = np.roll(A,-1,axis=0)
+    B1 = np.roll(B,-1,axis=1)
+    #vertices of B to edges of A, and vertices of A to edges of B
+    d1 = _points_segments_distance(B[:,:,np.newaxis,:],A,A1).min(axis=(1,2))
+    d2 = _points_segments_distance(A[np.newaxis,:,np.newaxis,:],B[:,np.newaxis,:,:],B1[:,np.newaxis,:,:]).min(axis=(1,2))
+    d = np.minimum(d1,d2)
+    d[polygons_intersect_polygon_2d(polygon,B)] = 0.0
+    return d
+
+
 class CollisionDetector2D:
     """A class for detecting collisions between many types of objects.
-    Simply provides a convenience wrapper around shapely objects.
 
-    Does not implement any acceleration data structures, so this may be
-    best combined with a grid for faster collision detection.
+    Objects are stored as shapely geometries in an STRtree (the broad phase),
+    and queries only run exact shapely tests (the narrow phase) on objects
+    whose bounding boxes are within the query margin.
+
+    The tree is immutable, so objects that are added or updated after it is
+    built are kept in a small set of pending objects that are tested directly.
+    The tree is rebuilt once the pending objects exceed REBUILD_FRACTION of
+    the tree's size.
     """
+    REBUILD_FRACTION = 0.25
+    REBUILD_MIN = 8
+
     def __init__(self):
         self.objects = dict()
-        self.collision_pairs = set()
+        self.ignored_pairs = set()          # type: Set[Tuple[str,str]]
+        self._tree = None                   # type: Optional[shapely.STRtree]
+        self._tree_names = []               # type: List[str]
+        self._stale = set()                 # type: Set[str]
+        self._pending = set()               # type: Set[str]
+
+    @staticmethod
+    def _pair(name1 : str, name2 : str) -> Tuple[str,str]:
+        return (name1,name2) if name1 < name2 else (name2,name1)
+
+    def _set(self, name : str, geometry) -> None:
+        if name in self.objects:
+            self._stale.add(name)
+        self.objects[name] = geometry
+        self._pending.add(name)
+
+    def _add(self, name : str, geometry) -> None:
+        if name in self.objects:
+            raise ValueError("Object named "+name+" already exists")
+        self._set(name,geometry)
+
+    def rebuild(self) -> None:
+        """Rebuilds the broad phase tree from all objects."""
+        self._tree_names = list(self.objects.keys())
+        self._tree = shapely.STRtree([self.objects[n] for n in self._tree_names]) if len(self._tree_names) > 0 else None
+        self._stale = set()
+        self._pending = set()
+
+    def _maybe_rebuild(self) -> None:
+        changed = len(self._pending) + len(self._stale)
+        if changed > max(self.REBUILD_MIN,self.REBUILD_FRACTION*len(self._tree_names)):
+            self.rebuild()
 
     def remove(self, name : str) -> None:
         """Removes an object from the collision detector."""
         del self.objects[name]
-        for name2 in self.objects.keys():
-            if name < name2:
-                 self.collision_pairs.discard((name,name2))
-            else:
-                 self.collision_pairs.discard((name2,name))
-    
+        self._stale.add(name)
+        self._pending.discard(name)
+        self.ignored_pairs = set(p for p in self.ignored_pairs if name not in p)
+
     def add_polygon(self, name : str, polygon : List[Tuple[float,float]]) -> None:
         """Adds an object to the collision detector."""
-        if name in self.objects:
-            raise ValueError("Object named "+name+" already exists")
-        for name2 in self.objects.keys():
-            if name < name2:
-                 self.collision_pairs.add((name,name2))
-            else:
-                 self.collision_pairs.add((name2,name))
-        self.objects[name] = shapely.Polygon(polygon)
-    
+        self._add(name,shapely.Polygon(polygon))
+
     def add_circle(self, name : str, center : Tuple[float,float], radius : float) -> None:
         """Adds an object to the collision detector."""
-        if name in self.objects:
-            raise ValueError("Object named "+name+" already exists")
-        for name2 in self.objects.keys():
-            if name < name2:
-                 self.collision_pairs.add((name,name2))
-            else:
-                 self.collision_pairs.add((name2,name))
-        self.objects[name] = shapely.Point(center[0], center[1]).buffer(radius)
-    
+        self._add(name,shapely.Point(center[0], center[1]).buffer(radius))
+
     def add_line(self, name : str, vertices : List[Tuple[float,float]]) -> None:
         """Adds an object to the collision detector."""
-        if name in self.objects:
-            raise ValueError("Object named "+name+" already exists")
-        for name2 in self.objects.keys():
-            if name < name2:
-                 self.collision_pairs.add((name,name2))
-            else:
-                 self.collision_pairs.add((name2,name))
-        self.objects[name] = shapely.LineString(vertices)
-    
+        self._add(name,shapely.LineString(vertices))
+
+    def update_polygon(self, name : str, polygon : List[Tuple[float,float]]) -> None:
+        """Adds or moves a polygon object."""
+        self._set(name,shapely.Polygon(polygon))
+
+    def update_circle(self, name : str, center : Tuple[float,float], radius : float) -> None:
+        """Adds or moves a circle object."""
+        self._set(name,shapely.Point(center[0], center[1]).buffer(radius))
+
+    def update_line(self, name : str, vertices : List[Tuple[float,float]]) -> None:
+        """Adds or moves a line string object."""
+        self._set(name,shapely.LineString(vertices))
+
     def ignore_collisions(self, name1 : str, name2 : str) -> None:
         """Ignores collisions between two objects."""
-        if name1 < name2:
-            self.collision_pairs.discard((name1,name2))
-        else:
-            self.collision_pairs.discard((name2,name1))
+        self.ignored_pairs.add(self._pair(name1,name2))
+
+    def _query(self, geometry, predicate : Optional[str] = None, margin : float = 0.0) -> List[str]:
+        """Returns names of objects for which predicate(geometry, object) is
+        true.  If margin > 0, returns objects within that distance of
+        geometry (the 'dwithin' predicate)."""
+        self._maybe_rebuild()
+        if margin > 0:
+            predicate = 'dwithin'
+        res = []
+        if self._tree is not None:
+            if predicate == 'dwithin':
+                inds = self._tree.query(geometry,predicate=predicate,distance=margin)
+            else:
+                inds = self._tree.query(geometry,predicate=predicate)
+            for i in np.sort(inds):
+                name = self._tree_names[i]
+                if name not in self._stale:
+                    res.append(name)
+        for name in self._pending:
+            obj = self.objects[name]
+            if predicate is None:
+                hit = shapely.intersects(shapely.envelope(geometry),shapely.envelope(obj))
+            elif predicate == 'dwithin':
+                hit = shapely.dwithin(geometry,obj,margin)
+            else:
+                hit = getattr(shapely,predicate)(geometry,obj)
+            if hit:
+                res.append(name)
+        return res
+
+    def candidates(self, name : str, margin : float = 0.0) -> List[str]:
+        """Returns the other objects whose bounding boxes are within margin of
+        the named object's bounding box (the broad phase only)."""
+        box = shapely.envelope(self.objects[name])
+        if margin > 0:
+            box = box.buffer(margin,join_style='mitre')
+        return [n for n in self._query(box) if n != name]
 
     def distance(self, name1 : str, name2 : Optional[str] = None) -> float:
         """Returns the distance between two objects.  If name2 is None, then
-        this returns the minimum distance from name1 to any other object."""
-        if name2 is None:
-            d = min(self.objects[name1].distance(self.objects[name2]) for name2 in self.collision_pairs[name1])
-            for name2,olist in self.collision_pairs.items():
-                if name1 in olist:
-                    d = min(d,self.objects[name1].distance(self.objects[name2]))
-            return d
-        return self.objects[name1].distance(self.objects[name2])
-
-    def items_colliding(self, name : Optional[str] = None) -> Iterator:
-        """Returns an iterator over pairs of objects that are colliding.
+        this returns the minimum distance from name1 to any other object that
+        isn't ignored."""
+        if name2 is not None:
+            return self.objects[name1].distance(self.objects[name2])
+        o = self.objects[name1]
+        others = [n for n in self.objects if n != name1 and self._pair(name1,n) not in self.ignored_pairs]
+        if len(others) == 0:
+            return float('inf')
+        return float(np.min(shapely.distance(o,[self.objects[n] for n in others])))
+
+    def items_colliding(self, name : Optional[str] = None, margin : float = 0.0) -> Iterator:
+        """Returns an iterator over pairs of objects that are colliding, or
+        are within `margin` of each other.
         
         If `name` is provided, then this returns an iterator over objects
         that are colliding with the named object.
         """
-        if name is None:
-            for name1, name2 in self.collision_pairs:
-                if self.objects[name1].intersects(self.objects[name2]):
-                    yield (name1,name2)
+        if name is not None:
+            for name2 in self._query(self.objects[name],'intersects',margin):
+                if name2 != name and self._pair(name,name2) not in self.ignored_pairs:
+                    yield self._pair(name,name2)
+            return
+        if self._pending or self._stale:
+            self.rebuild()
+        if self._tree is None:
+            return
+        geoms = [self.objects[n] for n in self._tree_names]
+        if margin > 0:
+            pairs = self._tree.query(geoms,predicate='dwithin',distance=margin)
         else:
-            o = self.objects[name]
-            for name2 in self.collision_pairs[name]:
-                if o.intersects(self.objects[name2]):
-                    yield (name,name2)
-            for name2,olist in self.collision_pairs.items():
-                if name in olist:
-                    if o.intersects(self.objects[name2]):
-                        yield (name2,name)
-    
+            pairs = self._tree.query(geoms,predicate='intersects')
+        for i,j in pairs.T:
+            if i < j:
+                pair = self._pair(self._tree_names[i],self._tree_names[j])
+                if pair not in self.ignored_pairs:
+                    yield pair
+
+    def items_intersecting_polygon(self, polygon : List[Tuple[float,float]], margin : float = 0.0) -> Iterator:
+        """Returns an iterator over objects that intersect the given polygon,
+        or are within `margin` of it."""
+        for name in self._query(shapely.Polygon(polygon),'intersects',margin):
+            yield name
+
+    def items_intersecting_circle(self, center : Tuple[float,float], radius : float, margin : float = 0.0) -> Iterator:
+        """Returns an iterator over objects that intersect the given circle,
+        or are within `margin` of it."""
+        for name in self._query(shapely.Point(center[0], center[1]).buffer(radius),'intersects',margin):
+            yield name
+
     def items_containing(self, point : Tuple[float,float]) -> Iterator:
         """Returns an iterator over objects that contain the given point."""
-        pt = shapely.Point(point[0], point[1])
-        for name,obj in self.objects.items():
-            if obj.contains(pt):
-                yield name
+        for name in self._query(shapely.Point(point[0], point[1]),'within'):
+            yield name
     
     def items_within_circle(self, center : Tuple[float,float], radius : float) -> Iterator:
         """Returns an iterator over objects that are within the given circle."""
-        circle = shapely.Point(center[0], center[1]).buffer(radius)
-        for name,obj in self.objects.items():
-            if circle.contains(obj):
-                yield name
+        for name in self._query(shapely.Point(center[0], center[1]).buffer(radius),'contains'):
+            yield name
     
     def items_within_box(self, lower : Tuple[float,float], upper : Tuple[float,float]) -> Iterator:
         """Returns an iterator over objects that are within the given box."""
-        box = shapely.box(lower[0], lower[1], upper[0], upper[1])
-        for name,obj in self.objects.items():
-            if box.contains(obj):
-                yield name
\ No newline at end of file
+        for name in self._query(shapely.box(lower[0], lower[1], upper[0], upper[1]),'contains'):
+            yield name
@@ -0,0 +1,326 @@
+"""Shortest paths on directed graphs with non-negative edge weights.
+
+:class:`Graph` stores the edges, :func:`shortest_path` runs A* (or Dijkstra,
+without a heuristic), and :class:`ContractionHierarchy` preprocesses a graph
+so that later queries only need to settle a handful of nodes.
+
+Queries have multiple sources and targets.  Each source has an initial cost
+and each target a final cost, so a query can start and end partway along an
+edge of the underlying map.
+"""
+
+import heapq
+import hashlib
+import numpy as np
+from typing import Callable,Dict,List,Optional,Tuple
+
+class Graph:
+    """A directed graph with n nodes and weighted edges tails[i]->heads[i]."""
+    def __init__(self, n : int, tails, heads, weights):
+        self.n = n
+        self.tails = np.asarray(tails,dtype=np.int64).reshape(-1)
+        self.heads = np.asarray(heads,dtype=np.int64).reshape(-1)
+        self.weights = np.asarray(weights,dtype=float).reshape(-1)
+        if not (len(self.tails) == len(self.heads) == len(self.weights)):
+            raise ValueError("Edge arrays must have the same length")
+        if len(self.weights) > 0 and self.weights.min() < 0:
+            raise ValueError("Edge weights must be non-negative")
+        self.out = [[] for i in range(n)]      # type: List[List[Tuple[int,float]]]
+        for u,v,w in zip(self.tails.tolist(),self.heads.tolist(),self.weights.tolist()):
+            self.out[u].append((v,w))
+
+    def __len__(self) -> int:
+        return self.n
+
+    def key(self) -> str:
+        """Returns a hash of the nodes and edges, e.g., to name cached
+        preprocessing results."""
+        h = hashlib.sha1()
+        h.update(np.int64(self.n).tobytes())
+        for a in (self.tails,self.heads,self.weights):
+            h.update(np.ascontiguousarray(a).tobytes())
+        return h.hexdigest()
+
+
+def shortest_path(graph : Graph, sources : Dict[int,float], targets : Dict[int,float],
+                  heuristic : Optional[Callable[[int],float]] = None) -> Tuple[float,List[int]]:
+    """Finds the cheapest path from any source to any target, where a path
+    from s to t costs sources[s] + the edge weights + targets[t].
+
+    heuristic(v) must not overestimate the remaining cost from v, including
+    the final cost, and must be consistent for the result to be optimal.
+    Without one, this is Dijkstra's algorithm.
+
+    Returns (cost, nodes), or (inf, []) if no target is reachable.
+    """
+    h = heuristic if heuristic is not None else (lambda v : 0.0)
+    goal = graph.n      #virtual node reached from each target
+    g = dict()
+    parent = dict()
+    queue = []
+    for s,c in sources.items():
+        if c < g.get(s,float('inf')):
+            g[s] = c
+            parent[s] = -1
+            heapq.heappush(queue,(c + h(s),s))
+    closed = set()
+    while queue:
+        f,u = heapq.heappop(queue)
+        if u == goal:
+            path = [parent[goal]]
+            while parent[path[-1]] >= 0:
+                path.append(parent[path[-1]])
+            return g[goal],path[::-1]
+        if u in closed:
+            continue
+        closed.add(u)
+        gu = g[u]
+        if u in targets:
+            c = gu + targets[u]
+            if c < g.get(goal,float('inf')):
+                g[goal] = c
+                parent[goal] = u
+                heapq.heappush(queue,(c,goal))
+        for v,w in graph.out[u]:
+            c = gu + w
+            if c < g.get(v,float('inf')):
+                g[v] = c
+                parent[v] = u
+                heapq.heappush(queue,(c + h(v),v))
+    return float('inf'),[]
+
+
+class ContractionHierarchy:
+    """A contraction hierarchy over a Graph.
+
+    Nodes are contracted one at a time, least important first, adding
+    shortcut edges that preserve shortest paths among the remaining nodes.
+    A query then searches forward from the sources and backward from the
+    targets, only ever moving to more important nodes.  The results are the
+    same as :func:`shortest_path` without a heuristic, up to ties.
+
+    Shortcuts are found with witness searches that settle at most
+    ``witness_limit`` nodes; a smaller limit preprocesses faster but may add
+    unnecessary shortcuts.
+
+    The hierarchy can be saved with :meth:`save` and restored with
+    :meth:`load`, which is much faster than building it.
+    """
+    VERSION = 1
+
+    def __init__(self, graph : Optional[Graph] = None, witness_limit : int = 64):
+        self.n = 0
+        self.rank = np.zeros(0,dtype=np.int64)
+        #upward edges as (tail, head, weight, middle) arrays.  middle is the
+        #contracted node a shortcut bypasses, or -1 for an edge of the graph
+        self.up = tuple(np.zeros(0,dtype=t) for t in (np.int64,np.int64,float,np.int64))
+        #edges into a node from a more important one
+        self.down = tuple(np.zeros(0,dtype=t) for t in (np.int64,np.int64,float,np.int64))
+        if graph is not None:
+            self._contract(graph,witness_limit)
+        self._prepare()
+
+    def _contract(self, graph : Graph, witness_limit : int) -> None:
+        n = graph.n
+        self.n = n
+        out = [dict() for i in range(n)]       # type: List[Dict[int,Tuple[float,int]]]
+        inc = [dict() for i in range(n)]       # type: List[Dict[int,Tuple[float,int]]]
+        for u,v,w in zip(graph.tails.tolist(),graph.heads.tolist(),graph.weights.tolist()):
+            if u != v and w < out[u].get(v,(float('inf'),))[0]:
+                out[u][v] = (w,-1)
+                inc[v][u] = (w,-1)
+        contracted = np.zeros(n,dtype=bool)
+        deleted_neighbors = [0]*n
+
+        def shortcuts(v):
+            """The shortcuts needed to contract v, as (u, w, weight)."""
+            res = []
+            if not inc[v] or not out[v]:
+                return res
+            max_out = max(c for c,_ in out[v].values())
+            for u,(wu,_) in inc[v].items():
+                #witness search from u, avoiding v
+                limit = wu + max_out
+                dist = {u:0.0}
+                queue = [(0.0,u)]
+                settled = 0
+                while queue and settled < witness_limit:
+                    d,x = heapq.heappop(queue)
+                    if d > dist[x]:
+                        continue
+                    if d > limit:
+                        break
+                    settled += 1
+                    for y,(wy,_) in out[x].items():
+                        if y == v:
+                            continue
+                        if d + wy < dist.get(y,float('inf')):
+                            dist[y] = d + wy
+                            heapq.heappush(queue,(d + wy,y))
+                for w,(ww,_) in out[v].items():
+                    if w == u:
+                        continue
+                    if wu + ww < dist.get(w,float('inf')):
+                        res.append((u,w,wu + ww))
+            return res
+
+        def priority(v, needed):
+            #edge difference, plus a term that spreads contractions out
+            return len(needed) - len(inc[v]) - len(out[v]) + deleted_neighbors[v]
+
+        queue = [(priority(v,shortcuts(v)),v) for v in range(n)]
+        heapq.heapify(queue)
+        up = []
+        down = []
+        rank = np.zeros(n,dtype=np.int64)
+        order = 0
+        while queue:
+            p,v = heapq.heappop(queue)
+            if contracted[v]:
+                continue
+            #lazy update: contract v only if it's still the least important
+            needed = shortcuts(v)
+            p = priority(v,needed)
+            if queue and p > queue[0][0]:
+                heapq.heappush(queue,(p,v))
+                continue
+            for u,w,c in needed:
+                if c < out[u].get(w,(float('inf'),))[0]:
+                    out[u][w] = (c,v)
+                    inc[w][u] = (c,v)
+            for w,(c,m) in out[v].items():
+                up.append((v,w,c,m))
+                del inc[w][v]
+                deleted_neighbors[w] += 1
+            for u,(c,m) in inc[v].items():
+                down.append((u,v,c,m))
+                del out[u][v]
+                deleted_neighbors[u] += 1
+            out[v] = dict()
+            inc[v] = dict()
+            contracted[v] = True
+            rank[v] = order
+            order += 1
+        self.rank = rank
+        self.up = _edge_arrays(up)
+        self.down = _edge_arrays(down)
+
+    def _prepare(self) -> None:
+        self.up_out = [[] for i in range(self.n)]      # type: List[List[Tuple[int,float]]]
+        self.down_in = [[] for i in range(self.n)]     # type: List[List[Tuple[int,float]]]
+        self.middle = dict()                           # type: Dict[Tuple[int,int],int]
+        for u,v,w,m in zip(*(a.tolist() for a in self.up)):
+            self.up_out[u].append((v,w))
+            self.middle[(u,v)] = m
+        for u,v,w,m in zip(*(a.tolist() for a in self.down)):
+            self.down_in[v].append((u,w))
+            self.middle[(u,v)] = m
+
+    def num_shortcuts(self) -> int:
+        return int((self.up[3] >= 0).sum() + (self.down[3] >= 0).sum())
+
+    def save(self, fn : str, key : str = '') -> None:
+        """Saves to a .npz file.  key identifies the graph, e.g., Graph.key()."""
+        np.savez(fn,version=self.VERSION,key=key,n=self.n,rank=self.rank,
+                 up_tails=self.up[0],up_heads=self.up[1],up_weights=self.up[2],up_middles=self.up[3],
+                 down_tails=self.down[0],down_heads=self.down[1],down_weights=self.down[2],down_middles=self.down[3])
+
+    @classmethod
+    def load(cls, fn : str, key : Optional[str] = None) -> 'ContractionHierarchy':
+        """Loads from a file written by save().  If key is given, raises a
+        ValueError if the file was saved with a different key."""
+        with np.load(fn,allow_pickle=False) as data:
+            if int(data['version']) != cls.VERSION:
+                raise ValueError("Contraction hierarchy file {} has an old version".format(fn))
+            if key is not None and str(data['key']) != key:
+                raise ValueError("Contraction hierarchy file {} is for a different graph".format(fn))
+            res = cls.__new__(cls)
+            res.n = int(data['n'])
+            res.rank = data['rank']
+            res.up = tuple(data['up_'+k] for k in ('tails','heads','weights','middles'))
+            res.down = tuple(data['down_'+k] for k in ('tails','heads','weights','middles'))
+        res._prepare()
+        return res
+
+    def shortest_path(self, sources : Dict[int,float], targets : Dict[int,float]) -> Tuple[float,List[int]]:
+        """Same as :func:`shortest_path` on the original graph."""
+        dist = (dict(),dict())
+        parent = (dict(),dict())
+        queues = ([],[])
+        for side,seeds in enumerate((sources,targets)):
+            for s,c in seeds.items():
+                if c < dist[side].get(s,float('inf')):
+                    dist[side][s] = c
+                    parent[side][s] = -1
+                    queues[side].append((c,s))
+            heapq.heapify(queues[side])
+        edges = (self.up_out,self.down_in)
+        #edges from more important nodes, used to skip ("stall") nodes whose
+        #distance is already known to be too large
+        stall_edges = (self.down_in,self.up_out)
+        inf = float('inf')
+        best = inf
+        meet = -1
+        while True:
+            #expand the side with the smaller tentative distance
+            top0 = queues[0][0][0] if queues[0] else inf
+            top1 = queues[1][0][0] if queues[1] else inf
+            if min(top0,top1) >= best:
+                break
+            side = 0 if top0 <= top1 else 1
+            d,u = heapq.heappop(queues[side])
+            dside = dist[side]
+            if d > dside[u]:
+                continue
+            stalled = False
+            for v,w in stall_edges[side][u]:
+                if v in dside and dside[v] + w < d:
+                    stalled = True
+                    break
+            if stalled:
+                continue
+            other = dist[1-side].get(u)
+            if other is not None and d + other < best:
+                best = d + other
+                meet = u
+            queue = queues[side]
+            pside = parent[side]
+            for v,w in edges[side][u]:
+                if d + w < dside.get(v,inf):
+                    dside[v] = d + w
+                    pside[v] = u
+                    heapq.heappush(queue,(d + w,v))
+        if meet < 0:
+            return float('inf'),[]
+        forward = [meet]
+        while parent[0][forward[-1]] >= 0:
+            forward.append(parent[0][forward[-1]])
+        forward.reverse()
+        backward = [meet]
+        while parent[1][backward[-1]] >= 0:
+            backward.append(parent[1][backward[-1]])
+        nodes = forward + backward[1:]
+        path = [nodes[0]]
+        for u,v in zip(nodes[:-1],nodes[1:]):
+            self._unpack(u,v,path)
+        return best,path
+
+    def _unpack(self, u : int, v : int, path : List[int]) -> None:
+        """Appends the original nodes after u on the edge u->v to path."""
+        stack = [(u,v)]
+        while stack:
+            a,b = stack.pop()
+            m = self.middle[(a,b)]
+            if m < 0:
+                path.append(b)
+            else:
+                stack.append((m,b))
+                stack.append((a,m))
+
+
+def _edge_arrays(edges : List[Tuple[int,int,float,int]]) -> Tuple[np.ndarray,np.ndarray,np.ndarray,np.ndarray]:
+    if len(edges) == 0:
+        return tuple(np.zeros(0,dtype=t) for t in (np.int64,np.int64,float,np.int64))
+    tails,heads,weights,middles = zip(*edges)
+    return (np.array(tails,dtype=np.int64),np.array(heads,dtype=np.int64),
+            np.array(weights,dtype=float),np.array(middles,dtype=np.int64))
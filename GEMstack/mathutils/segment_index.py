@@ -0,0 +1,123 @@
+"""Exact nearest-segment queries on polylines with many segments.
+
+Each segment is covered by sample points spaced at most ``spacing`` apart,
+which are stored in a KD-tree.  For a query point x, the segment of the
+nearest sample gives an upper bound D on the distance to the polyline, and
+any segment closer than D must have a sample within D + spacing/2 of x.
+Only the segments with samples in that ball are projected onto.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+from typing import Tuple
+
+def project_segments(x : np.ndarray, a : np.ndarray, b : np.ndarray) -> Tuple[np.ndarray,np.ndarray]:
+    """Projects the point(s) x onto the segments a[i]->b[i].  Returns the
+    distances and the segment parameters in [0,1]."""
+    v = b - a
+    vlen2 = np.einsum('ij,ij->i',v,v)
+    udotv = np.einsum('ij,ij->i',x - a,v)
+    degenerate = vlen2 <= 1e-12
+    u = np.clip(udotv/np.where(degenerate,1.0,vlen2),0.0,1.0)
+    u[degenerate] = 0.0
+    return np.linalg.norm(a + v*u[:,np.newaxis] - x,axis=1),u
+
+
+class SegmentIndex:
+    """Answers closest-point queries on the polyline through ``points``.
+
+    Results match a brute-force scan over all segments: for each query, the
+    distance and the parameter ``i+u`` of the closest point, where i is the
+    segment index and u in [0,1] the position along it.
+
+    Use :meth:`from_segments` to index segments that aren't connected.
+    """
+    def __init__(self, points : np.ndarray):
+        points = np.asarray(points,dtype=float)
+        if len(points) < 2:
+            raise ValueError("SegmentIndex needs at least 2 points")
+        self._build(points[:-1],points[1:])
+
+    @classmethod
+    def from_segments(cls, a : np.ndarray, b : np.ndarray) -> 'SegmentIndex':
+        """Indexes the segments a[i]->b[i]."""
+        a = np.asarray(a,dtype=float)
+        b = np.asarray(b,dtype=float)
+        if len(a) == 0 or a.shape != b.shape:
+            raise ValueError("SegmentIndex needs at least 1 segment, with matching endpoints")
+        index = cls.__new__(cls)
+        index._build(a,b)
+        return index
+
+    def _build(self, a : np.ndarray, b : np.ndarray) -> None:
+        self.a = a
+        self.b = b
+        seglens = np.linalg.norm(b - a,axis=1)
+        #sample spacing is about the typical segment length, but not so small
+        #that one long segment produces a huge number of samples
+        positive = seglens[seglens > 0]
+        spacing = float(np.median(positive)) if len(positive) > 0 else 1.0
+        spacing = max(spacing,float(seglens.sum())/(4*len(seglens)))
+        counts = np.maximum(np.ceil(seglens/spacing),1).astype(int)
+        self.sample_segment = np.repeat(np.arange(len(seglens)),counts)
+        #sample at the middle of each of the counts[i] pieces of segment i
+        starts = np.cumsum(counts) - counts
+        piece = np.arange(len(self.sample_segment)) - np.repeat(starts,counts)
+        u = (piece + 0.5)/counts[self.sample_segment]
+        sa = a[self.sample_segment]
+        sb = b[self.sample_segment]
+        self.samples = sa + (sb - sa)*u[:,np.newaxis]
+        #half the largest distance between neighboring samples on a segment
+        self.radius = 0.5*float(np.max(seglens/counts))
+        self.tree = cKDTree(self.samples)
+
+    def __len__(self) -> int:
+        return len(self.a)
+
+    def project(self, x, segments : np.ndarray) -> Tuple[np.ndarray,np.ndarray]:
+        """Projects x onto the given segments.  Returns the distances and
+        segment parameters in [0,1]."""
+        return project_segments(np.asarray(x,dtype=float),self.a[segments],self.b[segments])
+
+    def nearest_segments(self, x, k : int = 1) -> np.ndarray:
+        """Returns the segments of the k samples nearest to x (possibly with
+        repeats).  Not necessarily the k nearest segments."""
+        k = min(k,len(self.samples))
+        _,nearest = self.tree.query(np.asarray(x,dtype=float),k=k)
+        return self.sample_segment[np.atleast_1d(nearest)]
+
+    def segments_within(self, x, distance : float) -> np.ndarray:
+        """Returns a sorted array of all segments that may be within the given
+        distance of x.  Includes every segment that is."""
+        inds = self.tree.query_ball_point(np.asarray(x,dtype=float),distance + self.radius + 1e-9)
+        return np.unique(self.sample_segment[np.asarray(inds,dtype=int)])
+
+    def closest_point(self, x) -> Tuple[float,float]:
+        """Returns (distance, parameter) of the closest point to x."""
+        x = np.asarray(x,dtype=float)
+        bound,_ = self.project(x,self.nearest_segments(x))
+        seg = self.segments_within(x,bound[0])
+        d,u = self.project(x,seg)
+        i = int(np.argmin(d))
+        return float(d[i]),int(seg[i])+float(u[i])
+
+    def closest_points(self, xs : np.ndarray) -> Tuple[np.ndarray,np.ndarray]:
+        """Batched version of :meth:`closest_point`.  xs is an m x d array.
+        Returns arrays of m distances and m parameters."""
+        xs = np.asarray(xs,dtype=float).reshape(-1,self.a.shape[1])
+        if len(xs) == 0:
+            return np.zeros(0),np.zeros(0)
+        _,nearest = self.tree.query(xs)
+        seg = self.sample_segment[nearest]
+        bound,_ = project_segments(xs,self.a[seg],self.b[seg])
+        candidates = self.tree.query_ball_point(xs,bound + self.radius + 1e-9)
+        #flatten the (query, segment) candidate pairs and project them all at once
+        query = np.repeat(np.arange(len(xs)),[len(c) for c in candidates])
+        seg = self.sample_segment[np.concatenate(candidates).astype(int)]
+        d,u = project_segments(xs[query],self.a[seg],self.b[seg])
+        #for each query, the first segment with the minimum distance
+        order = np.lexsort((seg,d,query))
+        first = np.ones(len(order),dtype=bool)
+        first[1:] = query[order[1:]] != query[order[:-1]]
+        best = order[first]
+        return d[best],seg[best] + u[best]
@@ -1,5 +1,6 @@
 
 import numpy as np
+import functools
 from klampt.math import vectorops as vo
 from klampt.math import so2
 from typing import Tuple
@@ -72,11 +73,11 @@ def point_segment_distance(x,a,b) -> Tuple[float,float]:
     udotv = np.dot(u,v)
     if udotv < 0:
         return vector_norm(u),0
-    elif udotv > vnorm:
+    elif udotv > vnorm**2:
         return vector_norm(vector_sub(x,b)),1
     else:
-        param = udotv/vnorm
-        return vector_norm(vector_sub(u,vector_mul(v,param/vnorm))),param
+        param = udotv/vnorm**2
+        return vector_norm(vector_sub(u,vector_mul(v,param))),param
 
 def rotate2d(point, angle : float, origin=None):
     """Rotates a point about the origin by an angle"""
@@ -112,25 +113,82 @@ def yaw_to_heading(yaw : float, degrees=True) -> float:
     else:
         return np.radians(heading_degrees)
 
+class LocalTangentPlane:
+    """Converts between lat/lon and (east,north) offsets in m from an origin.
+
+    Uses the same approximation as alvinxy: meters per degree of latitude and
+    longitude are evaluated once at the origin's latitude, so conversions are
+    linear and whole arrays are converted in one NumPy call.
+    """
+    def __init__(self, lat_reference : float, lon_reference : float):
+        self.lat_reference = lat_reference
+        self.lon_reference = lon_reference
+        lat0 = np.radians(lat_reference)
+        self.m_per_deg_lat = 111132.09 - 566.05*np.cos(2.0*lat0) + 1.20*np.cos(4.0*lat0) - 0.002*np.cos(6.0*lat0)
+        self.m_per_deg_lon = 111415.13*np.cos(lat0) - 94.55*np.cos(3.0*lat0) + 0.12*np.cos(5.0*lat0)
+
+    def to_xy(self, lat, lon):
+        """Returns (x,y), where x is east in m, y is north in m.  lat and lon
+        may be arrays."""
+        return (np.subtract(lon,self.lon_reference)*self.m_per_deg_lon,
+                np.subtract(lat,self.lat_reference)*self.m_per_deg_lat)
+
+    def to_lat_lon(self, x_east, y_north):
+        """Returns (lat,lon) in degrees.  x_east and y_north may be arrays."""
+        return (np.divide(y_north,self.m_per_deg_lat) + self.lat_reference,
+                np.divide(x_east,self.m_per_deg_lon) + self.lon_reference)
+
+@functools.lru_cache(maxsize=64)
+def local_tangent_plane(lat_reference : float, lon_reference : float) -> LocalTangentPlane:
+    """Returns the (cached) LocalTangentPlane at the given origin."""
+    return LocalTangentPlane(lat_reference,lon_reference)
+
+#if not None, every lat/lon conversion is compared against alvinxy and a
+#ValueError is raised if they differ by more than this many meters
+GEODETIC_CROSS_CHECK_TOLERANCE = None
+
+def geodetic_cross_check(lat, lon, lat_reference : float, lon_reference : float) -> float:
+    """Converts lat/lon to x/y and back with both LocalTangentPlane and
+    alvinxy, and returns the largest difference, in m.  Needs alvinxy.
+    """
+    import alvinxy.alvinxy as axy
+    ltp = local_tangent_plane(lat_reference,lon_reference)
+    x,y = ltp.to_xy(lat,lon)
+    lat_back,lon_back = ltp.to_lat_lon(x,y)
+    err = 0.0
+    for i,(la,lo) in enumerate(zip(np.atleast_1d(lat),np.atleast_1d(lon))):
+        ax,ay = axy.ll2xy(la,lo,lat_reference,lon_reference)
+        alat,alon = axy.xy2ll(ax,ay,lat_reference,lon_reference)
+        err = max(err,abs(ax-np.atleast_1d(x)[i]),abs(ay-np.atleast_1d(y)[i]),
+                  abs(alat-np.atleast_1d(lat_back)[i])*ltp.m_per_deg_lat,
+                  abs(alon-np.atleast_1d(lon_back)[i])*abs(ltp.m_per_deg_lon))
+    return err
+
+def _cross_check(lat, lon, lat_reference : float, lon_reference : float):
+    err = geodetic_cross_check(lat,lon,lat_reference,lon_reference)
+    if err > GEODETIC_CROSS_CHECK_TOLERANCE:
+        raise ValueError("Geodetic conversion differs from alvinxy by %g m"%(err,))
+
 def lat_lon_to_xy(lat : float, lon : float, lat_reference : float, lon_reference : float):
     """ Conversion of Lat & Lon to X & Y.
 
-    Returns (x,y), where x is east in m, y is north in m.
+    Returns (x,y), where x is east in m, y is north in m.  lat and lon may be
+    arrays.
     """
-    import alvinxy.alvinxy as axy 
-    # convert GNSS waypoints into local fixed frame reprented in x and y
-    east_x, north_y = axy.ll2xy(lat, lon, lat_reference, lon_reference)
-    return east_x, north_y
+    if GEODETIC_CROSS_CHECK_TOLERANCE is not None:
+        _cross_check(lat,lon,lat_reference,lon_reference)
+    return local_tangent_plane(lat_reference,lon_reference).to_xy(lat,lon)
 
 def xy_to_lat_lon(x_east : float, y_north : float, lat_reference : float, lon_reference : float):
     """ Conversion of X & Y to Lat & Lon.
 
-    Returns (lat,lon), where lat and lon are in degrees.
+    Returns (lat,lon), where lat and lon are in degrees.  x_east and y_north
+    may be arrays.
     """
-    import alvinxy.alvinxy as axy 
-    # convert GNSS waypoints into local fixed frame reprented in x and y
-    lat, lon = axy.xy2ll(x_east, y_north, lat_reference, lon_reference)
-    return lat, lon
+    res = local_tangent_plane(lat_reference,lon_reference).to_lat_lon(x_east,y_north)
+    if GEODETIC_CROSS_CHECK_TOLERANCE is not None:
+        _cross_check(res[0],res[1],lat_reference,lon_reference)
+    return res
 
 def quaternion_to_euler(x : float, y : float, z : float, w : float):
     t0 = +2.0 * (w * x + y * z)
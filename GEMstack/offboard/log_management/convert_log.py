@@ -0,0 +1,61 @@
+"""Converts behavior / state logs between the JSON and binary formats.
+
+Usage::
+
+    python -m GEMstack.offboard.log_management.convert_log logs/RUN_FOLDER
+    python -m GEMstack.offboard.log_management.convert_log logs/RUN_FOLDER --to json
+    python -m GEMstack.offboard.log_management.convert_log behavior.json behavior.glog
+
+Given a log folder, behavior.json and state.json are converted to
+behavior.glog and state.glog (or back, with ``--to json``).  Files named
+state.* are assumed to be in state format, and all others in delta format.
+"""
+
+import os
+import argparse
+import time
+
+from ...state import AllState   #registers the state classes for deserialization
+from ...utils.logging import convert_logfile
+
+LOG_NAMES = ['behavior','state']
+
+def convert(src : str, dest : str, uncompressed : bool = False, chunk_size : int = 256):
+    delta_format = not os.path.basename(src).startswith('state.')
+    kwargs = {}
+    if dest.endswith('.glog'):
+        kwargs = {'compress':not uncompressed,'chunk_size':chunk_size}
+    t0 = time.time()
+    count = convert_logfile(src,dest,delta_format,**kwargs)
+    print("Converted %d messages from %s to %s in %.2fs (%.1f MB -> %.1f MB)" % (count,src,dest,time.time()-t0,
+          os.path.getsize(src)/(1024*1024),os.path.getsize(dest)/(1024*1024)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert GEMstack logs between JSON and binary formats.")
+    parser.add_argument("src", help="Log folder or log file.")
+    parser.add_argument("dest", nargs='?', default=None, help="Output log file, if src is a file.")
+    parser.add_argument("--to", choices=['binary','json'], default='binary', help="Output format, if src is a folder.")
+    parser.add_argument("--uncompressed", action='store_true', help="Don't compress binary logs.")
+    parser.add_argument("--chunk_size", type=int, default=256, help="Messages per chunk in binary logs.")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.src):
+        src_ext,dest_ext = ('.json','.glog') if args.to == 'binary' else ('.glog','.json')
+        found = False
+        for name in LOG_NAMES:
+            src = os.path.join(args.src,name+src_ext)
+            if os.path.exists(src):
+                convert(src,os.path.join(args.src,name+dest_ext),args.uncompressed,args.chunk_size)
+                found = True
+        if not found:
+            print("No %s logs found in %s" % (src_ext,args.src))
+            return 1
+    else:
+        if args.dest is None:
+            print("Need an output file")
+            return 1
+        convert(args.src,args.dest,args.uncompressed,args.chunk_size)
+    return 0
+
+if __name__ == '__main__':
+    exit(main())
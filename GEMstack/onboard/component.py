@@ -11,6 +11,11 @@ class Component:
     def state_outputs(self) -> List[str]:
         """Returns the list of AllState outputs this component generates."""
         return []
+    def trigger_inputs(self) -> List[str]:
+        """Returns a list of sensors and/or AllState items that trigger this
+        component.  If non-empty, the component is only updated when one of
+        them has new data since its last update, and no faster than rate()."""
+        return []
     def healthy(self):
         """Returns True if the element is in a stable state."""
         return True
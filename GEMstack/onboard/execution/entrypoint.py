@@ -76,6 +76,13 @@ def main():
                 print(EXECUTION_PREFIX,"Adding non-standard pipeline",k)
                 pipeline_settings[k] = v
 
+    #sensors that trigger components must be tracked before any component subscribes to them
+    component_settings = [v for s in pipeline_settings.values() for stage in ['perception','planning','other'] for v in (s.get(stage) or {}).values()]
+    component_settings += visualization_settings if isinstance(visualization_settings,list) else [visualization_settings]
+    for v in component_settings:
+        if isinstance(v,dict) and 'trigger' in v:
+            mission_executor.track_sensor_arrivals(v['trigger'] if isinstance(v['trigger'],list) else [v['trigger']])
+
     visualizers = []
     if isinstance(visualization_settings,dict):
         #one visualizer
@@ -92,7 +99,14 @@ def main():
         logfolder = replay_settings.get('log',None)
         if logfolder is not None:
             replay_components = replay_settings.get('components',[])
-            mission_executor.replay_components(replay_components,logfolder)
+            replay_speed = replay_settings.get('speed',1.0)
+            if replay_speed == 'max':
+                replay_speed = float('inf')
+            mission_executor.replay_components(replay_components,logfolder,
+                                               start=replay_settings.get('start',None),
+                                               end=replay_settings.get('end',None),
+                                               speed=replay_speed,
+                                               fields=replay_settings.get('fields',None))
 
             #TODO: ROS topic replay
             logmeta = config.load_config_recursive(os.path.join(logfolder,'meta.yaml'))
@@ -100,7 +114,7 @@ def main():
             
             #TODO: launch a roslog replay of the topics in ros_topics, disable in the vehicle interface
 
-    for (name,s) in pipeline_settings.items():
+    def make_pipeline(s):
         perception_settings = s.get('perception',{})
         planning_settings = s.get('planning',{})
         other_settings = s.get('other',{})
@@ -117,8 +131,16 @@ def main():
         for (k,v) in other_settings.items():
             if v is None: continue
             other_components[k] = mission_executor.make_component(v,k,'GEMstack.onboard.other', {'vehicle_interface':vehicle_interface})
-        
-        mission_executor.add_pipeline(name,perception_components,planning_components,other_components)
+        return perception_components,planning_components,other_components
+
+    #with lazy_pipelines, only the initial and recovery pipelines are created (and their modules imported) up front
+    lazy_pipelines = settings.get('run.lazy_pipelines',False)
+    for (name,s) in pipeline_settings.items():
+        if lazy_pipelines and name not in [mission_executor.current_pipeline,'recovery']:
+            component_names = [k for stage in ['perception','planning','other'] for k in s.get(stage,{}).keys()]
+            mission_executor.add_lazy_pipeline(name,lambda s=s:make_pipeline(s),component_names)
+        else:
+            mission_executor.add_pipeline(name,*make_pipeline(s))
 
     #configure logging
     if log_settings:
@@ -137,6 +159,8 @@ def main():
         log_topics = log_settings.get('ros_topics',[])
         rosbag_options = log_settings.get('rosbag_options','')
         mission_executor.log_ros_topics(log_topics, rosbag_options)
+        #record sensors natively
+        mission_executor.log_sensors(log_settings.get('sensors',[]))
         #determine whether to log vehicle interface
         log_vehicle_interface = log_settings.get('vehicle_interface',False)
         if log_vehicle_interface:
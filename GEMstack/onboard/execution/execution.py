@@ -5,14 +5,17 @@ from ..component import Component
 from ...utils.loops import TimedLooper
 from ...utils import settings
 from ...utils.serialization import serialize
+from ...utils.histogram import LatencyHistogram
 from .logging import LoggingManager
 import json
 import time
 import importlib
 import io
 import contextlib
+import threading
 import sys
-from typing import Dict,Tuple,Set,List,Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict,Tuple,Set,List,Optional,Callable
 
 EXECUTION_PREFIX = "Execution:"
 EXECUTION_VERBOSITY = 1
@@ -24,6 +27,11 @@ COMPONENT_SETTINGS = None
 
 LOGGING_MANAGER = None  # type: LoggingManager
 
+# Classes resolved by make_class, keyed by (module path, class name)
+COMPONENT_CLASSES = dict()  # type: Dict[Tuple[str,str],type]
+# Time taken by each import / constructor call in make_class, in order
+STARTUP_PROFILE = []  # type: List[dict]
+
 def executor_debug_print(verbosity : int, format : str, *args):
     """Top level prints. Will be printed to stdout and logged."""
     if EXECUTION_VERBOSITY >= verbosity:
@@ -90,6 +98,34 @@ def import_module_dynamic(module_name, parent_module=None):
     return importlib.import_module(full_path)
 
 
+def resolve_class(component_module, class_name, parent_module=None) -> Tuple[type,float]:
+    """Imports a class, caching the result.  Returns the class and the time
+    spent importing it, which is 0 if the module was already imported."""
+    full_path = component_module if parent_module is None else parent_module + '.' + component_module
+    key = (full_path,class_name)
+    if key in COMPONENT_CLASSES:
+        return COMPONENT_CLASSES[key],0.0
+    t0 = time.perf_counter()
+    module = import_module_dynamic(component_module,parent_module)
+    import_time = time.perf_counter() - t0
+    klass = getattr(module,class_name)
+    COMPONENT_CLASSES[key] = klass
+    return klass,import_time
+
+
+def print_startup_profile(profile : List[dict] = None):
+    """Prints the time spent importing and constructing each class made by
+    make_class, slowest first."""
+    if profile is None:
+        profile = STARTUP_PROFILE
+    if len(profile) == 0:
+        return
+    executor_debug_print(1,"{:<60} {:>9} {:>9}","Startup profile (s)","import","construct")
+    for item in sorted(profile,key=lambda x:-x['import']-x['construct']):
+        executor_debug_print(1,"{:<60} {:>9.3f} {:>9.3f}",item['module']+'.'+item['class'],item['import'],item['construct'])
+    executor_debug_print(1,"{:<60} {:>9.3f} {:>9.3f}","Total",sum(x['import'] for x in profile),sum(x['construct'] for x in profile))
+
+
 def make_class(config_info, component_module, parent_module=None, extra_args = None):
     """Creates an object from a config_info dictionary or string.
 
@@ -129,16 +165,20 @@ def make_class(config_info, component_module, parent_module=None, extra_args = N
         executor_debug_print(0,"Importing {} from {} to get {}",component_module,parent_module,class_name)
     else:
         executor_debug_print(0,"Importing {} to get {}",component_module,class_name)
-    module = import_module_dynamic(component_module,parent_module)
-    klass = getattr(module,class_name)
+    klass,import_time = resolve_class(component_module,class_name,parent_module)
+    t0 = time.perf_counter()
     try:
-        return klass(*args,**kwargs,**extra_args)
-    except TypeError:
         try:
-            return klass(*args,**kwargs)
+            return klass(*args,**kwargs,**extra_args)
         except TypeError:
-            executor_debug_print(0,"Unable to launch module {} with class {} and args {} kwargs {}",component_module,class_name,args,kwargs)
-            raise
+            try:
+                return klass(*args,**kwargs)
+            except TypeError:
+                executor_debug_print(0,"Unable to launch module {} with class {} and args {} kwargs {}",component_module,class_name,args,kwargs)
+                raise
+    finally:
+        module = component_module if parent_module is None else parent_module + '.' + component_module
+        STARTUP_PROFILE.append({'module':module,'class':class_name,'import':import_time,'construct':time.perf_counter()-t0})
 
 
 def validate_components(components : Dict[str,ComponentExecutor], provided : List = None):
@@ -185,6 +225,161 @@ def validate_components(components : Dict[str,ComponentExecutor], provided : Lis
     return list(provided)
 
 
+def component_dependencies(components : Dict[str,ComponentExecutor], order : List[str]) -> Dict[str,Set[str]]:
+    """Builds the dependency DAG between the named components, which will be
+    executed in the given order.
+
+    Component b depends on an earlier component a if b reads something that a
+    writes, a reads something that b writes, or both write the same item.
+    Components that read or write 'all' depend on everything before them.
+
+    Returns:
+        dict: maps each component name to the set of names of earlier
+        components that must finish before it can run.
+    """
+    deps = dict()
+    for i,k in enumerate(order):
+        c = components[k]
+        reads = set(c.inputs)
+        writes = set(c.output)
+        deps[k] = set()
+        for j in range(i):
+            prev = components[order[j]]
+            prev_reads = set(prev.inputs)
+            prev_writes = set(prev.output)
+            if 'all' in reads or 'all' in writes or 'all' in prev_reads or 'all' in prev_writes:
+                deps[k].add(order[j])
+            elif (reads & prev_writes) or (writes & prev_reads) or (writes & prev_writes):
+                deps[k].add(order[j])
+    return deps
+
+
+class ThreadLocalStream(io.TextIOBase):
+    """A stream that forwards writes to a per-thread target, or to the
+    fallback stream if the calling thread has not set a target.  Used in place
+    of sys.stdout / sys.stderr while components run on worker threads, since
+    contextlib.redirect_stdout is not thread safe."""
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.local = threading.local()
+
+    def target(self):
+        target = getattr(self.local,'target',None)
+        return target if target is not None else self.fallback
+
+    def write(self, s):
+        return self.target().write(s)
+
+    def flush(self):
+        self.target().flush()
+
+
+@contextlib.contextmanager
+def capture_output(f : io.StringIO, g : io.StringIO):
+    """Redirects stdout to f and stderr to g within the context.  Thread safe
+    if sys.stdout and sys.stderr are ThreadLocalStream objects."""
+    if isinstance(sys.stdout,ThreadLocalStream) and isinstance(sys.stderr,ThreadLocalStream):
+        sys.stdout.local.target = f
+        sys.stderr.local.target = g
+        try:
+            yield
+        finally:
+            sys.stdout.local.target = None
+            sys.stderr.local.target = None
+    else:
+        with contextlib.redirect_stdout(f):
+            with contextlib.redirect_stderr(g):
+                yield
+
+
+class OutputRingBuffer(io.TextIOBase):
+    """A fixed-size text buffer that component output is written into.  The
+    storage is allocated once; if more than `capacity` bytes are written
+    between drains, the oldest output is dropped and counted.  Writes and
+    drains may come from different threads."""
+    def __init__(self, capacity : int = 65536):
+        self.buffer = bytearray(capacity)
+        self.start = 0
+        self.size = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        data = s.encode('utf-8',errors='replace')
+        n = len(data)
+        capacity = len(self.buffer)
+        with self.lock:
+            if n > capacity:
+                self.dropped += n - capacity
+                data = data[n-capacity:]
+                n = capacity
+            overflow = self.size + n - capacity
+            if overflow > 0:
+                self.start = (self.start + overflow) % capacity
+                self.size -= overflow
+                self.dropped += overflow
+            end = (self.start + self.size) % capacity
+            first = min(n, capacity - end)
+            self.buffer[end:end+first] = data[:first]
+            self.buffer[:n-first] = data[first:]
+            self.size += n
+        return len(s)
+
+    def drain(self) -> str:
+        """Returns everything written since the last drain and empties the
+        buffer."""
+        with self.lock:
+            if self.size == 0 and self.dropped == 0:
+                return ''
+            end = self.start + self.size
+            if end <= len(self.buffer):
+                data = bytes(self.buffer[self.start:end])
+            else:
+                data = bytes(self.buffer[self.start:]) + bytes(self.buffer[:end-len(self.buffer)])
+            dropped = self.dropped
+            self.start = self.size = self.dropped = 0
+        text = data.decode('utf-8',errors='replace')
+        if dropped:
+            text = "[... {} bytes of output dropped ...]\n".format(dropped) + text
+        return text
+
+
+class OutputFlusher(threading.Thread):
+    """Background thread that periodically drains the output buffers of
+    components and passes the output to ComponentExecutor.log_output, so that
+    printing and writing to log files happens off the main loop.
+
+    Since output is flushed in batches, the timestamps in the component
+    stdout / stderr logs are accurate only to within `interval` seconds.
+    """
+    def __init__(self, interval : float = 0.1):
+        threading.Thread.__init__(self, name='output_flusher', daemon=True)
+        self.interval = interval
+        self.components = []   # type: List[ComponentExecutor]
+        self.stopped = threading.Event()
+
+    def add(self, c : ComponentExecutor):
+        self.components.append(c)
+
+    def flush(self):
+        for c in self.components:
+            c.log_output(c.stdout_buffer.drain(),c.stderr_buffer.drain())
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def stop(self):
+        """Stops the thread and flushes any remaining output."""
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
+
+
 class Debugger:
     """A simple debugging interface that allows components
     to send debug messages to visualizations and loggers."""
@@ -235,6 +430,18 @@ class ComponentExecutor:
         self.num_overruns = 0
         self.overrun_amount = 0.0
         self.do_update = None
+        self.wall_time = LatencyHistogram()
+        self.cpu_time = LatencyHistogram()
+        self.measure_cpu_time = True  #False if the executor records cpu_time itself
+        self.deadline_misses = 0
+        self.skipped_ticks = 0
+        self.capture = True
+        self.snapshot_inputs = False
+        self.triggers = c.trigger_inputs()
+        self.sensor_arrivals = None   # type: Optional[Dict[str,int]]
+        self.trigger_stamp = None
+        self.stdout_buffer = None     # type: Optional[OutputRingBuffer]
+        self.stderr_buffer = None     # type: Optional[OutputRingBuffer]
     
     def set_debugger(self, debugger):
         if self.do_debug:
@@ -249,13 +456,31 @@ class ComponentExecutor:
     def stop(self):
         self.c.cleanup()
 
+    def triggered(self, state : AllState) -> bool:
+        """Returns True if a trigger has new data since the last update, or if
+        the component has no triggers.  Sensors are tracked by the number of
+        readings received, and state items by their version."""
+        if not self.triggers:
+            return True
+        stamp = []
+        for name in self.triggers:
+            if self.sensor_arrivals is not None and name in self.sensor_arrivals:
+                stamp.append(self.sensor_arrivals[name])
+            else:
+                stamp.append(state.version(name))
+        if stamp == self.trigger_stamp:
+            return False
+        self.trigger_stamp = stamp
+        return True
+
     def update(self, t : float, state : AllState):
-        if self.next_update_time is None or t >= self.next_update_time:
+        if (self.next_update_time is None or t >= self.next_update_time) and self.triggered(state):
             t0 = time.time()
             self.update_now(t,state)
             t1 = time.time()
             self.last_update_time = t
-            if self.next_update_time is None:
+            if self.next_update_time is None or self.triggers:
+                #triggered components are rate limited from the time of their last update
                 self.next_update_time = t + self.dt
             else:
                 self.next_update_time += self.dt
@@ -266,38 +491,53 @@ class ComponentExecutor:
                     executor_debug_print(1,"Component {} is running behind (pushed back) overran dt {} by {} s",self.c.__class__.__name__,t1-t0,self.dt,t-self.next_update_time)
                 self.num_overruns += 1
                 self.overrun_amount += t - self.next_update_time
+                self.skipped_ticks += int((t - self.next_update_time)/self.dt) + 1
                 self.next_update_time = t + self.dt
+            if self.dt > 0 and t1 - t0 > self.dt:
+                self.deadline_misses += 1
             return True
         executor_debug_print(3,"Component {}","not updating at time {}, next update time is {}",self.c.__class__.__name__,t,self.next_update_time)
         return False
 
+    def _call_update(self, *args):
+        try:
+            if self.do_update is not None:
+                return self.do_update(*args)
+            return self.c.update(*args)
+        except Exception as e:
+            executor_debug_exception(e,"Exception in component {}: {}",self.c.__class__.__name__,e)
+            self.had_exception = True
+            return None
+
     def _do_update(self, t:float, *args):
+        if not self.capture:
+            return self._call_update(*args)
+        if self.stdout_buffer is not None:
+            #output is logged by the OutputFlusher
+            with capture_output(self.stdout_buffer,self.stderr_buffer):
+                return self._call_update(*args)
         f = io.StringIO()
         g = io.StringIO()
-        with contextlib.redirect_stdout(f):
-            with contextlib.redirect_stderr(g):
-                try:
-                    if self.do_update is not None:
-                        res = self.do_update(*args)
-                    else:
-                        res = self.c.update(*args)
-                except Exception as e:
-                    executor_debug_exception(e,"Exception in component {}: {}",self.c.__class__.__name__,e)
-                    self.had_exception = True
-                    res = None
+        with capture_output(f,g):
+            res = self._call_update(*args)
         self.log_output(f.getvalue(),g.getvalue())
         return res
 
     def update_now(self, t:float, state : AllState):
         """Performs the updates for this component, without fussing with the polling scheduling"""
         if self.inputs == ['all']:
-            args = (state,)
+            args = (state.snapshot() if self.snapshot_inputs else state,)
         else:
             args = tuple([getattr(state,i) for i in self.inputs])
         executor_debug_print(2,"Updating {}",self.c.__class__.__name__)
         #capture stdout/stderr
 
+        t0 = time.perf_counter()
+        c0 = time.thread_time()
         res = self._do_update(t, *args)
+        if self.measure_cpu_time:
+            self.cpu_time.record(time.thread_time() - c0)
+        self.wall_time.record(time.perf_counter() - t0)
         #write result to state
         if res is not None:
             if len(self.output) > 1:
@@ -309,6 +549,16 @@ class ComponentExecutor:
                 setattr(state,self.output[0],  res)
                 setattr(state,self.output[0]+'_update_time', t)
 
+    def timing_stats(self) -> dict:
+        """Returns a dict summarizing the wall-clock and CPU time spent in
+        updates, and the number of deadline misses and skipped ticks.  A deadline
+        miss is an update that took longer than 1/rate."""
+        return {'wall_time':self.wall_time.summary(),
+                'cpu_time':self.cpu_time.summary(),
+                'rate':1.0/self.dt if self.dt > 0 else None,
+                'deadline_misses':self.deadline_misses,
+                'skipped_ticks':self.skipped_ticks}
+
     def log_output(self,stdout,stderr):
         if stdout:
             lines = stdout.split('\n')
@@ -342,6 +592,7 @@ class ExecutorBase:
     def __init__(self, vehicle_interface):
         self.vehicle_interface = vehicle_interface
         self.all_components = dict()  # type: Dict[str,ComponentExecutor]
+        self.component_names = dict() # type: Dict[str,str]
         self.always_run_components = dict()      # type: Dict[str,ComponentExecutor]
         self.pipelines = dict()       # type: Dict[str,Tuple[Dict[str,ComponentExecutor],Dict[str,ComponentExecutor],Dict[str,ComponentExecutor]]]
         self.current_pipeline = 'drive'  # type: str
@@ -351,6 +602,17 @@ class ExecutorBase:
         self.debugger.add_handler(self.logging_manager)
         self.last_loop_time = time.time()
         self.last_hardware_faults = set()
+        self.num_workers = settings.get('run.parallel_workers',0)
+        self.thread_pool = None       # type: Optional[ThreadPoolExecutor]
+        self.dependencies = dict()    # type: Dict[int,Tuple[Dict[str,ComponentExecutor],List[Tuple[str,ComponentExecutor]],Dict[str,Set[str]]]]
+        self.buffered_output = settings.get('run.buffered_output',False)
+        self.output_buffer_size = settings.get('run.output_buffer_size',65536)
+        self.output_flusher = None    # type: Optional[OutputFlusher]
+        self.lazy_pipelines = dict()  # type: Dict[str,Tuple[Callable,List[str]]]
+        self.started_components = set() # type: Set[int]
+        self.sensor_arrivals = dict() # type: Dict[str,int]
+        self.trigger_sensors = set()  # type: Set[str]
+        self.trigger_event = threading.Event()
 
     def begin(self):
         """Override me to do any initialization.  The vehicle will have
@@ -372,6 +634,44 @@ class ExecutorBase:
         the vehicle is stopped."""
         pass
 
+    def make_looper(self, dt : float, name : str):
+        """Creates the looper used to time the main loop.  Override me to run
+        on a different clock, e.g., a VirtualLooper for benchmarking."""
+        return TimedLooper(dt,name=name,wake=self.trigger_event if self.trigger_sensors else None)
+
+    def track_sensor_arrivals(self, names : List[str]):
+        """Counts the readings of the named sensors in sensor_arrivals, and
+        wakes up the main loop when one arrives, so components can be
+        triggered by them.  Names that aren't sensors of the vehicle interface
+        are ignored.
+
+        Only callbacks subscribed after this call are counted, so it should
+        be called before any component that subscribes to these sensors is
+        made.  The vehicle interface's subscribe_sensor is wrapped the first
+        time a sensor is tracked; callbacks of other sensors aren't wrapped.
+        """
+        if self.vehicle_interface is None:
+            return
+        sensors = self.vehicle_interface.sensors()
+        names = [n for n in names if n in sensors and n not in self.trigger_sensors]
+        if not names:
+            return
+        if not self.trigger_sensors:
+            subscribe_sensor = self.vehicle_interface.subscribe_sensor
+            def subscribe_and_track(name, callback, type = None):
+                if name not in self.trigger_sensors:
+                    return subscribe_sensor(name, callback, type)
+                def tracked_callback(*args):
+                    res = callback(*args)
+                    self.sensor_arrivals[name] += 1
+                    self.trigger_event.set()
+                    return res
+                return subscribe_sensor(name, tracked_callback, type)
+            self.vehicle_interface.subscribe_sensor = subscribe_and_track
+        for name in names:
+            self.sensor_arrivals[name] = 0
+            self.trigger_sensors.add(name)
+
     def make_component(self, config_info, component_name, parent_module=None, extra_args = None) -> ComponentExecutor:
         """Creates a component, caching the result.  See arguments of :func:`make_class`.
 
@@ -382,6 +682,11 @@ class ExecutorBase:
         if identifier in self.all_components:
             return self.all_components[identifier]
         else:
+            triggers = None
+            if isinstance(config_info,dict) and 'trigger' in config_info:
+                triggers = config_info['trigger'] if isinstance(config_info['trigger'],list) else [config_info['trigger']]
+                #before the component is made, in case it subscribes to the sensor
+                self.track_sensor_arrivals(triggers)
             try:
                 component = make_class(config_info,component_name,parent_module,extra_args)
             except Exception as e:
@@ -395,8 +700,10 @@ class ExecutorBase:
                 component = replacement
             if isinstance(config_info,dict) and config_info.get('multiprocess',False):
                 #wrap component in a multiprocess executor.  TODO: not tested yet
+                #shared_memory gives the size of the shared memory buffers in MB, 0 to pickle everything
                 from .multiprocess_execution import MPComponentExecutor
-                executor = MPComponentExecutor(component)
+                shared_memory_size = int(config_info.get('shared_memory',0)*1024*1024)
+                executor = MPComponentExecutor(component, shared_memory_size=shared_memory_size)
             else:
                 executor = ComponentExecutor(component)
             if isinstance(config_info,dict):
@@ -405,8 +712,14 @@ class ExecutorBase:
                     executor.dt = 1.0/config_info['rate']
                 executor.print_stderr = executor.print_stdout = config_info.get('print',True)
                 executor.do_debug = config_info.get('debug',True)
+                executor.capture = config_info.get('capture',True)
+                executor.snapshot_inputs = config_info.get('snapshot',False)
+                if triggers is not None:
+                    executor.triggers = triggers
+            executor.sensor_arrivals = self.sensor_arrivals
             executor.set_debugger(self.debugger)
             self.all_components[identifier] = executor
+            self.component_names[identifier] = component_name
             return executor
     
     def always_run(self, component_name, component: ComponentExecutor):
@@ -422,6 +735,54 @@ class ExecutorBase:
         validate_components(other, output)
         self.pipelines[name] = (perception,planning,other)
 
+    def add_lazy_pipeline(self, name : str, factory : Callable, component_names : List[str] = None):
+        """Declares a pipeline whose components are only created, and whose
+        modules are only imported, when the executor first switches to it.
+        `factory()` must return the (perception, planning, other) dicts given
+        to add_pipeline.  `component_names` lists the pipeline's components,
+        which is used to check the replayed components before the pipeline
+        is created.
+        """
+        self.lazy_pipelines[name] = (factory,component_names if component_names is not None else [])
+
+    def load_pipeline(self, name : str) -> bool:
+        """Creates and starts a lazy pipeline if it hasn't been created yet.
+        Returns False if the pipeline doesn't exist or couldn't be created."""
+        if name in self.pipelines:
+            return True
+        if name not in self.lazy_pipelines:
+            return False
+        factory,_ = self.lazy_pipelines.pop(name)
+        num_profiled = len(STARTUP_PROFILE)
+        t0 = time.perf_counter()
+        try:
+            self.add_pipeline(name,*factory())
+        except Exception as e:
+            executor_debug_exception(e,"Exception raised while creating pipeline {}: {}",name,e)
+            return False
+        executor_debug_print(1,"Created pipeline {} in {:.3f}s",name,time.perf_counter()-t0)
+        print_startup_profile(STARTUP_PROFILE[num_profiled:])
+        self.start_components()
+        return True
+
+    def start_components(self):
+        """Starts the components that haven't been started yet."""
+        for c in self.all_components.values():
+            if id(c) in self.started_components:
+                continue
+            self.started_components.add(id(c))
+            c.start()
+            if self.output_flusher is not None:
+                self.capture_component_output(c)
+
+    def set_parallel(self, num_workers : int):
+        """Sets the number of worker threads used to update components.  If
+        num_workers <= 1, components are updated one after another on the main
+        thread.  Otherwise, components that don't share any AllState items are
+        updated concurrently.  See :func:`component_dependencies`.
+        """
+        self.num_workers = num_workers
+
     def set_log_folder(self,folder : str):
         self.logging_manager.set_log_folder(folder)
     
@@ -429,7 +790,9 @@ class ExecutorBase:
         """Indicates that the vehicle interface should be logged"""
         if enabled:
             logger = self.logging_manager.log_vehicle_behavior(self.vehicle_interface)
-            self.always_run('vehicle_behavior_logger',ComponentExecutor(logger))
+            executor = ComponentExecutor(logger)
+            executor.snapshot_inputs = True
+            self.always_run('vehicle_behavior_logger',executor)
         else:
             raise NotImplementedError("Disabling vehicle interface logging not supported yet")
     
@@ -440,7 +803,9 @@ class ExecutorBase:
     def log_state(self,state_attributes : List[str], rate : Optional[float]=None):
         """Indicates that the designated state attributes should be logged at the given rate."""
         logger = self.logging_manager.log_state(state_attributes,rate)
-        self.always_run('state_logger',ComponentExecutor(logger))
+        executor = ComponentExecutor(logger)
+        executor.snapshot_inputs = True
+        self.always_run('state_logger',executor)
 
     def log_ros_topics(self, topics : List[str], rosbag_options : str = '') -> Optional[str]:
         """Indicates that the designated ros topics should be logged with the given options."""
@@ -448,13 +813,23 @@ class ExecutorBase:
         if command:
             executor_debug_print(0,"Recording ROS topics with command {}",command)
 
-    def replay_components(self, replayed_components : list, replay_folder : str):
+    def log_sensors(self, sensors : List[str]):
+        """Indicates that the designated sensors should be recorded to the
+        log folder.  See :meth:`LoggingManager.log_sensors`."""
+        self.logging_manager.log_sensors(self.vehicle_interface,sensors)
+        if sensors:
+            executor_debug_print(0,"Recording sensors {}",', '.join(sensors))
+
+    def replay_components(self, replayed_components : list, replay_folder : str,
+                          start : Optional[float] = None, end : Optional[float] = None,
+                          speed : float = 1.0, fields : Optional[Dict[str,List[str]]] = None):
         """Declare that the given components should be replayed from a log folder.
 
         Further make_component calls to this component will be replaced with
-        LogReplay objects.
+        LogReplay objects.  See :meth:`LoggingManager.replay_components` for
+        the replay options.
         """
-        self.logging_manager.replay_components(replayed_components,replay_folder)
+        self.logging_manager.replay_components(replayed_components,replay_folder,start,end,speed,fields)
 
     def event(self,event_description : str, event_print_string : str = None):
         """Logs an event to the metadata and prints a message to the console."""
@@ -468,6 +843,27 @@ class ExecutorBase:
         """Sets a main loop exit reason"""
         self.logging_manager.exit_event(description)
 
+    def timing_stats(self) -> Dict[str,dict]:
+        """Returns the timing statistics of all components, indexed by
+        component name.  See :meth:`ComponentExecutor.timing_stats`."""
+        res = dict()
+        for identifier,c in self.all_components.items():
+            name = self.component_names.get(identifier,identifier)
+            if name in res:
+                name = '{} ({})'.format(name,c.c.__class__.__name__)
+            res[name] = c.timing_stats()
+        for name,c in self.always_run_components.items():
+            res[name] = c.timing_stats()
+        return res
+
+    def print_timing_stats(self):
+        stats = self.timing_stats()
+        executor_debug_print(1,"{:<30} {:>7} {:>9} {:>9} {:>9} {:>7} {:>7}","Component timing (ms)","count","p50","p99","max","missed","skipped")
+        for name,s in stats.items():
+            w = s['wall_time']
+            if w['count'] == 0: continue
+            executor_debug_print(1,"{:<30} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>7} {:>7}",name,w['count'],w['p50']*1000,w['p99']*1000,w['max']*1000,s['deadline_misses'],s['skipped_ticks'])
+
     def run(self):
         """Main entry point.  Runs the mission execution loop."""
         global LOGGING_MANAGER
@@ -488,16 +884,29 @@ class ExecutorBase:
                 if c in perception_components or c in planning_components or c in other_components:
                     found = True
                     break
+            for (name,(factory,component_names)) in self.lazy_pipelines.items():
+                if c in component_names:
+                    found = True
+                    break
             if not found:
                 raise ValueError("Replay component",c,"not found in any pipeline")
 
+        print_startup_profile()
+
         #start running components
-        for k,c in self.all_components.items():
-            c.start()
+        self.start_components()
+        if self.trigger_sensors:
+            executor_debug_print(1,"Sensors {} trigger component updates",', '.join(sorted(self.trigger_sensors)))
+        if self.num_workers is not None and self.num_workers > 1:
+            executor_debug_print(1,"Updating components with {} worker threads",self.num_workers)
+            self.thread_pool = ThreadPoolExecutor(self.num_workers,thread_name_prefix='component')
+        if self.buffered_output:
+            self.start_output_flusher()
 
         #start running mission
         self.state = AllState.zero()
         self.state.mission.type = MissionEnum.IDLE
+        self.state.touch('mission')
         
         validated = False
         try:
@@ -524,7 +933,7 @@ class ExecutorBase:
                         #done
                         self.set_exit_reason("normal exit")
                         break
-                    if next not in self.pipelines:
+                    if not self.load_pipeline(next):
                         executor_debug_print(1,"Pipeline {} not found, switching to recovery",next)
                         next = 'recovery'
                     if self.current_pipeline == 'recovery' and next == 'recovery':
@@ -557,12 +966,50 @@ class ExecutorBase:
         #cleanup, whether validated or not
 
         for k,c in self.all_components.items():
+            if id(c) not in self.started_components:
+                continue
             executor_debug_print(2,"Stopping",k)
             c.stop()
-        
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown()
+            self.thread_pool = None
+        if self.output_flusher is not None:
+            self.stop_output_flusher()
+
+        self.print_timing_stats()
+        self.logging_manager.log_timing_stats(self.timing_stats())
+        self.logging_manager.log_startup_profile(STARTUP_PROFILE)
         self.logging_manager.close()
         executor_debug_print(0,"Done with execution loop")
 
+    def start_output_flusher(self):
+        """Gives each capturing component its own output buffers, installs
+        ThreadLocalStreams as sys.stdout / sys.stderr for the rest of the run,
+        and starts the background flusher."""
+        self.output_flusher = OutputFlusher()
+        components = list(self.all_components.values()) + [c for c in self.always_run_components.values() if c not in self.all_components.values()]
+        for c in components:
+            self.capture_component_output(c)
+        self.saved_streams = (sys.stdout,sys.stderr)
+        sys.stdout,sys.stderr = ThreadLocalStream(sys.stdout),ThreadLocalStream(sys.stderr)
+        self.output_flusher.start()
+
+    def capture_component_output(self, c : ComponentExecutor):
+        if not c.capture or c.stdout_buffer is not None:
+            return
+        c.stdout_buffer = OutputRingBuffer(self.output_buffer_size)
+        c.stderr_buffer = OutputRingBuffer(self.output_buffer_size)
+        self.output_flusher.add(c)
+
+    def stop_output_flusher(self):
+        """Flushes remaining component output and restores sys.stdout /
+        sys.stderr."""
+        self.output_flusher.stop()
+        for c in self.output_flusher.components:
+            c.stdout_buffer = c.stderr_buffer = None
+        sys.stdout,sys.stderr = self.saved_streams
+        self.output_flusher = None
+
     def check_for_hardware_faults(self):
         """Handles vehicle fault checking / logging"""
         faults = self.vehicle_interface.hardware_faults()
@@ -597,7 +1044,7 @@ class ExecutorBase:
             return True
         components = list(perception_components.values()) + list(self.always_run_components.values())
         dt_min = min([c.dt for c in components if c.dt != 0.0])
-        looper = TimedLooper(dt_min,name="main executor")
+        looper = self.make_looper(dt_min,"main executor")
         sensors_working = False
         num_attempts = 0
         t0 = time.time()
@@ -630,11 +1077,12 @@ class ExecutorBase:
         """Runs a pipeline until a switch is requested."""
         if self.current_pipeline == 'recovery':        
             self.state.mission.type = MissionEnum.RECOVERY_STOP
+            self.state.touch('mission')
         
         (perception_components,planning_components,other_components) = self.pipelines[self.current_pipeline]
         components = list(perception_components.values()) + list(planning_components.values()) + list(other_components.values()) + list(self.always_run_components.values())
         dt_min = min([c.dt for c in components if c.dt != 0.0])
-        looper = TimedLooper(dt_min,name="main executor")
+        looper = self.make_looper(dt_min,"main executor")
         while looper and not self.done():
             self.state.t = self.vehicle_interface.time()
             self.logging_manager.set_vehicle_time(self.state.t)
@@ -707,6 +1155,9 @@ class ExecutorBase:
             for k in COMPONENT_ORDER:
                 if k in components:
                     order.append(k)
+        if self.thread_pool is not None and len(order) > 1:
+            self.update_components_parallel(components, order, state, now)
+            return
         for k in order:
             updated = False
             if now:
@@ -718,6 +1169,45 @@ class ExecutorBase:
             if updated:
                 self.logging_manager.log_component_update(k, state, components[k].output)
 
+    def update_components_parallel(self, components : Dict[str,ComponentExecutor], order : List[str], state : AllState, now = False):
+        """Updates the components on the thread pool, respecting the
+        dependencies between them.  Components are submitted in order, and each
+        one waits for the components it depends on, so a component is never
+        blocked by a later one.  Logging is performed on the calling thread
+        in the given order once all updates are done.
+        """
+        #the cache holds on to the dict itself, so that a new one can't get
+        #the same id once the old one is freed
+        entries = [(k,components[k]) for k in order]
+        cached = self.dependencies.get(id(components))
+        if cached is None or cached[0] is not components or cached[1] != entries:
+            cached = (components, entries, component_dependencies(components, order))
+            self.dependencies[id(components)] = cached
+        deps = cached[2]
+        t = state.t
+
+        def run_component(k, waits):
+            for w in waits:
+                w.result()
+            if now:
+                components[k].update_now(t,state)
+                return True
+            return components[k].update(t,state)
+
+        stdout,stderr = sys.stdout,sys.stderr
+        if not isinstance(stdout,ThreadLocalStream):
+            sys.stdout,sys.stderr = ThreadLocalStream(stdout),ThreadLocalStream(stderr)
+        try:
+            futures = dict()
+            for k in order:
+                futures[k] = self.thread_pool.submit(run_component, k, [futures[d] for d in deps[k]])
+            updated = dict((k,futures[k].result()) for k in order)
+        finally:
+            sys.stdout,sys.stderr = stdout,stderr
+        for k in order:
+            if updated[k]:
+                self.logging_manager.log_component_update(k, state, components[k].output)
+
 
 class StandardExecutor(ExecutorBase):
     def __init__(self, vehicle_interface):
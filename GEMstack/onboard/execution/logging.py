@@ -1,14 +1,227 @@
 from __future__ import annotations
 from ..component import Component
 from ...utils import serialization,logging,config,settings
-from typing import List,Optional,Dict,Set,Any
+from ...utils.sensor_log import SensorLogWriter
+from ...state import AllState
+from typing import List,Optional,Dict,Set,Any,Callable
+from dataclasses import fields
 import time
 import datetime
 import os
+import copy
+import collections
+import threading
 import subprocess
 import numpy as np
 import cv2
 
+class LogWriter(threading.Thread):
+    """Performs file writes for the LoggingManager on a background thread, so
+    that a slow disk doesn't stretch the executor's loop.
+
+    Writes are submitted as jobs, which are run in order.  At most `max_queue`
+    jobs may be pending.  When the queue is full, `policy` decides what happens:
+
+    - 'block': the caller waits until there is room.
+    - 'drop_oldest': the oldest droppable job is discarded.
+    - 'drop_debug': new debug jobs are discarded, and other jobs displace the
+      oldest pending debug job (or wait, if there is none).
+
+    Files that jobs write to are flushed and fsync'ed together at most every
+    `fsync_interval` seconds.
+
+    If the thread isn't running (not started, or stopped), jobs are run
+    immediately on the caller's thread.
+    """
+    POLICIES = ['block','drop_oldest','drop_debug']
+
+    def __init__(self, max_queue : int = 1000, policy : str = 'block', fsync_interval : float = 1.0):
+        threading.Thread.__init__(self,name='LogWriter',daemon=True)
+        if policy not in LogWriter.POLICIES:
+            raise ValueError("Invalid log writer policy {}, must be one of {}".format(policy,LogWriter.POLICIES))
+        self.max_queue = max_queue
+        self.policy = policy
+        self.fsync_interval = fsync_interval
+        self.queue = collections.deque()  # type: collections.deque
+        self.pending_keys = dict()        # type: Dict[str,list]
+        self.dirty_files = set()
+        self.cond = threading.Condition()
+        self.stopping = False
+        self.start_time = None
+        self.last_sync_time = None
+        self.jobs = 0
+        self.dropped = 0
+        self.errors = 0
+        self.bytes_written = 0
+        self.max_queue_depth = 0
+        self.syncs = 0
+
+    def submit(self, fn : Callable, *args, debug : bool = False, file = None, key : str = None, droppable : bool = True) -> bool:
+        """Queues a call fn(*args).  Returns False if it was dropped.
+
+        Arguments:
+            debug: whether this is a debug write, which the 'drop_debug'
+                policy may discard.
+            file: the file object that the job writes to.  It will be synced,
+                and if fn doesn't return the number of bytes written, the
+                change in file position is counted instead.
+            key: if given and a job with the same key is still pending, that
+                job's arguments are replaced instead of queuing a new job.
+                Keyed jobs are never dropped.
+            droppable: if False, the job is never dropped.
+        """
+        job = [fn,args,debug,file,droppable and key is None]
+        with self.cond:
+            if self.is_alive() and not self.stopping:
+                if key is not None and key in self.pending_keys:
+                    self.pending_keys[key][1] = args
+                    return True
+                while len(self.queue) >= self.max_queue:
+                    if self.policy == 'drop_debug' and debug:
+                        self.dropped += 1
+                        return False
+                    victim = None
+                    if self.policy == 'drop_oldest':
+                        victim = next((j for j in self.queue if j[4]),None)
+                    elif self.policy == 'drop_debug':
+                        victim = next((j for j in self.queue if j[2] and j[4]),None)
+                    if victim is None:
+                        self.cond.wait()
+                        if not self.is_alive() or self.stopping:
+                            break
+                    else:
+                        self.queue.remove(victim)
+                        self.dropped += 1
+                else:
+                    self.queue.append(job)
+                    if key is not None:
+                        self.pending_keys[key] = job
+                    self.max_queue_depth = max(self.max_queue_depth,len(self.queue))
+                    self.cond.notify_all()
+                    return True
+        self.run_job(job)
+        return True
+
+    def run_job(self, job : list) -> None:
+        fn,args,debug,file,droppable = job
+        try:
+            pos = file.tell() if file is not None else None
+            nbytes = fn(*args)
+            if nbytes is None and file is not None:
+                nbytes = file.tell() - pos
+        except Exception as e:
+            self.errors += 1
+            print("LogWriter: error writing log:",e)
+            return
+        self.jobs += 1
+        if nbytes:
+            self.bytes_written += nbytes
+        if file is not None:
+            self.dirty_files.add(file)
+
+    def sync(self) -> None:
+        """Flushes and fsyncs all files written since the last sync."""
+        for f in self.dirty_files:
+            try:
+                f.flush()
+                os.fsync(f.fileno())
+            except (ValueError,OSError):
+                #file was closed or isn't a disk file
+                pass
+        self.dirty_files = set()
+        self.last_sync_time = time.time()
+        self.syncs += 1
+
+    def sync_and_close(self, f, closer : Callable = None) -> None:
+        """Syncs the file object f and then closes it with closer() (by
+        default, f.close())."""
+        if f in self.dirty_files:
+            try:
+                f.flush()
+                os.fsync(f.fileno())
+            except (ValueError,OSError):
+                pass
+            self.dirty_files.discard(f)
+        (closer or f.close)()
+
+    def start(self):
+        self.start_time = time.time()
+        self.last_sync_time = self.start_time
+        threading.Thread.start(self)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while len(self.queue) == 0 and not self.stopping:
+                    if self.dirty_files:
+                        remaining = self.last_sync_time + self.fsync_interval - time.time()
+                        if remaining <= 0:
+                            break
+                        self.cond.wait(remaining)
+                    else:
+                        self.cond.wait()
+                batch = list(self.queue)
+                self.queue.clear()
+                self.pending_keys = dict()
+                stopping = self.stopping
+                self.cond.notify_all()
+            for job in batch:
+                self.run_job(job)
+            if self.dirty_files and (stopping or time.time() - self.last_sync_time >= self.fsync_interval):
+                self.sync()
+            if stopping and len(batch) == 0:
+                return
+
+    def stop(self) -> None:
+        """Writes all pending jobs, syncs, and stops the thread."""
+        if not self.is_alive():
+            return
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        self.join()
+
+    def queue_depth(self) -> int:
+        return len(self.queue)
+
+    def stats(self) -> dict:
+        """Returns a dict with the current and maximum queue depth, number of
+        jobs written and dropped, bytes written, and bytes per second since
+        the thread was started."""
+        duration = time.time() - self.start_time if self.start_time is not None else 0
+        return {'policy':self.policy,
+                'queue_depth':len(self.queue),
+                'max_queue_depth':self.max_queue_depth,
+                'jobs':self.jobs,
+                'dropped':self.dropped,
+                'errors':self.errors,
+                'syncs':self.syncs,
+                'bytes_written':self.bytes_written,
+                'bytes_per_second':self.bytes_written / duration if duration > 0 else 0.0}
+
+
+def save_debug_array(filename : str, value) -> int:
+    os.makedirs(os.path.dirname(filename),exist_ok=True)
+    np.savez(filename,value)
+    return os.path.getsize(filename)
+
+def save_debug_image(filename : str, value) -> int:
+    os.makedirs(os.path.dirname(filename),exist_ok=True)
+    cv2.imwrite(filename,value)
+    return os.path.getsize(filename)
+
+def save_metadata(filename : str, metadata : dict) -> int:
+    config.save_config(filename,metadata)
+    return os.path.getsize(filename)
+
+
+# Sensors that can be recorded by LoggingManager.log_sensors, and the type
+# to subscribe to them with
+SENSOR_RECORDING_TYPES = {'top_lidar':np.ndarray,
+                          'front_camera':cv2.Mat,
+                          'front_depth':cv2.Mat}
+
+
 class LoggingManager:
     """A top level manager of the logging process.  This is responsible for
     creating log folders, log metadata files, and for replaying components from log
@@ -16,10 +229,12 @@ class LoggingManager:
     def __init__(self):
         self.log_folder = None        # type: Optional[str]
         self.replayed_components = dict()  # type Dict[str,str]
+        self.replay_options = dict()       # type: Dict[str,Any]
         self.logged_components = set() # type: Set[str]
         self.component_output_loggers = dict() # type: Dict[str,list]
         self.behavior_log = None
         self.rosbag_process = None
+        self.sensor_recorders = dict() # type: Dict[str,SensorLogWriter]
         self.run_metadata = dict()    # type: dict
         self.run_metadata['pipelines'] = []
         self.run_metadata['events'] = []
@@ -27,12 +242,18 @@ class LoggingManager:
         self.vehicle_time = None
         self.start_vehicle_time = None
         self.debug_messages = {}
+        self.log_format = settings.get('run.log.format','json')
+        self.writer = LogWriter(settings.get('run.log.queue_size',1000),
+                                settings.get('run.log.backpressure','block'),
+                                settings.get('run.log.fsync_interval',1.0))
 
     def logging(self) -> bool:
         return self.log_folder is not None
 
     def set_log_folder(self, folder : str) -> None:
         self.log_folder = folder
+        if settings.get('run.log.async',True) and not self.writer.is_alive():
+            self.writer.start()
 
         #save settings.yaml
         config.save_config(os.path.join(folder,'settings.yaml'),settings.settings())
@@ -47,22 +268,15 @@ class LoggingManager:
         self.run_metadata['git_branch'] = git_branch.decode('utf-8').strip()
         self.dump_log_metadata()
     
-    def close(self):
-        if self.behavior_log is not None:
-            self.behavior_log.close()
-            self.behavior_log = None
-        for k,(stdout,stderr) in self.component_output_loggers.items():
-            if stdout is not None:
-                stdout.close()
-            if stderr is not None:
-                stderr.close()
-        self.component_output_loggers = dict()
-    
-    def replay_components(self, replayed_components : list, replay_folder : str):
+    def replay_components(self, replayed_components : list, replay_folder : str,
+                          start : Optional[float] = None, end : Optional[float] = None,
+                          speed : float = 1.0, fields : Optional[Dict[str,List[str]]] = None):
         """Declare that the given components should be replayed from a log folder.
 
         Further make_component calls to this component will be replaced with
-        LogReplay objects.
+        LogReplay objects.  `start`, `end`, and `speed` are passed to
+        LogReplay (as `speed_multiplier`).  If `fields` maps a component to a
+        list of its outputs, only those outputs are replayed.
         """
         #sanity check: was this item logged?
         settings = config.load_config_recursive(os.path.join(replay_folder,'settings.yaml'))
@@ -74,24 +288,41 @@ class LoggingManager:
             if c not in logged_components:
                 raise ValueError("Replay component",c,"was not logged in",replay_folder,"(see settings.yaml)")
             self.replayed_components[c] = replay_folder
+        self.replay_options = {'start':start,'end':end,'speed':speed,'fields':fields or {}}
     
     def component_replayer(self, component_name : str, component : Component) -> Optional[LogReplay]:
         if component_name in self.replayed_components:
             #replace behavior of class with the LogReplay class
             replay_folder = self.replayed_components[component_name]
             outputs = component.state_outputs()
+            fields = self.replay_options['fields'].get(component_name,None)
+            if fields is not None:
+                for f in fields:
+                    if f not in outputs:
+                        raise ValueError("Replay field",f,"is not an output of component",component_name)
+                outputs = [o for o in outputs if o in fields]
             rate = component.rate()
             assert rate is not None and rate > 0, "Replayed component {} must have a positive rate".format(component_name)
-            return LogReplay(outputs,
-                                os.path.join(replay_folder,'behavior_log.json'),
-                                rate=rate)
+            speed = self.replay_options['speed']
+            if speed == float('inf'):
+                #update on every loop
+                rate = None
+            log_file = os.path.join(replay_folder,'behavior.glog')
+            if not os.path.exists(log_file):
+                log_file = os.path.join(replay_folder,'behavior.json')
+            return LogReplay(getattr(component,'vehicle_interface',None),
+                                outputs,
+                                log_file,
+                                rate=rate,
+                                speed_multiplier=speed,
+                                start=self.replay_options['start'],
+                                end=self.replay_options['end'])
         return None
 
     def dump_log_metadata(self):
         if not self.log_folder:
             return
-        from ...utils import config
-        config.save_config(os.path.join(self.log_folder,'meta.yaml'),self.run_metadata)
+        self.writer.submit(save_metadata,os.path.join(self.log_folder,'meta.yaml'),copy.deepcopy(self.run_metadata),key='meta')
 
     def load_log_metadata(self):
         if not self.log_folder:
@@ -105,18 +336,24 @@ class LoggingManager:
     def component_stderr_file(self,component_name : str) -> str:
         return os.path.join(self.log_folder,component_name+'.stderr.log')
 
+    def log_file(self, name : str) -> str:
+        """Returns the path of the log file with the given base name, with an
+        extension given by the run.log.format setting ('json' or 'binary')."""
+        return os.path.join(self.log_folder,name+('.glog' if self.log_format == 'binary' else '.json'))
+
     def log_vehicle_behavior(self,vehicle_interface) -> VehicleBehaviorLogger:
         if not self.log_folder:
             return
         if self.behavior_log is None:
-            self.behavior_log = logging.Logfile(os.path.join(self.log_folder,'behavior.json'),delta_format=True,mode='w')
-        return VehicleBehaviorLogger(self.behavior_log,vehicle_interface)
+            self.behavior_log = logging.open_logfile(self.log_file('behavior'),delta_format=True,mode='w')
+        return VehicleBehaviorLogger(self.behavior_log,vehicle_interface,self.writer)
     
     def log_state(self,state_attributes : List[str], rate : Optional[float]=None) -> AllStateLogger:
         if not self.log_folder:
             return
-        log_fn = os.path.join(self.log_folder,'state.json')
-        return AllStateLogger(state_attributes,rate,log_fn)
+        log_fn = self.log_file('state')
+        keyframe_interval = settings.get('run.log.state_keyframe_interval',10.0)
+        return AllStateLogger(state_attributes,rate,log_fn,self.writer,keyframe_interval)
 
     def log_components(self,components : List[str]) -> None:
         """Indicate that the state output of these components should be logged"""
@@ -124,7 +361,7 @@ class LoggingManager:
             return
         if components:
             if self.behavior_log is None:
-                self.behavior_log = logging.Logfile(os.path.join(self.log_folder,'behavior.json'),delta_format=True,mode='w')
+                self.behavior_log = logging.open_logfile(self.log_file('behavior'),delta_format=True,mode='w')
         self.logged_components = set(components)
 
     def log_ros_topics(self, topics : List[str], rosbag_options : str = '') -> Optional[str]:
@@ -136,6 +373,24 @@ class LoggingManager:
             return ' '.join(command)
         return None
 
+    def log_sensors(self, vehicle_interface, sensors : List[str]) -> None:
+        """Records the given array-valued sensors (point clouds, images) to
+        the sensors/ subfolder of the log folder, without going through ROS.
+        Read the recording with utils.sensor_log.open_sensor_log."""
+        if not self.log_folder:
+            return
+        chunk_bytes = int(settings.get('run.log.sensor_chunk_mb',256)*1024*1024)
+        for name in sensors:
+            if name not in SENSOR_RECORDING_TYPES:
+                raise ValueError("Can't record sensor {}, only {} can be recorded".format(name,list(SENSOR_RECORDING_TYPES.keys())))
+            if name in self.sensor_recorders:
+                continue
+            recorder = SensorLogWriter(os.path.join(self.log_folder,'sensors',name),chunk_bytes)
+            self.sensor_recorders[name] = recorder
+            def record(frame, recorder=recorder):
+                recorder.write(vehicle_interface.time(),frame)
+            vehicle_interface.subscribe_sensor(name,record,SENSOR_RECORDING_TYPES[name])
+
     def set_vehicle_time(self, vehicle_time : float) -> None:
         self.vehicle_time = vehicle_time
         if self.start_vehicle_time is None:
@@ -163,17 +418,17 @@ class LoggingManager:
             folder = os.path.join(self.log_folder,'debug_{}'.format(component))
             if item not in self.debug_messages[component]:
                 self.debug_messages[component][item] = []
-                os.mkdir(folder)
             filename = os.path.join(folder,item+'_%03d.npz'%len(self.debug_messages[component][item]))
-            np.savez(filename,value)
+            self.debug_messages[component][item].append((time.time(),self.vehicle_time-self.start_vehicle_time,os.path.basename(filename)))
+            self.writer.submit(save_debug_array,filename,value.copy(),debug=True)
         elif isinstance(value,cv2.Mat):
             #if really large, save as png
             folder = os.path.join(self.log_folder,'debug_{}'.format(component))
             if item not in self.debug_messages[component]:
                 self.debug_messages[component][item] = []
-                os.mkdir(folder)
             filename = os.path.join(folder,item+'_%03d.png'%len(self.debug_messages[component][item]))
-            cv2.imwrite(filename,value)
+            self.debug_messages[component][item].append((time.time(),self.vehicle_time-self.start_vehicle_time,os.path.basename(filename)))
+            self.writer.submit(save_debug_image,filename,value.copy(),debug=True)
         else:
             if item not in self.debug_messages[component]:
                 self.debug_messages[component][item] = []
@@ -223,6 +478,19 @@ class LoggingManager:
                                 row.append('')
                     f.write(','.join(row)+'\n')
 
+    def log_timing_stats(self, stats : Dict[str,dict]) -> None:
+        """Saves per-component timing statistics to timing.yaml."""
+        if not self.log_folder:
+            return
+        config.save_config(os.path.join(self.log_folder,'timing.yaml'),stats)
+
+    def log_startup_profile(self, profile : List[dict]) -> None:
+        """Saves the time spent importing and constructing components to
+        startup.yaml."""
+        if not self.log_folder:
+            return
+        config.save_config(os.path.join(self.log_folder,'startup.yaml'),profile)
+
     def pipeline_start_event(self, pipeline_name : str) -> None:
         """Logs a pipeline start event to the metadata."""
         self.run_metadata['pipelines'].append({'time':time.time(),'vehicle_time':self.vehicle_time,'name':pipeline_name})
@@ -238,7 +506,10 @@ class LoggingManager:
     def log_component_update(self, component : str, state : Any, outputs : List[str]) -> None:
          """Component update"""
          if component in self.logged_components and len(outputs)!=0:
-            self.behavior_log.log(state, outputs, self.vehicle_time)
+            message = {k:getattr(state,k) for k in outputs}
+            #encode now, since the pipeline may modify the outputs before the writer gets to them
+            message = self.behavior_log.encode(message, None, self.vehicle_time)
+            self.writer.submit(self.behavior_log.log_encoded, message, file=self.behavior_log.file)
     
     def log_component_stdout(self, component : str, msg : List[str]) -> None:
         if not self.log_folder:
@@ -248,8 +519,8 @@ class LoggingManager:
         if self.component_output_loggers[component][0] is None:
             self.component_output_loggers[component][0] = open(self.component_stdout_file(component),'w')
         timestr = datetime.datetime.fromtimestamp(self.vehicle_time).strftime("%H:%M:%S.%f")[:-3]
-        for l in msg:
-            self.component_output_loggers[component][0].write(timestr + ': ' + l + '\n')
+        f = self.component_output_loggers[component][0]
+        self.writer.submit(f.write,''.join(timestr + ': ' + l + '\n' for l in msg),file=f)
 
     def log_component_stderr(self, component : str, msg : List[str]) -> None:
         if not self.log_folder:
@@ -259,12 +530,37 @@ class LoggingManager:
         if self.component_output_loggers[component][1] is None:
             self.component_output_loggers[component][1] = open(self.component_stderr_file(component),'w')
         timestr = datetime.datetime.fromtimestamp(self.vehicle_time).strftime("%H:%M:%S.%f")[:-3]
-        for l in msg:
-            self.component_output_loggers[component][1].write(timestr + ': ' + l + '\n')
+        f = self.component_output_loggers[component][1]
+        self.writer.submit(f.write,''.join(timestr + ': ' + l + '\n' for l in msg),file=f)
+
+    def writer_stats(self) -> dict:
+        """Returns the queue depth and throughput of the background writer.
+        See :meth:`LogWriter.stats`."""
+        return self.writer.stats()
 
     def close(self):
         self.dump_debug()
         self.debug_messages = {}
+        if self.writer.is_alive():
+            self.writer.stop()
+            stats = self.writer.stats()
+            print("Log writer: {} writes, {} dropped, {:.1f} MB at {:.1f} KB/s, max queue depth {}".format(
+                  stats['jobs'],stats['dropped'],stats['bytes_written']/(1024*1024),stats['bytes_per_second']/1024,stats['max_queue_depth']))
+            self.run_metadata['log_writer'] = stats
+            self.dump_log_metadata()
+        if self.behavior_log is not None:
+            self.behavior_log.close()
+            self.behavior_log = None
+        for k,recorder in self.sensor_recorders.items():
+            recorder.close()
+            print("Recorded {} frames ({:.1f} MB) from sensor {}".format(recorder.frames,recorder.bytes_written/(1024*1024),k))
+        self.sensor_recorders = dict()
+        for k,(stdout,stderr) in self.component_output_loggers.items():
+            if stdout is not None:
+                stdout.close()
+            if stderr is not None:
+                stderr.close()
+        self.component_output_loggers = dict()
         if self.rosbag_process is not None:
             out,err = self.rosbag_process.communicate()  # Will block 
             print('-------------------------------------------')
@@ -291,19 +587,32 @@ class LogReplay(Component):
     ``{ITEM1:VAL, ITEM2:VAL, ITEM1_update_time:t, ITEM2_update_time:t}``.
     
     If the `delta_format` attribute is True, then the delta format is assumed.
+
+    If `start` is given, replay jumps to `start` seconds after the start of the
+    log, and the first update outputs the items as of that time.  If `end` is
+    given, replay stops `end` seconds after the start of the log.  Log time
+    advances `speed_multiplier` times as fast as vehicle time.  If
+    `speed_multiplier` is inf, each update replays the next logged message,
+    i.e., replay runs as fast as the component is updated.
     """
     def __init__(self, vehicle_interface, outputs : List[str],
                  log_file : str,
                  delta_format=True,
                  rate : float = 10.0,
-                 speed_multiplier : float = 1.0):
+                 speed_multiplier : float = 1.0,
+                 start : Optional[float] = None,
+                 end : Optional[float] = None):
         self.vehicle_interface = vehicle_interface
         self.outputs = outputs
         self.logfn = log_file
         self._rate = rate
         self.speed_multiplier = speed_multiplier
-        self.logfile = logging.Logfile(log_file,delta_format,'r')
+        self.start = start
+        self.end = end
+        self.logfile = logging.open_logfile(log_file,delta_format,'r',items=outputs)
         self.start_time = None
+        self.log_start_time = None
+        self.done = False
     
     def rate(self):
         return self._rate
@@ -311,24 +620,47 @@ class LogReplay(Component):
     def state_outputs(self):
         return self.outputs
 
+    def output_values(self, items : dict):
+        #convert the dict to a list of values in the same order as self.outputs
+        res = [items.get(o,None) for o in self.outputs]
+        if len(self.outputs)==1:
+            return res[0]
+        if all(v is None for v in res):
+            return None
+        return res
+
     def update(self):
-        t = self.vehicle_interface.time()
-        if self.start_time == None:
-            self.start_time = t
+        t = self.vehicle_interface.time() if self.vehicle_interface is not None else time.time()
         if not self.logfile:
             return
+        if self.start_time == None:
+            self.start_time = t
+            if self.start is not None:
+                self.log_start_time = self.logfile.time_range()[0] + self.start
+                return self.output_values(self.logfile.seek(self.log_start_time))
+            self.logfile.read(duration_to_advance=0)
+            self.log_start_time = self.logfile.start_time
+            if self.log_start_time is None:
+                self.done = True
+        if self.done:
+            return None
 
-        res,msgs = self.logfile.read(duration_from_start = (t - self.start_time)*self.speed_multiplier, cumulative = True)
+        if self.speed_multiplier == float('inf'):
+            if self.logfile.eof:
+                self.done = True
+                return None
+            #read all messages at the time of the next message
+            next_t = float(np.nextafter(self.logfile.next_item_time,np.inf))
+        else:
+            next_t = self.log_start_time + (t - self.start_time)*self.speed_multiplier
+        if self.end is not None and next_t > self.logfile.start_time + self.end:
+            next_t = max(self.logfile.start_time + self.end,self.logfile.time_index)
+            self.done = True
+        res,msgs = self.logfile.read(absolute_time = next_t, cumulative = True)
         #if nothing new was read, just return None
         if len(msgs)==0:
             return None
-        #convert the dict to a list of values in the same order as self.outputs
-        res = [res.get(o,None) for o in self.outputs]
-        if len(self.outputs)==1:
-            return res[0]
-        if all(v is None for v in res):
-            return None
-        return res
+        return self.output_values(res)
 
     def cleanup(self):
         self.logfile.close()
@@ -336,11 +668,12 @@ class LogReplay(Component):
 
 
 class VehicleBehaviorLogger(Component):
-    def __init__(self,behavior_log, vehicle_interface):
+    def __init__(self,behavior_log, vehicle_interface, writer : LogWriter = None):
         if isinstance(behavior_log,str):
-            behavior_log = logging.Logfile(behavior_log,delta_format=True,mode='w')
+            behavior_log = logging.open_logfile(behavior_log,delta_format=True,mode='w')
         self.behavior_log = behavior_log
         self.vehicle_interface = vehicle_interface
+        self.writer = writer if writer is not None else LogWriter()
         self.vehicle_log_t_last = None
 
     def rate(self):
@@ -356,15 +689,32 @@ class VehicleBehaviorLogger(Component):
         if state.t != self.vehicle_log_t_last:
             collection = {'vehicle_interface_command':self.vehicle_interface.last_command,
                         'vehicle_interface_reading':self.vehicle_interface.last_reading}
-            self.behavior_log.log(collection,t=state.t)
+            message = self.behavior_log.encode(collection,None,state.t)
+            self.writer.submit(self.behavior_log.log_encoded,message,file=self.behavior_log.file)
             self.vehicle_log_t_last = state.t
 
 
 class AllStateLogger(Component):
-    def __init__(self,attributes,rate,log_fn):   
+    """Logs the given state attributes in state format, encoded as keyframes
+    and deltas.
+
+    A keyframe line contains all of the attributes, plus the key
+    ``logging.KEYFRAME_KEY`` giving the state time.  Other lines only contain
+    the attributes that changed since the last logged line, i.e., whose
+    ``*_update_time`` stamp or AllState version changed.  A keyframe is
+    written first and then every `keyframe_interval` seconds, so a reader can
+    reconstruct the state at any time from the nearest keyframe (see
+    :meth:`Logfile.seek` and :meth:`BinaryLogfile.seek`).  If `keyframe_interval` is None, only the first
+    line is a keyframe.
+    """
+    def __init__(self,attributes,rate,log_fn,writer : LogWriter = None, keyframe_interval : Optional[float] = None):
         self._rate = rate     
         self.attributes = attributes
-        self.state_log = logging.Logfile(log_fn,delta_format=False,mode='w')
+        self.state_log = logging.open_logfile(log_fn,delta_format=False,mode='w')
+        self.writer = writer if writer is not None else LogWriter()
+        self.keyframe_interval = keyframe_interval
+        self.last_keyframe_time = None
+        self.last_logged = dict()   # type: Dict[str,tuple]
 
     def rate(self):
         return self._rate
@@ -377,12 +727,31 @@ class AllStateLogger(Component):
     
     def cleanup(self):
         if self.state_log:
-            self.state_log.close()
+            self.writer.submit(self.writer.sync_and_close,self.state_log.file,self.state_log.close,droppable=False)
             self.state_log = None
 
     def update(self,state):
-        if self.attributes:
-            if self.attributes[0] == 'all':
-                self.state_log.log(state)
-            else:
-                self.state_log.log(state,self.attributes)
+        if not self.attributes:
+            return
+        if self.attributes[0] == 'all':
+            attributes = [f.name for f in fields(AllState) if f.name != 't' and not f.name.endswith('_update_time')]
+        else:
+            attributes = self.attributes
+        keyframe = self.last_keyframe_time is None or (self.keyframe_interval is not None and state.t >= self.last_keyframe_time + self.keyframe_interval)
+        message = {}
+        if keyframe:
+            message[logging.KEYFRAME_KEY] = state.t
+            self.last_keyframe_time = state.t
+        for k in attributes:
+            stamp = getattr(state,k+'_update_time',None)
+            key = (stamp,state.version(k))
+            if not keyframe and self.last_logged.get(k) == key:
+                continue
+            self.last_logged[k] = key
+            message[k] = getattr(state,k)
+            message[k+'_update_time'] = stamp if stamp is not None else state.t
+        if len(message) == 0:
+            return
+        #encode now, since the state's items may be modified in place before the writer gets to them
+        message = self.state_log.encode(message,None,state.t)
+        self.writer.submit(self.state_log.log_encoded,message,file=self.state_log.file)
@@ -1,7 +1,12 @@
-from multiprocessing import Process, Queue
+from multiprocessing import Process, Queue, Value
+from multiprocessing.shared_memory import SharedMemory
 import queue
 from ..component import Component
 from .execution import ComponentExecutor
+from dataclasses import is_dataclass, fields
+from typing import Any, Optional, Tuple
+import numpy as np
+import copy
 import time
 import sys
 import traceback
@@ -9,19 +14,172 @@ import traceback
 MAX_QUEUE_SIZE = 10
 #wait this many seconds before timing out on a queue get
 UPDATE_TIMEOUT = 5.0   
+#arrays smaller than this many bytes are pickled rather than sent through shared memory
+SHARED_MEMORY_MIN_BYTES = 64*1024
+#alignment of arrays in the shared memory ring, in bytes
+SHARED_MEMORY_ALIGNMENT = 64
+
+
+class SharedArrayRef:
+    """Placeholder for a numpy array stored in a SharedMemoryRing."""
+    def __init__(self, offset : int, shape : tuple, dtype : str):
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+
+class SharedMemoryMessage:
+    """A message whose large arrays have been replaced by SharedArrayRefs.
+    `end` is the ring position to release once the message is consumed."""
+    def __init__(self, payload : Any, end : int):
+        self.payload = payload
+        self.end = end
+
+
+def map_arrays(obj : Any, fn) -> Any:
+    """Returns a copy of obj where all numpy arrays (and SharedArrayRefs)
+    nested in lists, tuples, dicts, and dataclasses are replaced by fn(array).
+    Objects that contain no arrays are returned as-is."""
+    if isinstance(obj,(np.ndarray,SharedArrayRef)):
+        return fn(obj)
+    elif isinstance(obj,list):
+        res = [map_arrays(v,fn) for v in obj]
+        return obj if all(a is b for a,b in zip(res,obj)) else res
+    elif isinstance(obj,tuple):
+        res = tuple(map_arrays(v,fn) for v in obj)
+        return obj if all(a is b for a,b in zip(res,obj)) else res
+    elif isinstance(obj,dict):
+        res = dict((k,map_arrays(v,fn)) for k,v in obj.items())
+        return obj if all(res[k] is v for k,v in obj.items()) else res
+    elif is_dataclass(obj) and not isinstance(obj,type):
+        changed = dict()
+        for f in fields(obj):
+            v = getattr(obj,f.name)
+            newv = map_arrays(v,fn)
+            if newv is not v:
+                changed[f.name] = newv
+        if not changed:
+            return obj
+        res = copy.copy(obj)
+        for k,v in changed.items():
+            object.__setattr__(res,k,v)
+        return res
+    return obj
+
+
+class SharedMemoryRing:
+    """A single-producer, single-consumer ring buffer in shared memory used
+    to pass large numpy arrays between processes without pickling them.
+
+    The writer copies each large array into the ring once and sends a small
+    SharedMemoryMessage through a normal queue.  The reader gets arrays that
+    are views into the ring, which remain valid until it releases the message
+    (MPComponentExecutor releases a message when the next one arrives).
+    Space is reclaimed in FIFO order.  If the ring is full, the writer falls
+    back to pickling.
+    """
+    def __init__(self, size : int):
+        self.size = size
+        self.shm = SharedMemory(create=True,size=size)
+        self.written = Value('q',0)    #total bytes allocated by the writer
+        self.released = Value('q',0)   #total bytes released by the reader
+        self.owner = True
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['owner'] = False
+        return state
+
+    def _allocate(self, nbytes : int) -> Optional[int]:
+        nbytes = (nbytes + SHARED_MEMORY_ALIGNMENT - 1)//SHARED_MEMORY_ALIGNMENT*SHARED_MEMORY_ALIGNMENT
+        written = self.written.value
+        pos = written % self.size
+        if pos + nbytes > self.size:
+            #skip the tail so the array is contiguous
+            written += self.size - pos
+            pos = 0
+        if written + nbytes - self.released.value > self.size:
+            return None
+        self.written.value = written + nbytes
+        return pos
+
+    def encode(self, obj : Any, min_bytes : int = SHARED_MEMORY_MIN_BYTES) -> Any:
+        """Copies the large arrays in obj into the ring and returns a
+        SharedMemoryMessage.  Returns obj if nothing was copied."""
+        copied = [False]
+        def to_ring(a):
+            if isinstance(a,SharedArrayRef) or a.nbytes < min_bytes or a.dtype.hasobject:
+                return a
+            pos = self._allocate(a.nbytes)
+            if pos is None:
+                return a
+            view = np.ndarray(a.shape,a.dtype,buffer=self.shm.buf,offset=pos)
+            view[...] = a
+            copied[0] = True
+            return SharedArrayRef(pos,a.shape,a.dtype.str)
+        payload = map_arrays(obj,to_ring)
+        if not copied[0]:
+            return obj
+        return SharedMemoryMessage(payload,self.written.value)
+
+    def decode(self, msg : SharedMemoryMessage, copy_arrays : bool = False) -> Any:
+        """Converts a message back into the original object.  If copy_arrays
+        is False, arrays are views into the ring that become invalid after
+        release().  Otherwise, they are copied and the message is released."""
+        def from_ring(ref):
+            if not isinstance(ref,SharedArrayRef):
+                return ref
+            a = np.ndarray(ref.shape,np.dtype(ref.dtype),buffer=self.shm.buf,offset=ref.offset)
+            return a.copy() if copy_arrays else a
+        res = map_arrays(msg.payload,from_ring)
+        if copy_arrays:
+            self.release(msg)
+        return res
+
+    def release(self, msg : SharedMemoryMessage) -> None:
+        """Frees the ring space used by msg and all earlier messages."""
+        self.released.value = msg.end
+
+    def detach(self, obj : Any) -> Any:
+        """Returns obj with copies of any arrays that are views into the ring,
+        so that obj stays valid after the ring space is released."""
+        def copy_ring_views(a):
+            if isinstance(a,np.ndarray) and np.may_share_memory(a,np.frombuffer(self.shm.buf,dtype=np.uint8)):
+                return a.copy()
+            return a
+        return map_arrays(obj,copy_ring_views)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
 
 class MPComponentExecutor(ComponentExecutor):
     """A component executor that uses a subprocess.
 
+    If shared_memory_size > 0, large numpy arrays in the inputs and outputs
+    are passed through SharedMemoryRing buffers of that many bytes rather
+    than being pickled.  Input arrays seen by the component are views into
+    shared memory that are only valid until its next update(), so the
+    component must copy any array that it keeps.  Outputs that are views of
+    the inputs are copied before they are sent back.
+
     TODO: print stdout / stderr according to the print config and
     logging settings.
     """
-    def __init__(self, component : Component, *args, **kwargs):
+    def __init__(self, component : Component, *args, shared_memory_size : int = 0, **kwargs):
         super(MPComponentExecutor, self).__init__(component, *args, **kwargs)
         self._in_queue = Queue()
         self._out_queue = Queue()
+        self._in_ring = None   # type: Optional[SharedMemoryRing]
+        self._out_ring = None  # type: Optional[SharedMemoryRing]
+        if shared_memory_size > 0:
+            self._in_ring = SharedMemoryRing(shared_memory_size)
+            self._out_ring = SharedMemoryRing(shared_memory_size)
         self._process = None
         self.do_update = self._do_update
+        #the subprocess measures the CPU time of its updates and sends it with the outputs
+        self.measure_cpu_time = False
         self._times_put = []
         self._delay_count = 0
         self._num_delayed = 0
@@ -38,7 +196,7 @@ class MPComponentExecutor(ComponentExecutor):
         }
         if hasattr(self.c,'debugger'):
             delattr(self.c,'debugger') #can't be serialized via Pickle 
-        self._process = Process(target=self._run, args=(self.c, self._in_queue, self._out_queue, config))
+        self._process = Process(target=self._run, args=(self.c, self._in_queue, self._out_queue, config, self._in_ring, self._out_ring))
         try:
             self._process.start()
         except Exception as e:
@@ -68,8 +226,13 @@ class MPComponentExecutor(ComponentExecutor):
             self._process.join()
             self._process.close()
             self._process = None
+        for ring in [self._in_ring,self._out_ring]:
+            if ring is not None:
+                ring.close()
+        self._in_ring = self._out_ring = None
 
-    def _run(self, component : Component, inqueue : Queue, outqueue : Queue, config):
+    def _run(self, component : Component, inqueue : Queue, outqueue : Queue, config,
+             in_ring : SharedMemoryRing = None, out_ring : SharedMemoryRing = None):
         #let parent process handle SIGINT
         import signal    
         signal.signal(signal.SIGINT, signal.SIG_IGN)
@@ -81,6 +244,7 @@ class MPComponentExecutor(ComponentExecutor):
             outqueue.put((e,traceback.format_tb(e.__traceback__)))
             return
         outqueue.put('initialized')
+        msg = None   #the last input message, released when the next one arrives
         while True:
             #update
             try:
@@ -89,13 +253,31 @@ class MPComponentExecutor(ComponentExecutor):
                 print("Timeout waiting for data from parent process",component.__class__.__name__)
                 break
 
-            if data == 'stop':
+            if msg is not None:
+                #the previous output was detached from its input views before it was sent
+                in_ring.release(msg)
+                msg = None
+            if isinstance(data,SharedMemoryMessage):
+                msg = data
+                data = in_ring.decode(msg)
+            elif data == 'stop':
                 print("Parent process requested stop",component.__class__.__name__)
                 break
             
             try:
+                c0 = time.thread_time()
                 res = component.update(*data)
-                outqueue.put(res)
+                cpu_time = time.thread_time() - c0
+                if out_ring is not None:
+                    res = out_ring.encode(res)
+                if msg is not None:
+                    #outputs may alias the input views, and arrays left in the
+                    #message are pickled later by the queue's feeder thread
+                    if isinstance(res,SharedMemoryMessage):
+                        res.payload = in_ring.detach(res.payload)
+                    else:
+                        res = in_ring.detach(res)
+                outqueue.put((cpu_time,res))
             except KeyboardInterrupt:
                 return
             except Exception as e:
@@ -108,12 +290,17 @@ class MPComponentExecutor(ComponentExecutor):
         except Exception as e:
             print("Error cleaning up",component.__class__.__name__)
             outqueue.put((e,traceback.format_tb(e.__traceback__)))
+        for ring in [in_ring,out_ring]:
+            if ring is not None:
+                ring.shm.close()
         print("Exiting process",component.__class__.__name__)
         
     def _do_update(self, t, *args):
         if not self.healthy():
             return None
         if self._in_queue.qsize() < MAX_QUEUE_SIZE:
+            if self._in_ring is not None:
+                args = self._in_ring.encode(args)
             self._in_queue.put(args)
             self._times_put.append(time.time())
         else:
@@ -136,6 +323,11 @@ class MPComponentExecutor(ComponentExecutor):
                 self._process.close()
                 self._process = None
                 return None
+            cpu_time,res = res
+            self.cpu_time.record(cpu_time)
+            if isinstance(res,SharedMemoryMessage):
+                #outputs are stored in the state, so they can't stay in the ring
+                res = self._out_ring.decode(res,copy_arrays=True)
             return res
         else:
             self._delay_count += 1
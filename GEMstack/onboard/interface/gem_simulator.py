@@ -333,22 +333,35 @@ class GEMDoubleIntegratorSimulationInterface(GEMInterface):
         looper = TimedLooper(self.simulator.dt / self.real_time_multiplier,name="Simulation thread")
         while looper and not data['stop']:
             with lock:
-                self.simulator.simulate(self.simulator.dt, self.last_command)
-                self.last_reading = self.simulator.last_reading
+                self.step()
 
-                if self.gnss_callback is not None and self.simulator.simulation_time - self.last_gnss_time > self.gnss_dt:
-                    vehicle_state = self.simulator.state()
-                    self.gnss_callback(self.gnss_emulator(vehicle_state))
-                    self.last_gnss_time = self.simulator.simulation_time
-                if self.imu_callback is not None and self.simulator.simulation_time - self.last_imu_time > self.imu_dt:
-                    pose = ObjectPose(frame=ObjectFrameEnum.CURRENT,t=self.simulation_time,x=0,y=0,yaw=0)
-                    vehicle_state = self.last_reading.to_state(pose)
-                    self.imu_callback(vehicle_state)
-                    self.last_imu_time = self.simulator.simulation_time
-                if self.agent_detector_callback is not None and self.simulator.simulation_time - self.last_agent_time > self.agent_dt:
-                    for k,a in self.simulator.agents.items():
-                        self.agent_detector_callback(k,a.to_agent_state())
-                    self.last_agent_time = self.simulator.simulation_time
+    def step(self):
+        """Advances the simulation by one time step and calls the sensor
+        callbacks that are due."""
+        self.simulator.simulate(self.simulator.dt, self.last_command)
+        self.last_reading = self.simulator.last_reading
+
+        if self.gnss_callback is not None and self.simulator.simulation_time - self.last_gnss_time > self.gnss_dt:
+            vehicle_state = self.simulator.state()
+            self.gnss_callback(self.gnss_emulator(vehicle_state))
+            self.last_gnss_time = self.simulator.simulation_time
+        if self.imu_callback is not None and self.simulator.simulation_time - self.last_imu_time > self.imu_dt:
+            pose = ObjectPose(frame=ObjectFrameEnum.CURRENT,t=self.simulator.simulation_time,x=0,y=0,yaw=0)
+            vehicle_state = self.last_reading.to_state(pose)
+            self.imu_callback(vehicle_state)
+            self.last_imu_time = self.simulator.simulation_time
+        if self.agent_detector_callback is not None and self.simulator.simulation_time - self.last_agent_time > self.agent_dt:
+            for k,a in self.simulator.agents.items():
+                self.agent_detector_callback(k,a.to_agent_state())
+            self.last_agent_time = self.simulator.simulation_time
+
+    def advance(self, T : float):
+        """Steps the simulation forward by T seconds of simulation time on the
+        calling thread.  Used instead of start() to run on a virtual clock."""
+        assert self.thread is None, "Can't advance the simulation while the simulator thread is running"
+        tend = self.simulator.simulation_time + T - 1e-9
+        while self.simulator.simulation_time < tend:
+            self.step()
 
     def gnss_emulator(self, vehicle_state: VehicleState):
         position_noise = self.gnss_emulator_settings.get('position_noise',0.0)
@@ -19,6 +19,7 @@ class StandardPerceptionNormalizer(Component):
                 return
         #convert vehicle pose to start frame
         state.vehicle.pose = state.vehicle.pose.to_frame(ObjectFrameEnum.START, start_pose_abs=state.start_vehicle_pose)
+        state.touch('vehicle')
 
 
 def normalize_scene_to_current(state : AllState):
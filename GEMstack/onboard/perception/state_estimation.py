@@ -1,3 +1,4 @@
+from __future__ import annotations
 from dataclasses import replace
 import math
 from typing import List
@@ -9,12 +10,14 @@ from ...knowledge.vehicle.geometry import front2steer,steer2front
 from ...mathutils.signal import OnlineLowPassFilter
 from ..interface.gem import GEMInterface
 from ..component import Component
-from ..interface.gem_hardware import GNSSReading
+from ..interface.gnss_reading import GNSSReading
 
 #necessary imports for processing Vio odometry information
-from nav_msgs.msg import Odometry
-from ...mathutils import transforms
-import rospy
+try:
+    from nav_msgs.msg import Odometry
+    import rospy
+except ImportError:
+    pass
 import numpy as np
 import subprocess
 
@@ -89,7 +92,7 @@ class VIOSlamEstimator(Component):
         self.run_vio_rtabmap()
 
     def vio_slam_callback(self, reading : VioslamReading):
-        
+        pass
 
     # Get information from the visual odometry topic from rtabmap
     def callback_with_Vioslam_reading(self, msg : Odometry):
@@ -7,6 +7,7 @@ from ...mathutils import collisions
 from ...mathutils.transforms import normalize_vector
 from ...state.intent import VehicleIntent,VehicleIntentEnum
 from ...state import AgentEnum
+from ...state.agent import agents_to_frame
 import os
 import copy
 from time import time
@@ -117,64 +118,35 @@ class DrivingLogicIntent(Component):
 
         # Search across midline for points that don't collide with objects
         SEARCH_STEPS = 100
-        empty_points = []
-        for i in range(0, SEARCH_STEPS):
-            u = i / SEARCH_STEPS
-            
-            search_point = vector_add(
-                vector_mul(midline_start, 1.0-u),
-                vector_mul(midline_end, u)
-            )
-
-            #TODO: Convert to CollisionDetector2D object. 
-            intersects = False
-            for agent_s in state.agents.values():
-                agent = agent_s.to_frame(state.roadgraph.frame, state.vehicle.pose, state.start_vehicle_pose)
-                if(collisions.point_in_polygon_2d(search_point, agent.polygon_parent())):
-                    intersects = True
-                    break
-            
-            if(not intersects):
-                empty_points.append(search_point)
-                
-        
-        # Find point furthest from all vehicles
-        points_with_distances = {}
-
-        for point in empty_points:
-            min_dist = float('inf')
-            for agent_s in state.agents.values():
-                if agent_s.type == AgentEnum.PEDESTRIAN:
-                    agent = agent_s.to_frame(state.roadgraph.frame, state.vehicle.pose, state.start_vehicle_pose)
-                    for agent_point in agent.polygon_parent():
-                        dist = vector_dist(point, agent_point)
-                        if(dist < min_dist):
-                            min_dist = dist
+        u = np.arange(SEARCH_STEPS)[:,np.newaxis] / SEARCH_STEPS
+        search_points = np.asarray(midline_start)*(1.0-u) + np.asarray(midline_end)*u
 
-            if min_dist not in points_with_distances:
-                points_with_distances[min_dist] = [point]
-            else:
-                points_with_distances[min_dist].append(point)
+        agents = agents_to_frame(list(state.agents.values()), state.roadgraph.frame, state.vehicle.pose, state.start_vehicle_pose)
+        agent_polygons = [agent.polygon_parent() for agent in agents]
+        intersects = np.zeros(SEARCH_STEPS,dtype=bool)
+        for polygon in agent_polygons:
+            intersects |= collisions.points_in_polygon_2d(search_points, polygon)
+        empty_points = search_points[~intersects]
 
-        sorted_points_with_distances = {key: points_with_distances[key] for key in sorted(points_with_distances)}
+        # Find point furthest from all vehicles
+        pedestrian_points = [p for agent,polygon in zip(agents,agent_polygons) if agent.type == AgentEnum.PEDESTRIAN for p in polygon]
+        if len(pedestrian_points) > 0:
+            diffs = empty_points[:,np.newaxis,:2] - np.asarray(pedestrian_points)[np.newaxis,:,:2]
+            min_dists = np.sqrt((diffs**2).sum(axis=2)).min(axis=1)
+        else:
+            min_dists = np.full(len(empty_points),float('inf'))
 
         xbounds,_,_ = settings.get('vehicle.geometry.bounds')
         step_bound = int(xbounds[1] * 2)
+        offsets = np.zeros((2*step_bound,search_points.shape[1]))
+        offsets[:,0] = np.arange(-step_bound, step_bound)
 
         # Get point closest to waving pedestrian and avoid obstacles
-        for points in list(sorted_points_with_distances.items()):
-            for point in points[1]:
-                intersects = False
-                for agent_s in state.agents.values():
-                    agent = agent_s.to_frame(state.roadgraph.frame, state.vehicle.pose, state.start_vehicle_pose)
-                    for i in range(-step_bound, step_bound):
-                        if(collisions.point_in_polygon_2d([point[0] + i, point[1]], agent.polygon_parent())):
-                            intersects = True
-                            break
-                if not intersects:
-                    return point, state.roadgraph.frame
-                else:
-                    continue
+        for i in np.argsort(min_dists, kind='stable'):
+            point = empty_points[i]
+            shifted = point + offsets
+            if not any(collisions.points_in_polygon_2d(shifted, polygon).any() for polygon in agent_polygons):
+                return point.tolist(), state.roadgraph.frame
 
 
 
@@ -0,0 +1,299 @@
+"""Point-to-point routing along the lanes of a roadgraph.
+
+:class:`LaneGraph` turns a roadgraph's lanes and lane-lane connections into
+a weighted graph.  Its nodes are positions along lane centerlines: the lane
+ends and the places where a connection leaves or enters a lane.  Its edges
+are the centerline pieces between consecutive positions on a lane, weighted
+by their length, and the connections, weighted by the distance between their
+endpoints plus a per-type cost, e.g., to discourage lane changes and turns.
+Every weight is at least the straight-line distance between its endpoints,
+so the straight-line distance to the goal is an admissible A* heuristic.
+
+:class:`LaneRouter` snaps start and goal points to lanes and searches the
+graph with A*, or with a contraction hierarchy that is cached to disk per
+map.
+"""
+
+from ...state import Roadgraph, Route, ObjectFrameEnum, RoadgraphConnectionEnum
+from ...state.roadgraph import RoadgraphConnection, LaneIndex
+from ...mathutils.graph_search import Graph, ContractionHierarchy, shortest_path
+import os
+import math
+import numpy as np
+from typing import Dict,List,Optional,Tuple,Union
+
+#extra cost of each connection type, in m.  Types not listed (ONCOMING,
+#CROSSING, BORDERING) can't be driven through.
+TRANSITION_COSTS = {
+    RoadgraphConnectionEnum.CONTINUES : 0.0,
+    RoadgraphConnectionEnum.MERGE : 0.0,
+    RoadgraphConnectionEnum.DIVERGE : 0.0,
+    RoadgraphConnectionEnum.ADJACENT : 10.0,
+    RoadgraphConnectionEnum.RIGHT_TURN : 2.0,
+    RoadgraphConnectionEnum.LEFT_TURN : 5.0,
+    RoadgraphConnectionEnum.U_TURN : 20.0,
+}
+
+CACHE_FOLDER = os.path.join('~','.cache','GEMstack','lane_routing')
+
+#arc lengths are rounded to this many decimals so positions can be matched
+DECIMALS = 6
+
+
+class LaneGraph:
+    """The graph of positions along a roadgraph's lanes.
+
+    Lane changes (ADJACENT connections, in both directions) can start every
+    ``lane_change_spacing`` m along the lane, or along the connection's
+    location if it has one, and end ``lane_change_length`` m further along
+    the other lane.  Other connections occur at the end of lane1, or at their
+    location.  MERGE connections enter lane2 next to the end of lane1 and
+    DIVERGE connections leave lane1 next to the start of lane2.
+
+    Arc lengths are measured in the roadgraph's frame, which can't be GLOBAL.
+    """
+    def __init__(self, roadgraph : Roadgraph,
+                 transition_costs : Optional[Dict[Union[RoadgraphConnectionEnum,str],float]] = None,
+                 lane_change_spacing : float = 5.0, lane_change_length : float = 10.0):
+        if roadgraph.frame == ObjectFrameEnum.GLOBAL:
+            raise ValueError("Can't route on a roadgraph in the GLOBAL frame, convert it to a Cartesian frame first")
+        self.transition_costs = dict(TRANSITION_COSTS)
+        if transition_costs is not None:
+            for k,v in transition_costs.items():
+                self.transition_costs[RoadgraphConnectionEnum[k] if isinstance(k,str) else k] = v
+        self.lane_change_spacing = lane_change_spacing
+        self.lane_change_length = lane_change_length
+        self.index = roadgraph.lane_index()      # type: LaneIndex
+        self.lane_names = self.index.lane_names
+        self.lane_lengths = dict()               # type: Dict[str,float]
+        for lane,seg in self.index.lane_segments.items():
+            self.lane_lengths[lane] = float(self._seg_end(seg[-1]))
+
+        transitions = []
+        for c in roadgraph.connections:
+            transitions += self._transitions(c)
+        positions = {lane:[0.0,length] for lane,length in self.lane_lengths.items()}
+        for lane1,a,lane2,b,cost in transitions:
+            positions[lane1].append(a)
+            positions[lane2].append(b)
+
+        #nodes, numbered lane by lane in increasing arc length
+        self.lane_positions = dict()             # type: Dict[str,np.ndarray]
+        self.lane_first_node = dict()            # type: Dict[str,int]
+        node_lane = []
+        node_s = []
+        tails,heads,weights = [],[],[]
+        first = 0
+        for lane in self.lane_names:
+            s = np.unique(np.round(positions[lane],DECIMALS))
+            self.lane_positions[lane] = s
+            self.lane_first_node[lane] = first
+            node_lane += [lane]*len(s)
+            node_s.append(s)
+            tails.append(np.arange(first,first+len(s)-1))
+            heads.append(np.arange(first+1,first+len(s)))
+            weights.append(np.diff(s))
+            first += len(s)
+        self.node_lane = node_lane
+        self.node_s = np.concatenate(node_s) if node_s else np.zeros(0)
+        self.node_points = np.zeros((len(self.node_s),3))
+        for lane in self.lane_names:
+            first = self.lane_first_node[lane]
+            s = self.lane_positions[lane]
+            self.node_points[first:first+len(s)] = self.lane_points(lane,s)
+        for lane1,a,lane2,b,cost in transitions:
+            u = self.node(lane1,a)
+            v = self.node(lane2,b)
+            tails.append([u])
+            heads.append([v])
+            weights.append([cost + float(np.linalg.norm(self.node_points[v]-self.node_points[u]))])
+        self.graph = Graph(len(self.node_s),np.concatenate(tails) if tails else [],
+                           np.concatenate(heads) if heads else [],np.concatenate(weights) if weights else [])
+
+    def _seg_end(self, seg):
+        return self.index.seg_start[seg] + np.linalg.norm(self.index.index.b[seg]-self.index.index.a[seg],axis=-1)
+
+    def _arc_length(self, point, lane : str) -> float:
+        return self.index.lane_distance(point,lane)[1]
+
+    def _transitions(self, c : RoadgraphConnection) -> List[Tuple[str,float,str,float,float]]:
+        """Returns the (lane1, a, lane2, b, cost) transitions from arc length a
+        on lane1 to arc length b on lane2 for a connection."""
+        cost = self.transition_costs.get(c.type)
+        if cost is None or c.lane2 is None or c.lane1 not in self.lane_lengths or c.lane2 not in self.lane_lengths:
+            return []
+        if c.type == RoadgraphConnectionEnum.ADJACENT:
+            return self._lane_changes(c.lane1,c.lane2,c.location,cost) + self._lane_changes(c.lane2,c.lane1,c.location,cost)
+        len1 = self.lane_lengths[c.lane1]
+        if len(c.location) > 0:
+            a = self._arc_length(c.location[0],c.lane1)
+            b = self._arc_length(c.location[-1],c.lane2)
+        elif c.type == RoadgraphConnectionEnum.MERGE:
+            a = len1
+            b = self._arc_length(self.lane_points(c.lane1,[len1])[0],c.lane2)
+        elif c.type == RoadgraphConnectionEnum.DIVERGE:
+            a = self._arc_length(self.lane_points(c.lane2,[0.0])[0],c.lane1)
+            b = 0.0
+        else:
+            a = len1
+            b = 0.0
+        return [(c.lane1,a,c.lane2,b,cost)]
+
+    def _lane_changes(self, lane1 : str, lane2 : str, location : List, cost : float) -> List[Tuple[str,float,str,float,float]]:
+        if len(location) > 0:
+            arcs = [self._arc_length(p,lane1) for p in location]
+            lo,hi = min(arcs),max(arcs)
+        else:
+            lo,hi = 0.0,self.lane_lengths[lane1]
+        count = max(int(math.ceil((hi-lo)/self.lane_change_spacing)),0) + 1
+        len2 = self.lane_lengths[lane2]
+        res = []
+        for a,p in zip(np.linspace(lo,hi,count),self.lane_points(lane1,np.linspace(lo,hi,count))):
+            s = self._arc_length(p,lane2)
+            if s >= len2 - 1e-6:
+                #lane1 extends past the end of lane2
+                continue
+            res.append((lane1,float(a),lane2,min(s + self.lane_change_length,len2),cost))
+        return res
+
+    def node(self, lane : str, s : float) -> int:
+        """Returns the node at arc length s on a lane, which must exist."""
+        s = np.round(s,DECIMALS)
+        i = int(np.searchsorted(self.lane_positions[lane],s))
+        return self.lane_first_node[lane] + i
+
+    def lane_points(self, lane : str, s) -> np.ndarray:
+        """Returns the 3D points at the given arc lengths along a lane's
+        centerline."""
+        seg = self.index.lane_segments[lane]
+        starts = self.index.seg_start[seg]
+        s = np.asarray(s,dtype=float)
+        i = np.clip(np.searchsorted(starts,s,side='right')-1,0,len(seg)-1)
+        a = self.index.index.a[seg[i]]
+        b = self.index.index.b[seg[i]]
+        seglen = np.linalg.norm(b-a,axis=-1)
+        u = np.clip((s - starts[i])/np.where(seglen > 0,seglen,1.0),0.0,1.0)
+        return a + (b-a)*u[...,np.newaxis]
+
+    def lane_slice(self, lane : str, s0 : float, s1 : float) -> np.ndarray:
+        """Returns the centerline of a lane between arc lengths s0 and s1."""
+        seg = self.index.lane_segments[lane]
+        starts = self.index.seg_start[seg]
+        inner = (starts > s0) & (starts < s1)
+        return np.vstack((self.lane_points(lane,[s0]),self.index.index.a[seg[inner]],self.lane_points(lane,[s1])))
+
+
+class LaneRouter:
+    """Finds shortest routes along the lanes of a roadgraph.
+
+    If contract = True, the lane graph is preprocessed into a contraction
+    hierarchy, which is saved in cache_folder under a hash of the graph and
+    reloaded the next time the same map is routed on.
+    """
+    def __init__(self, roadgraph : Roadgraph,
+                 transition_costs : Optional[Dict[Union[RoadgraphConnectionEnum,str],float]] = None,
+                 lane_change_spacing : float = 5.0, lane_change_length : float = 10.0,
+                 contract : bool = False, cache_folder : Optional[str] = CACHE_FOLDER):
+        self.roadgraph = roadgraph
+        self.lane_graph = LaneGraph(roadgraph,transition_costs,lane_change_spacing,lane_change_length)
+        self.hierarchy = None       # type: Optional[ContractionHierarchy]
+        self._points = [tuple(p) for p in self.lane_graph.node_points.tolist()]
+        if contract:
+            self.hierarchy = self._load_hierarchy(cache_folder)
+
+    def _load_hierarchy(self, cache_folder : Optional[str]) -> ContractionHierarchy:
+        graph = self.lane_graph.graph
+        if cache_folder is None:
+            return ContractionHierarchy(graph)
+        key = graph.key()
+        fn = os.path.join(os.path.expanduser(cache_folder),key+'.npz')
+        if os.path.exists(fn):
+            try:
+                return ContractionHierarchy.load(fn,key)
+            except (OSError,ValueError) as e:
+                print("Warning: ignoring lane routing cache file",fn,":",e)
+        hierarchy = ContractionHierarchy(graph)
+        try:
+            os.makedirs(os.path.dirname(fn),exist_ok=True)
+            tmp = fn[:-4] + '.%d.tmp.npz'%os.getpid()
+            hierarchy.save(tmp,key)
+            os.replace(tmp,fn)
+        except OSError as e:
+            print("Warning: could not save lane routing cache file",fn,":",e)
+        return hierarchy
+
+    def snap(self, point, lane : Optional[str] = None) -> Optional[Tuple[str,float]]:
+        """Returns the (lane, arc length) of the closest point on the given
+        lane, or on the nearest lane, to an (x,y) or (x,y,z) point."""
+        if lane is not None:
+            return lane,float(np.round(self.lane_graph.index.lane_distance(point,lane)[1],DECIMALS))
+        nearest = self.roadgraph.nearest_lanes(point,1)
+        if len(nearest) == 0:
+            return None
+        return nearest[0][0],float(np.round(nearest[0][2],DECIMALS))
+
+    def shortest_route(self, start, goal, start_lane : Optional[str] = None,
+                       goal_lane : Optional[str] = None) -> Tuple[float,List[Tuple[str,float,float]]]:
+        """Finds the cheapest route from the start point to the goal point,
+        which are snapped to start_lane and goal_lane, or to the nearest lanes.
+
+        Returns the cost and the route as a list of (lane, s0, s1) pieces,
+        each driving along a lane from arc length s0 to s1.  Returns
+        (inf, []) if the goal can't be reached.
+        """
+        g = self.lane_graph
+        snapped_start = self.snap(start,start_lane)
+        snapped_goal = self.snap(goal,goal_lane)
+        if snapped_start is None or snapped_goal is None:
+            return float('inf'),[]
+        lane0,s0 = snapped_start
+        lane1,s1 = snapped_goal
+        best = (float('inf'),[])
+        if lane0 == lane1 and s1 >= s0:
+            best = (s1-s0,[(lane0,s0,s1)])
+        #enter the graph at the next node on the start lane, and leave it at
+        #the previous node on the goal lane
+        i = int(np.searchsorted(g.lane_positions[lane0],s0))
+        j = int(np.searchsorted(g.lane_positions[lane1],s1,side='right'))-1
+        if i >= len(g.lane_positions[lane0]) or j < 0:
+            return best
+        sources = {g.lane_first_node[lane0]+i : float(g.lane_positions[lane0][i]-s0)}
+        targets = {g.lane_first_node[lane1]+j : float(s1-g.lane_positions[lane1][j])}
+        if self.hierarchy is not None:
+            cost,nodes = self.hierarchy.shortest_path(sources,targets)
+        else:
+            goal_point = tuple(g.lane_points(lane1,[s1])[0])
+            points = self._points
+            cost,nodes = shortest_path(g.graph,sources,targets,lambda v : math.dist(points[v],goal_point))
+        if cost < best[0]:
+            best = (cost,self._pieces(nodes,lane0,s0,lane1,s1))
+        return best
+
+    def _pieces(self, nodes : List[int], lane0 : str, s0 : float, lane1 : str, s1 : float) -> List[Tuple[str,float,float]]:
+        g = self.lane_graph
+        pieces = []
+        lane,start = lane0,s0
+        for u,v in zip(nodes[:-1],nodes[1:]):
+            if g.node_lane[v] != g.node_lane[u] or g.node_s[v] < g.node_s[u]:
+                pieces.append((lane,start,float(g.node_s[u])))
+                lane,start = g.node_lane[v],float(g.node_s[v])
+        pieces.append((lane1,start,s1))
+        return [p for p in pieces if p[2] > p[1]] or pieces[-1:]
+
+    def route(self, start, goal, start_lane : Optional[str] = None, goal_lane : Optional[str] = None) -> Optional[Route]:
+        """Returns the shortest route from start to goal as a Route through
+        the lane centerlines, in the roadgraph's frame, or None if the goal
+        can't be reached."""
+        cost,pieces = self.shortest_route(start,goal,start_lane,goal_lane)
+        if len(pieces) == 0:
+            return None
+        points = []
+        lanes = []
+        for lane,a,b in pieces:
+            pts = self.lane_graph.lane_slice(lane,a,b)[:,:2].tolist()
+            if len(points) > 0 and np.allclose(points[-1],pts[0]):
+                pts = pts[1:]
+            points += pts
+            if len(lanes) == 0 or lanes[-1] != lane:
+                lanes.append(lane)
+        return Route(frame=self.roadgraph.frame,points=points,lanes=lanes)
@@ -84,7 +84,7 @@ class PurePursuit(object):
                 print("Transforming trajectory from",self.trajectory.frame.name,"to",state.pose.frame.name)
                 self.trajectory = self.trajectory.to_frame(state.pose.frame, current_pose=state.pose)
 
-        closest_dist,closest_parameter = self.path.closest_point_local((curr_x,curr_y),[self.current_path_parameter-5.0,self.current_path_parameter+5.0])
+        closest_dist,closest_parameter = self.path.track_closest_point((curr_x,curr_y),self.current_path_parameter,5.0,5.0)
         self.current_path_parameter = closest_parameter
         self.current_traj_parameter += dt
         #TODO: calculate parameter that is look_ahead distance away from the closest point?
@@ -11,10 +11,11 @@ import os
 import copy
 from time import time
 from dataclasses import replace
-from queue import PriorityQueue
+import heapq
 import numpy as np
 import math
 from ...state.physical_object import ObjectFrameEnum, convert_point
+from .lane_routing import LaneRouter
 
 class StaticRoutePlanner(Component):
     """Reads a route from disk and returns it as the desired route."""
@@ -51,6 +52,50 @@ class StaticRoutePlanner(Component):
     def update(self):
         return self.route
 
+class RoadgraphRoutePlanner(Component):
+    """Plans the shortest route along the lanes of a roadmap to a goal point,
+    rather than reading a hand-authored route from disk.
+
+    The start and goal are (x,y) points in the roadmap's frame.  If start is
+    not given, the route starts at the vehicle's position when the planner
+    first runs.  The lane graph's contraction hierarchy is cached to disk,
+    so only the first run on a map pays for preprocessing.
+    """
+    def __init__(self, mapfn : str, goal : List[float], start : List[float] = None,
+                 transition_costs : dict = None, contract : bool = True):
+        with open(mapfn,'r') as f:
+            roadmap = serialization.load(f)
+        if isinstance(roadmap,Roadmap):
+            roadmap = roadmap.graph
+        if not isinstance(roadmap,Roadgraph):
+            raise ValueError("Invalid roadmap file "+mapfn)
+        self.router = LaneRouter(roadmap,transition_costs,contract=contract)
+        self.goal = goal
+        self.route = None
+        if start is not None:
+            self.route = self.plan(start)
+
+    def plan(self, start : List[float]) -> Route:
+        route = self.router.route(start,self.goal)
+        if route is None:
+            raise RuntimeError("No route along the roadmap from {} to {}".format(start,self.goal))
+        return route
+
+    def state_inputs(self):
+        return ['all']
+
+    def state_outputs(self) -> List[str]:
+        return ['route']
+
+    def rate(self):
+        return 1.0
+
+    def update(self, state : AllState):
+        if self.route is None:
+            pose = state.vehicle.pose.to_frame(self.router.roadgraph.frame,current_pose=state.vehicle.pose,start_pose_abs=state.start_vehicle_pose)
+            self.route = self.plan([pose.x,pose.y])
+        return self.route
+
 class DummyRoutePlanner(Component):
     """Reads a route from disk and returns it as the desired route."""
     def __init__(self, start : List[float], end : List[float]):
@@ -169,6 +214,7 @@ class SearchNavigationRoutePlanner(Component):
         self.gear_cost = settings.get('A_star_planner.search_planner.gear_cost')
 
         self.smooth_threshold = settings.get('A_star_planner.search_planner.smooth_threshold')
+        self.batch_expansion = settings.get('A_star_planner.search_planner.batch_expansion',True)
 
         self.route = None
         self.last_path = None
@@ -203,6 +249,16 @@ class SearchNavigationRoutePlanner(Component):
 
         self.setup_search(start, end)
 
+        obstacles = collisions.CollisionDetector2D()
+        for i,agent in enumerate(agents):
+            obstacles.add_polygon(str(i),agent.polygon_parent())
+        # bounding circles of the obstacles, to skip the far ones in check_states
+        obstacle_polygons = np.zeros((0,4,2))
+        if len(agents) > 0:
+            obstacle_polygons = collisions.stack_polygons([agent.polygon_parent() for agent in agents])
+        obstacle_centers = obstacle_polygons.mean(axis=1)
+        obstacle_radii = np.linalg.norm(obstacle_polygons - obstacle_centers[:,np.newaxis],axis=2).max(axis=1,initial=0.0)
+
         def check_constraints(state):
             s = self.state2s(state)
             if s[0] < 0 or s[0] >= self.s_bound[0] or s[1] < 0 or s[1] >= self.s_bound[1]:
@@ -214,12 +270,28 @@ class SearchNavigationRoutePlanner(Component):
             new_l, new_w = l + 2*self.LONGITUDINAL_DISTANCE_BUFFER, w + 2*self.LATERAL_DISTANCE_BUFFER
             vehicle_object.dimensions = (new_l, new_w, h)
             vehicle_poly = vehicle_object.polygon_parent()
-            for agent in agents:
-                if collisions.polygon_intersects_polygon_2d(vehicle_poly, agent.polygon_parent()):
-                    return False
-            return True
+            return next(obstacles.items_intersecting_polygon(vehicle_poly),None) is None
         
+        def check_states(states):
+            #batched version of check_constraints, for an n x 4 array of states
+            states = np.asarray(states,dtype=float).reshape(-1,4)
+            s = self.lattice(states)
+            ok = (s >= 0).all(axis=1) & (s[:,0] < self.s_bound[0]) & (s[:,1] < self.s_bound[1])
+            footprints = self.footprints(states[ok])
+            centers = footprints.mean(axis=1)
+            radius = np.linalg.norm(footprints[0,0]-centers[0]) if len(footprints) > 0 else 0.0
+            # test all nearby (footprint, obstacle) pairs at once
+            near = np.linalg.norm(centers[:,np.newaxis]-obstacle_centers,axis=2) <= radius + obstacle_radii
+            i,j = np.nonzero(near)
+            hit = collisions.polygon_pairs_intersect_2d(footprints[i],obstacle_polygons[j])
+            free = np.ones(len(footprints),dtype=bool)
+            free[i[hit]] = False
+            ok[ok] = free
+            return ok
+
         def check_path(path):
+            if self.batch_expansion:
+                return len(path) == 0 or bool(check_states([p[:4] for p in path[::5]]).all())
             for p in path[::5]:
                 if not check_constraints(p):
                     return False
@@ -255,11 +327,18 @@ class SearchNavigationRoutePlanner(Component):
         # replan = True
         if replan: # replan when last route is not valid
             # Compute grid map
-            for i in range(self.grid_map.shape[0]):
-                for j in range(self.grid_map.shape[1]):
-                    x, y = self.grid_resolution*i+self.x_bound[0], self.grid_resolution*j+self.y_bound[0]
-                    if not check_constraints([x,y,0,0]):
-                        self.grid_map[i,j] = -1
+            if self.batch_expansion:
+                i, j = np.indices(self.grid_map.shape)
+                cells = np.zeros((i.size,4))
+                cells[:,0] = self.grid_resolution*i.ravel()+self.x_bound[0]
+                cells[:,1] = self.grid_resolution*j.ravel()+self.y_bound[0]
+                self.grid_map[~check_states(cells).reshape(self.grid_map.shape)] = -1
+            else:
+                for i in range(self.grid_map.shape[0]):
+                    for j in range(self.grid_map.shape[1]):
+                        x, y = self.grid_resolution*i+self.x_bound[0], self.grid_resolution*j+self.y_bound[0]
+                        if not check_constraints([x,y,0,0]):
+                            self.grid_map[i,j] = -1
             i = round((self.end[0]-self.x_bound[0])/self.grid_resolution)
             j = round((self.end[1]-self.y_bound[0])/self.grid_resolution)
             obstacle_heuristic(self.grid_map, [i,j])
@@ -268,14 +347,15 @@ class SearchNavigationRoutePlanner(Component):
             end = [*self.end[:3], 0]
             root = Node(start,0,heuristic=self.heuristic(start,end))
 
-            queue = PriorityQueue()
-            queue.put(root)
+            # open list entries are (f, insertion order, node)
+            queue = [(root.f(),0,root)]
+            pushed = 1
 
             visited = set()
             visited.add(tuple(start))
 
-            while not queue.empty():
-                current = queue.get()
+            while queue:
+                current = heapq.heappop(queue)[2]
                 if self.distance(current.state,end) < self.target_threshold:
                     break
                 elif np.random.uniform() < self.rs_prob(current.state):
@@ -285,24 +365,46 @@ class SearchNavigationRoutePlanner(Component):
                     statee = [xe/self.turn_radius,ye/self.turn_radius,the]
                     ps = eval_path(get_optimal_path(states,statee), current.state[:3], \
                                    radius=self.turn_radius, resolution=self.RS_resolution)
-                    collision = False
-                    for p in ps:
-                        if not check_constraints(p):
-                            collision = True
-                            break
+                    if self.batch_expansion:
+                        collision = len(ps) > 0 and not check_states([p[:4] for p in ps]).all()
+                    else:
+                        collision = False
+                        for p in ps:
+                            if not check_constraints(p):
+                                collision = True
+                                break
                     if not collision:
                         for p in ps:
                             cost = self.cost(current.state,p) + current.cost
                             child = Node(p,cost,heuristic=0.,parent=current)
                             current = child
                         break
+                if self.batch_expansion:
+                    # roll out all controls at once, then collision check the
+                    # unvisited ones in one call
+                    states = self.expand_batch(current.state)
+                    keys = self.lattice_keys(states)
+                    new = np.array([k not in visited for k in keys.tolist()],dtype=bool)
+                    states, keys = states[new], keys[new]
+                    free = check_states(states)
+                    states, keys = states[free], keys[free]
+                    costs = self.cost_batch(current.state,states) + current.cost
+                    for state,key,cost in zip(states.tolist(),keys.tolist(),costs.tolist()):
+                        if key in visited:
+                            continue
+                        visited.add(key)
+                        child = Node(state,cost,heuristic=self.heuristic(state,end),parent=current)
+                        heapq.heappush(queue,(child.f(),pushed,child))
+                        pushed += 1
+                    continue
                 for state in self.expand(current.state):
                     s = self.state2s(state)
                     if tuple(s) not in visited and check_constraints(state):
                         visited.add(tuple(s))
                         cost = self.cost(current.state,state) + current.cost
                         child = Node(state,cost,heuristic=self.heuristic(state,end),parent=current)
-                        queue.put(child)
+                        heapq.heappush(queue,(child.f(),pushed,child))
+                        pushed += 1
 
             if self.distance(current.state,end) > self.target_threshold:
                 print("Failed to find a path")
@@ -340,6 +442,22 @@ class SearchNavigationRoutePlanner(Component):
         
         return route
     
+    def footprints(self, states) -> np.ndarray:
+        """Returns the buffered vehicle outlines at each of the n states
+        (x,y,yaw,...), as an n x 4 x 2 array.  Matches the polygon that
+        check_constraints builds from VehicleState.to_object()."""
+        states = np.asarray(states,dtype=float)
+        xbounds,ybounds,zbounds = settings.get('vehicle.geometry.bounds')
+        l = xbounds[1]-xbounds[0] + 2*self.LONGITUDINAL_DISTANCE_BUFFER
+        w = ybounds[1]-ybounds[0] + 2*self.LATERAL_DISTANCE_BUFFER
+        cx, cy = 0.5*(xbounds[0]+xbounds[1]), 0.5*(ybounds[0]+ybounds[1])
+        corners = np.array([(cx-l/2,cy-w/2),(cx+l/2,cy-w/2),(cx+l/2,cy+w/2),(cx-l/2,cy+w/2)])
+        c, s = np.cos(states[:,2]), np.sin(states[:,2])
+        res = np.empty((len(states),4,2))
+        res[:,:,0] = c[:,np.newaxis]*corners[:,0] - s[:,np.newaxis]*corners[:,1] + states[:,0:1]
+        res[:,:,1] = s[:,np.newaxis]*corners[:,0] + c[:,np.newaxis]*corners[:,1] + states[:,1:2]
+        return res
+
     def setup_search(self, start, end):
         self.start = start
         self.end = end
@@ -397,6 +515,39 @@ class SearchNavigationRoutePlanner(Component):
             return next_states
         self.expand = expand
 
+        def lattice(states):
+            # batched state2s, for an n x 4 array of states
+            s = np.empty((len(states),3),dtype=int)
+            s[:,0] = np.round((states[:,0]-x_bound[0])/(x_bound[1]-x_bound[0])*self.s_bound[0])
+            s[:,1] = np.round((states[:,1]-y_bound[0])/(y_bound[1]-y_bound[0])*self.s_bound[1])
+            s[:,2] = np.round((states[:,2]-theta_bound[0])/(theta_bound[1]-theta_bound[0])*self.s_bound[2]) % self.s_bound[2]
+            return s
+        self.lattice = lattice
+
+        def lattice_keys(states):
+            # closed set keys: the lattice cell (x,y,theta) and direction, packed in one int.
+            # x and y are offset by one cell since rounding may step just outside the bounds
+            s = lattice(states)
+            ny, nth = self.s_bound[1]+2, self.s_bound[2]
+            return (((s[:,0]+1)*ny + s[:,1]+1)*nth + s[:,2])*2 + (states[:,3] > 0)
+        self.lattice_keys = lattice_keys
+
+        def expand_batch(state):
+            # same children as expand, in the same order, as an n x 4 array
+            steer = np.repeat(sample_steer(),2)
+            f = np.tile([-1.,1.],len(steer)//2)
+            x, y, theta, _ = state
+            dtheta = self.v*np.tan(steer)/self.L
+            next_states = np.empty((len(steer),4))
+            next_states[:,0] = x + f*np.cos(theta)*self.v*self.dt
+            next_states[:,1] = y + f*np.sin(theta)*self.v*self.dt
+            next_states[:,2] = theta + dtheta*self.dt
+            next_states[:,3] = f
+            inside = (next_states[:,0] >= x_bound[0]) & (next_states[:,0] <= x_bound[1]) & \
+                     (next_states[:,1] >= y_bound[0]) & (next_states[:,1] <= y_bound[1])
+            return next_states[inside]
+        self.expand_batch = expand_batch
+
         def heuristic(state1,state2,agents=[]):
             xs,ys,ths = state1[:3]
             start = [xs/self.turn_radius,ys/self.turn_radius,ths]
@@ -417,6 +568,12 @@ class SearchNavigationRoutePlanner(Component):
             return c
         self.cost = cost
 
+        def cost_batch(state1,states):
+            scale = np.where(states[:,3] < 0,self.backward_cost_scale,1.0)
+            c = np.hypot(states[:,0]-state1[0],states[:,1]-state1[1])*scale
+            return c + np.where(state1[3]*states[:,3] < 0,self.gear_cost,0.0)
+        self.cost_batch = cost_batch
+
         def distance(state1,state2):
             return np.linalg.norm(np.array(state1[:3])-np.array(state2[:3])) + \
                 min(abs(state1[2]-state2[2])%(2*np.pi), 2*np.pi-abs(state1[2]-state2[2])%(2*np.pi))
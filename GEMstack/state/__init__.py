@@ -18,7 +18,7 @@ __all__ = ['PhysicalObject','ObjectPose','ObjectFrameEnum',
            'MissionEnum','MissionObjective',
            'Route',
            'PredicateValues',
-           'AllState']
+           'AllState','AllStateSnapshot']
 from .physical_object import PhysicalObject, ObjectPose, ObjectFrameEnum
 from .trajectory import Path,Trajectory
 from .vehicle import VehicleState,VehicleGearEnum
@@ -34,4 +34,4 @@ from .relations import EntityRelation, EntityRelationEnum, EntityRelationGraph
 from .mission import MissionEnum,MissionObjective
 from .route import Route
 from .predicates import PredicateValues
-from .all import AllState
+from .all import AllState,AllStateSnapshot
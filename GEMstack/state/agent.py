@@ -1,9 +1,9 @@
 from __future__ import annotations
 from dataclasses import dataclass, replace
 from ..utils.serialization import register
-from .physical_object import ObjectFrameEnum,ObjectPose,PhysicalObject,convert_vector
+from .physical_object import ObjectFrameEnum,ObjectPose,PhysicalObject,convert_vector,convert_poses,get_frame_converter
 from enum import Enum
-from typing import Tuple
+from typing import Tuple,List
 from enum import Flag, auto
 
 class AgentEnum(Enum):
@@ -47,4 +47,20 @@ class AgentState(PhysicalObject):
     def to_frame(self, frame : ObjectFrameEnum, current_pose = None, start_pose_abs = None) -> AgentState:
         newpose = self.pose.to_frame(frame,current_pose,start_pose_abs)
         newvelocity = convert_vector(self.velocity,self.pose.frame,frame,current_pose,start_pose_abs)
-        return replace(self,pose=newpose,velocity=newvelocity)
\ No newline at end of file
+        return replace(self,pose=newpose,velocity=newvelocity)
+
+
+def agents_to_frame(agents : List[AgentState], frame : ObjectFrameEnum, current_pose = None, start_pose_abs = None) -> List[AgentState]:
+    """Converts a list of agents to a new frame.  Equivalent to calling
+    to_frame on each, but converts all agents in the same frame at once."""
+    poses = convert_poses([a.pose for a in agents],frame,current_pose,start_pose_abs)
+    velocities = [a.velocity for a in agents]
+    groups = dict()
+    for i,a in enumerate(agents):
+        if a.pose.frame != frame:
+            groups.setdefault(a.pose.frame,[]).append(i)
+    for source_frame,inds in groups.items():
+        conv = get_frame_converter(source_frame,frame,current_pose,start_pose_abs)
+        for i,v in zip(inds,conv.vectors([agents[i].velocity for i in inds]).tolist()):
+            velocities[i] = tuple(v)
+    return [replace(a,pose=p,velocity=v) for a,p,v in zip(agents,poses,velocities)]
\ No newline at end of file
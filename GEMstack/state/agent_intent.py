@@ -1,7 +1,7 @@
 from __future__ import annotations
 from dataclasses import dataclass, replace
 from ..utils.serialization import register
-from .physical_object import ObjectFrameEnum,ObjectPose
+from .physical_object import ObjectFrameEnum,ObjectPose,convert_poses
 from enum import Enum
 from typing import List,Optional
 
@@ -29,7 +29,7 @@ class AgentIntent:
     def to_frame(self, frame : ObjectFrameEnum, current_pose = None, start_pose_abs = None) -> AgentIntent:
         if self.path is None:
             return self
-        new_path = [p.to_frame(frame,current_pose,start_pose_abs) for p in self.path]
+        new_path = convert_poses(self.path,frame,current_pose,start_pose_abs)
         return replace(self, path = new_path)
 
 
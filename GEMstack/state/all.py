@@ -10,9 +10,13 @@ from .mission import MissionObjective
 from .route import Route
 from .trajectory import Trajectory
 from .predicates import PredicateValues
-from typing import Dict,List,Optional
+from typing import Dict,List,Optional,Any
 from .agent import AgentState
 from .agent import AgentEnum
+import threading
+
+#guards the generation counter, since components running in parallel may set items at the same time
+_VERSION_LOCK = threading.Lock()
 
 @dataclass
 @register
@@ -61,6 +65,62 @@ class AllState(SceneState):
     tracking_frames : Dict[AgentEnum, Dict[int, Dict[int, AgentState]]] = None
     predicted_trajectories : List[Dict[List[AgentState]]] = None
 
+    def __post_init__(self):
+        object.__setattr__(self,'_generation',0)
+        object.__setattr__(self,'_versions',dict())
+        object.__setattr__(self,'_snapshot',None)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self,name,value)
+        versions = self.__dict__.get('_versions')
+        if versions is not None and not name.startswith('_'):
+            with _VERSION_LOCK:
+                generation = self._generation + 1
+                object.__setattr__(self,'_generation',generation)
+                versions[name] = generation
+
+    @property
+    def generation(self) -> int:
+        """A counter that increases every time an item of the state is set."""
+        return self._generation
+
+    def version(self, name : str) -> int:
+        """Returns the generation at which the item `name` was last set, or 0
+        if it hasn't been set since construction."""
+        return self._versions.get(name,0)
+
+    def changed_since(self, generation : int) -> List[str]:
+        """Returns the names of the items set after the given generation."""
+        return [k for k,v in self._versions.items() if v > generation]
+
+    def touch(self, *names : str) -> None:
+        """Marks the given items as changed.  Call this after modifying an
+        item in place, e.g., ``state.mission.type = X``, since only
+        assignments to the state's attributes are tracked."""
+        for name in names:
+            setattr(self,name,getattr(self,name))
+
+    def snapshot(self) -> AllStateSnapshot:
+        """Returns a read-only view of the current generation of the state.
+
+        This is a shallow copy, so it is cheap to make, and repeated calls
+        without an intervening write return the same object.  Later
+        assignments to the state do not affect the snapshot, but items
+        modified in place are shared, so writers should assign new values
+        rather than modifying items that readers may hold.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.generation != self._generation:
+            values = dict((k,v) for k,v in self.__dict__.items() if not k.startswith('_'))
+            snapshot = AllStateSnapshot(values,dict(self._versions),self._generation)
+            object.__setattr__(self,'_snapshot',snapshot)
+        return snapshot
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_snapshot'] = None
+        return state
+
     @staticmethod
     def zero():
         scene_zero = SceneState.zero()
@@ -74,4 +134,42 @@ class AllState(SceneState):
         new_intent = None if self.intent is None else self.intent.to_frame(frame,current_pose=self.vehicle.pose,start_pose_abs=spose)
         new_route = None if self.route is None else self.route.to_frame(frame,current_pose=self.vehicle.pose,start_pose_abs=spose)
         new_trajectory = None if self.trajectory is None else self.trajectory.to_frame(frame,current_pose=self.vehicle.pose,start_pose_abs=spose)
-        return replace(scene_to_frame, agent_intents = new_intents, route = new_route, trajectory = new_trajectory, intent=new_intent)
\ No newline at end of file
+        return replace(scene_to_frame, agent_intents = new_intents, route = new_route, trajectory = new_trajectory, intent=new_intent)
+
+
+class AllStateSnapshot:
+    """A read-only view of an AllState at a given generation, returned by
+    :meth:`AllState.snapshot`.  Items are accessed as attributes, as with
+    AllState.
+    """
+    __slots__ = ('_values','_versions','generation')
+
+    def __init__(self, values : Dict[str,Any], versions : Dict[str,int], generation : int):
+        object.__setattr__(self,'_values',values)
+        object.__setattr__(self,'_versions',versions)
+        object.__setattr__(self,'generation',generation)
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError("AllState has no item {}".format(name)) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("AllStateSnapshot is read-only")
+
+    def __reduce__(self):
+        return (AllStateSnapshot,(self._values,self._versions,self.generation))
+
+    def version(self, name : str) -> int:
+        return self._versions.get(name,0)
+
+    def changed_since(self, generation : int) -> List[str]:
+        return [k for k,v in self._versions.items() if v > generation]
+
+    def to_state(self) -> AllState:
+        """Returns a new AllState with the same items."""
+        return AllState(**self._values)
+
+    def to_frame(self, frame : ObjectFrameEnum) -> AllState:
+        return self.to_state().to_frame(frame)
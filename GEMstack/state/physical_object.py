@@ -4,6 +4,9 @@ from ..mathutils import transforms
 from ..utils.serialization import register
 from typing import Tuple,List,Optional
 from enum import Enum
+import math
+from collections import OrderedDict
+import threading
 import numpy as np
 from klampt.math import so2,so3,se3
 
@@ -185,33 +188,7 @@ class ObjectPose:
         """
         if self.frame == new_frame:
             return replace(self)
-        frame_chain = _get_frame_chain(self.frame,new_frame,current_pose,start_pose_abs)
-        if self.yaw is None:
-            pt = (self.x,self.y)
-            for (frame,pose,dir) in frame_chain[1:]:
-                if dir == 1:
-                    pt = pose.apply(pt)
-                else:
-                    pt = pose.apply_inv(pt)
-            new_x,new_y = pt
-            new_yaw = None
-        else:
-            xyhead = (self.x,self.y,self.yaw)
-            for (frame,pose,dir) in frame_chain[1:]:
-                if dir == 1:
-                    xyhead = pose.apply_xyhead(xyhead)
-                else:
-                    xyhead = pose.apply_inv_xyhead(xyhead)
-            new_x,new_y,new_yaw = xyhead
-        new_z = self.z
-        if new_z is not None:
-            for (frame,pose,dir) in frame_chain[1:]:
-                if pose.z is not None:
-                    new_z += pose.z*dir
-        new_t = self.t
-        for (frame,pose,dir) in frame_chain[1:]:
-            new_t += pose.t*dir
-        return replace(self, frame=new_frame, t=new_t,x=new_x, y=new_y, z=new_z, yaw=new_yaw)
+        return get_frame_converter(self.frame,new_frame,current_pose,start_pose_abs).poses([self])[0]
 
 
 @dataclass
@@ -308,6 +285,212 @@ def _get_frame_chain(source_frame : ObjectFrameEnum, target_frame : ObjectFrameE
     return frame_chain
 
 
+class FrameConverter:
+    """Converts batches of points, vectors, and poses from one frame to
+    another.
+
+    The frame chain is compiled once: consecutive Cartesian steps are composed
+    into single homogeneous transforms, so a batch is converted with one
+    matrix product per run of Cartesian steps.  Steps through a GLOBAL pose
+    convert between lat/lon and local east/north coordinates.
+
+    Use :func:`get_frame_converter` to reuse converters between calls.
+    """
+    def __init__(self, source_frame : ObjectFrameEnum, target_frame : ObjectFrameEnum,
+                 current_pose : ObjectPose = None, start_pose_abs : ObjectPose = None):
+        self.source_frame = source_frame
+        self.target_frame = target_frame
+        self.dt = 0.0                   #added to times
+        self.dz = 0.0                   #added to pose z coordinates
+        self.rotation2d = np.eye(2)     #applied to 2D vectors
+        self.rotation3d = np.eye(3)     #applied to 3D vectors
+        self.heading_sign = 1.0         #headings h are converted to heading_sign*h + heading_offset
+        self.heading_offset = 0.0
+        self.steps = []                 #list of ('cartesian',T2,T3) or ('global',pose,dir) steps
+        for (frame,pose,dir) in _get_frame_chain(source_frame,target_frame,current_pose,start_pose_abs)[1:]:
+            self.dt += pose.t*dir
+            if pose.z is not None:
+                self.dz += pose.z*dir
+            R2 = pose.rotation2d()
+            R3 = pose.rotation()
+            yaw = pose.yaw if pose.yaw is not None else 0.0
+            if dir == 1:
+                self.rotation2d = R2.dot(self.rotation2d)
+                self.rotation3d = R3.dot(self.rotation3d)
+            else:
+                self.rotation2d = R2.T.dot(self.rotation2d)
+                self.rotation3d = R3.T.dot(self.rotation3d)
+            if pose.frame == ObjectFrameEnum.GLOBAL:
+                self.heading_sign,self.heading_offset = -self.heading_sign,yaw - self.heading_offset
+                self.steps.append(('global',pose,dir))
+                continue
+            self.heading_offset += yaw*dir
+            t = pose.translation()
+            T2 = _homogeneous(R2,t[:2],dir)
+            T3 = _homogeneous(R3,t,dir)
+            if len(self.steps) > 0 and self.steps[-1][0] == 'cartesian':
+                _,T2prev,T3prev = self.steps[-1]
+                self.steps[-1] = ('cartesian',T2.dot(T2prev),T3.dot(T3prev))
+            else:
+                self.steps.append(('cartesian',T2,T3))
+        #coefficients for converting single poses without NumPy overhead
+        self.affine2d = None
+        if len(self.steps) == 1 and self.steps[0][0] == 'cartesian':
+            self.affine2d = tuple(self.steps[0][1][:2].flatten().tolist())
+
+    def points(self, pts) -> np.ndarray:
+        """Converts an n x 2 or n x 3 array of points."""
+        pts = np.asarray(pts,dtype=float)
+        d = pts.shape[-1]
+        if d not in [2,3]:
+            raise ValueError("Must provide 2D or 3D points")
+        for step in self.steps:
+            if step[0] == 'cartesian':
+                T = step[1] if d == 2 else step[2]
+                pts = pts.dot(T[:d,:d].T) + T[:d,d]
+            else:
+                pose,dir = step[1],step[2]
+                oz = pose.z if pose.z is not None else 0.0
+                res = np.empty(pts.shape)
+                if dir == 1:
+                    res[...,:2] = _local_to_global(pts[...,:2].dot(pose.rotation2d().T),pose.x,pose.y)
+                else:
+                    res[...,:2] = _global_to_local(pts[...,:2],pose.x,pose.y).dot(pose.rotation2d())
+                if d == 3:
+                    res[...,2] = pts[...,2] + oz*dir
+                pts = res
+        return pts
+
+    def vectors(self, vecs) -> np.ndarray:
+        """Converts an n x 2 or n x 3 array of directions."""
+        vecs = np.asarray(vecs,dtype=float)
+        R = self.rotation2d if vecs.shape[-1] == 2 else self.rotation3d
+        return vecs.dot(R.T)
+
+    def headings(self, headings) -> np.ndarray:
+        """Converts an array of yaws / headings, in radians."""
+        return np.mod(self.heading_sign*np.asarray(headings,dtype=float) + self.heading_offset,2*np.pi)
+
+    def xyheads(self, states) -> np.ndarray:
+        """Converts an n x 3 array of (x,y,heading) states."""
+        states = np.asarray(states,dtype=float)
+        res = np.empty(states.shape)
+        res[...,:2] = self.points(states[...,:2])
+        res[...,2] = self.headings(states[...,2])
+        return res
+
+    def poses(self, poses : List[ObjectPose]) -> List[ObjectPose]:
+        """Converts poses in the source frame.  Equivalent to calling
+        to_frame on each pose."""
+        if len(poses) == 0:
+            return []
+        if self.affine2d is not None and len(poses) <= 4:
+            a,b,tx,c,d,ty = self.affine2d
+            xy = [(a*p.x + b*p.y + tx,c*p.x + d*p.y + ty) for p in poses]
+            newyaws = [(self.heading_sign*p.yaw + self.heading_offset) % (2*math.pi) if p.yaw is not None else None for p in poses]
+            return [replace(p, frame=self.target_frame, t=p.t+self.dt, x=pt[0], y=pt[1],
+                            z=(p.z+self.dz if p.z is not None else None), yaw=yaw)
+                    for p,pt,yaw in zip(poses,xy,newyaws)]
+        xy = self.points([(p.x,p.y) for p in poses]).tolist()
+        yaws = [i for i,p in enumerate(poses) if p.yaw is not None]
+        newyaws = [None]*len(poses)
+        if len(yaws) > 0:
+            for i,yaw in zip(yaws,self.headings([poses[i].yaw for i in yaws]).tolist()):
+                newyaws[i] = yaw
+        return [replace(p, frame=self.target_frame, t=p.t+self.dt, x=pt[0], y=pt[1],
+                        z=(p.z+self.dz if p.z is not None else None), yaw=yaw)
+                for p,pt,yaw in zip(poses,xy,newyaws)]
+
+    def close_to(self, other : FrameConverter, position_tolerance : float, angle_tolerance : float) -> bool:
+        """Returns True if this converter moves positions (but not
+        necessarily times) by at most about position_tolerance m and rotates
+        by at most angle_tolerance radians more than other does."""
+        if (self.source_frame,self.target_frame) != (other.source_frame,other.target_frame) or len(self.steps) != len(other.steps):
+            return False
+        if abs(self.dz - other.dz) > position_tolerance:
+            return False
+        for a,b in zip(self.steps,other.steps):
+            if a[0] != b[0]:
+                return False
+            if a[0] == 'cartesian':
+                if np.abs(a[2][:3,:3]-b[2][:3,:3]).max() > angle_tolerance or np.linalg.norm(a[2][:3,3]-b[2][:3,3]) > position_tolerance:
+                    return False
+            else:
+                pa,pb = a[1],b[1]
+                if a[2] != b[2] or np.abs(pa.rotation()-pb.rotation()).max() > angle_tolerance:
+                    return False
+                if math.hypot(*transforms.lat_lon_to_xy(pb.y,pb.x,pa.y,pa.x)) > position_tolerance:
+                    return False
+        return True
+
+
+def _homogeneous(R : np.ndarray, t : np.ndarray, dir : int) -> np.ndarray:
+    d = len(t)
+    T = np.eye(d+1)
+    if dir == 1:
+        T[:d,:d] = R
+        T[:d,d] = t
+    else:
+        T[:d,:d] = R.T
+        T[:d,d] = -R.T.dot(t)
+    return T
+
+def _local_to_global(en : np.ndarray, olon : float, olat : float) -> np.ndarray:
+    """Converts an array of (east,north) offsets in m to (lon,lat)."""
+    lat,lon = transforms.xy_to_lat_lon(en[...,0],en[...,1],olat,olon)
+    return np.stack((lon,lat),axis=-1)
+
+def _global_to_local(lonlat : np.ndarray, olon : float, olat : float) -> np.ndarray:
+    """Converts an array of (lon,lat) to (east,north) offsets in m."""
+    return np.stack(transforms.lat_lon_to_xy(lonlat[...,1],lonlat[...,0],olat,olon),axis=-1)
+
+
+FRAME_CONVERTER_CACHE_SIZE = 64
+_frame_converter_cache = OrderedDict()
+_frame_converter_lock = threading.Lock()
+
+def _pose_key(pose : Optional[ObjectPose]):
+    if pose is None:
+        return None
+    return (pose.frame,pose.t,pose.x,pose.y,pose.z,pose.yaw,pose.pitch,pose.roll)
+
+def get_frame_converter(source_frame : ObjectFrameEnum, target_frame : ObjectFrameEnum,
+                        current_pose : ObjectPose = None, start_pose_abs : ObjectPose = None) -> FrameConverter:
+    """Returns a FrameConverter between the given frames, reusing a cached one
+    if it was built from the same reference poses."""
+    key = (source_frame,target_frame,_pose_key(current_pose),_pose_key(start_pose_abs))
+    with _frame_converter_lock:
+        conv = _frame_converter_cache.get(key)
+        if conv is not None:
+            _frame_converter_cache.move_to_end(key)
+            return conv
+    conv = FrameConverter(source_frame,target_frame,current_pose,start_pose_abs)
+    with _frame_converter_lock:
+        _frame_converter_cache[key] = conv
+        while len(_frame_converter_cache) > FRAME_CONVERTER_CACHE_SIZE:
+            _frame_converter_cache.popitem(last=False)
+    return conv
+
+
+def convert_poses(poses : List[ObjectPose], target_frame : ObjectFrameEnum,
+                  current_pose : ObjectPose = None, start_pose_abs : ObjectPose = None) -> List[ObjectPose]:
+    """Converts a list of poses, possibly in different frames, to a new
+    frame.  Equivalent to calling to_frame on each, but converts all poses
+    in the same frame at once."""
+    res = [None]*len(poses)
+    groups = dict()
+    for i,p in enumerate(poses):
+        if p.frame == target_frame:
+            res[i] = replace(p)
+        else:
+            groups.setdefault(p.frame,[]).append(i)
+    for frame,inds in groups.items():
+        conv = get_frame_converter(frame,target_frame,current_pose,start_pose_abs)
+        for i,p in zip(inds,conv.poses([poses[i] for i in inds])):
+            res[i] = p
+    return res
+
+
 def convert_point(source_pt : tuple, source_frame : ObjectFrameEnum, target_frame : ObjectFrameEnum,
                   current_pose : ObjectPose = None, start_pose_abs : ObjectPose = None) -> tuple:
     """Converts an (x,y) or (x,y,z) point from one frame to another. 
@@ -318,14 +501,11 @@ def convert_point(source_pt : tuple, source_frame : ObjectFrameEnum, target_fram
 
     GLOBAL and ABSOLUTE_CARTESIAN are incompatible.
     """
-    frame_chain = _get_frame_chain(source_frame,target_frame,current_pose,start_pose_abs)
-    pt = source_pt
-    for (frame,pose,dir) in frame_chain[1:]:
-        if dir == 1:
-            pt = pose.apply(pt)
-        else:
-            pt = pose.apply_inv(pt)
-    return pt
+    if source_frame == target_frame:
+        return source_pt
+    assert len(source_pt) in [2,3],"Must provide a 2D or 3D point"
+    conv = get_frame_converter(source_frame,target_frame,current_pose,start_pose_abs)
+    return tuple(conv.points(source_pt).tolist())
 
 def convert_vector(source_vec : tuple, source_frame : ObjectFrameEnum, target_frame : ObjectFrameEnum,
                   current_pose : ObjectPose = None, start_pose_abs : ObjectPose = None) -> tuple:
@@ -337,18 +517,8 @@ def convert_vector(source_vec : tuple, source_frame : ObjectFrameEnum, target_fr
 
     GLOBAL and ABSOLUTE_CARTESIAN are incompatible.
     """
-    frame_chain = _get_frame_chain(source_frame,target_frame,current_pose,start_pose_abs)
-    vec = source_vec
-    for (frame,pose,dir) in frame_chain[1:]:
-        if len(vec) == 2:
-            R = pose.rotation2d()
-        else:
-            R = pose.rotation()
-        if dir == 1:
-            vec = R.dot(vec)
-        else:
-            vec = R.T.dot(vec)
-    return tuple(vec)
+    conv = get_frame_converter(source_frame,target_frame,current_pose,start_pose_abs)
+    return tuple(conv.vectors(source_vec).tolist())
 
 def convert_xyhead(source_state : Tuple[float,float,float], source_frame : ObjectFrameEnum, target_frame : ObjectFrameEnum,
                    current_pose : ObjectPose = None, start_pose_abs : ObjectPose = None) -> Tuple[float,float,float]:
@@ -360,32 +530,23 @@ def convert_xyhead(source_state : Tuple[float,float,float], source_frame : Objec
 
     GLOBAL and ABSOLUTE_CARTESIAN are incompatible.
     """
-    frame_chain = _get_frame_chain(source_frame,target_frame,current_pose,start_pose_abs)
-
-    xyhead = source_state
-    for (frame,pose,dir) in frame_chain[1:]:
-        if dir == 1:
-            xyhead = pose.apply_xyhead(xyhead)
-        else:
-            xyhead = pose.apply_inv_xyhead(xyhead)
-    return xyhead
+    if source_frame == target_frame:
+        return source_state
+    conv = get_frame_converter(source_frame,target_frame,current_pose,start_pose_abs)
+    return tuple(conv.xyheads(source_state).tolist())
 
 
 def convert_points(source_pts : List[tuple], source_frame : ObjectFrameEnum, target_frame : ObjectFrameEnum,
                   current_pose : ObjectPose = None, start_pose_abs : ObjectPose = None) -> Tuple[float,float]:
     """Converts a list of (x,y) or (x,y,z) points from one frame to
-    another.  Faster than repeated calls to convert_point.
+    another.  Faster than repeated calls to convert_point.  source_pts may
+    also be an n x 2 or n x 3 array; use FrameConverter.points to get the
+    result as an array.
     """
-    frame_chain = _get_frame_chain(source_frame,target_frame,current_pose,start_pose_abs)
-    res = []
-    for pt in source_pts:
-        for (frame,pose,dir) in frame_chain[1:]:
-            if dir == 1:
-                pt = pose.apply(pt)
-            else:
-                pt = pose.apply_inv(pt)
-        res.append(pt)
-    return res
+    if len(source_pts) == 0:
+        return []
+    conv = get_frame_converter(source_frame,target_frame,current_pose,start_pose_abs)
+    return [tuple(p) for p in conv.points(source_pts).tolist()]
 
 
 def convert_xyheads(source_states : List[tuple], source_frame : ObjectFrameEnum, target_frame : ObjectFrameEnum,
@@ -393,14 +554,7 @@ def convert_xyheads(source_states : List[tuple], source_frame : ObjectFrameEnum,
     """Converts a list of (x,y,heading) states from one frame to another.
     Faster than repeated calls to convert_xyhead.
     """
-    frame_chain = _get_frame_chain(source_frame,target_frame,current_pose,start_pose_abs)
-
-    res = []
-    for xyhead in source_states:
-        for (frame,pose,dir) in frame_chain[1:]:
-            if dir == 1:
-                xyhead = pose.apply_xyhead(xyhead)
-            else:
-                xyhead = pose.apply_xyhead_inv(xyhead)
-        res.append(xyhead)
-    return res
+    if len(source_states) == 0:
+        return []
+    conv = get_frame_converter(source_frame,target_frame,current_pose,start_pose_abs)
+    return [tuple(s) for s in conv.xyheads(source_states).tolist()]
@@ -1,17 +1,23 @@
 from __future__ import annotations
 from ..utils.serialization import register
-from ..mathutils.transforms import point_segment_distance
-from .physical_object import ObjectFrameEnum, convert_point
+from ..mathutils.segment_index import SegmentIndex
+from .physical_object import ObjectFrameEnum, FrameConverter, convert_point, convert_points, get_frame_converter
 from .obstacle import Obstacle
 from .sign import Sign
 from .vehicle import VehicleState
 from enum import Enum
 from collections import defaultdict
-from dataclasses import dataclass, replace, field, asdict
+from dataclasses import dataclass, replace, field, fields
 import itertools
+import operator
 from typing import List,Tuple,Any,Optional,Dict
 import numpy as np
 
+#Roadgraph.to_frame reuses its last result for a frame while the conversion
+#moves points by less than this many m and rotates by less than this many radians
+FRAME_CACHE_POSITION_TOLERANCE = 1e-3
+FRAME_CACHE_ANGLE_TOLERANCE = 1e-5
+
 
 class RoadgraphCurveEnum(Enum):
     LANE_BOUNDARY = 0
@@ -85,7 +91,13 @@ class RoadgraphCurve:
 
     def to_frame(self, orig_frame : ObjectFrameEnum, new_frame : ObjectFrameEnum,
                  current_origin = None, global_origin = None) -> RoadgraphCurve:
-        return replace(self,segments=[[convert_point(p,orig_frame,new_frame,current_origin,global_origin) for p in seg] for seg in self.segments])
+        #convert all segments at once
+        pts = convert_points(sum(self.segments,[]),orig_frame,new_frame,current_origin,global_origin)
+        segments = []
+        for seg in self.segments:
+            segments.append(pts[:len(seg)])
+            pts = pts[len(seg):]
+        return replace(self,segments=segments)
 
     def polyline(self) -> List[Tuple[float,float,float]]:
         """Returns a contiguous polyline representation of the curve."""
@@ -118,6 +130,17 @@ class RoadgraphLane:
                         begin=self.begin.to_frame(orig_frame,new_frame,current_origin,global_origin) if self.begin is not None else None,
                         end=self.end.to_frame(orig_frame,new_frame,current_origin,global_origin) if self.end is not None else None)
 
+    def centerline(self) -> RoadgraphCurve:
+        """Returns the centerline of the lane.  If it isn't provided, it's
+        computed as the midpoints of the left and right boundaries and stored
+        in `center`."""
+        if self.center is None:
+            center = []
+            for l_seg, r_seg in zip(self.left.segments, self.right.segments):
+                center.append([tuple((l + r) / 2 for l,r in zip(lp,rp)) for lp, rp in zip(l_seg, r_seg)])
+            self.center = RoadgraphCurve(type=RoadgraphCurveEnum.LANE_BOUNDARY, segments=center, crossable=True)
+        return self.center
+
     def outline(self) -> List[Tuple[float,float,float]]:
         """Produces a 2D outline of the lane, including elevation.
 
@@ -150,7 +173,7 @@ class RoadgraphRegion:
     
     def to_frame(self, orig_frame : ObjectFrameEnum, new_frame : ObjectFrameEnum,
                  current_origin = None, global_origin = None) -> RoadgraphCurve:
-        return replace(self,outline=[convert_point(p,orig_frame,new_frame,current_origin,global_origin) for p in self.outline])
+        return replace(self,outline=convert_points(self.outline,orig_frame,new_frame,current_origin,global_origin))
 
 
 @dataclass
@@ -165,7 +188,7 @@ class RoadgraphConnection:
 
     def to_frame(self, orig_frame : ObjectFrameEnum, new_frame : ObjectFrameEnum,
                  current_origin = None, global_origin = None) -> RoadgraphCurve:
-        return replace(self,location=[convert_point(p,orig_frame,new_frame,current_origin,global_origin) for p in self.location])
+        return replace(self,location=convert_points(self.location,orig_frame,new_frame,current_origin,global_origin))
 
 
 @dataclass
@@ -245,18 +268,22 @@ class Roadgraph:
         return list(keys)
     
     def to_frame(self, frame : ObjectFrameEnum, current_pose = None, start_pose_abs = None) -> Roadgraph:
-        newcurves = dict()
-        for (k,c) in self.curves.items():
-            newc = c.to_frame(self.frame,frame,current_pose,start_pose_abs)
-            newcurves[k] = newc
-        newlanes = dict()
-        for (k,l) in self.lanes.items():
-            newl = l.to_frame(self.frame,frame,current_pose,start_pose_abs)
-            newlanes[k] = newl
-        newregions = dict()
-        for (k,r) in self.regions.items():
-            newr = r.to_frame(self.frame,frame,current_pose,start_pose_abs)
-            newregions[k] = newr
+        """Converts the roadgraph to another frame.
+
+        All points are converted at once, and the converted curves, lanes,
+        regions, and connections are cached per frame and reused while the
+        conversion changes by less than FRAME_CACHE_POSITION_TOLERANCE m and
+        FRAME_CACHE_ANGLE_TOLERANCE radians.  So the result shares them with
+        the results of later calls; don't modify them in place.
+        """
+        conv = get_frame_converter(self.frame,frame,current_pose,start_pose_abs)
+        frame_cache = self.__dict__.setdefault('_frame_cache',dict())
+        geometry = self.geometry()
+        cached = frame_cache.get(frame)
+        if cached is None or cached[0] is not geometry or not conv.close_to(cached[1],FRAME_CACHE_POSITION_TOLERANCE,FRAME_CACHE_ANGLE_TOLERANCE):
+            cached = (geometry,conv,geometry.to_frame(conv),dict())
+            frame_cache[frame] = cached
+        curves,lanes,regions,connections = cached[2]
         newsigns = dict()
         for (k,s) in self.signs.items():
             news = s.to_frame(frame,current_pose,start_pose_abs)
@@ -265,63 +292,246 @@ class Roadgraph:
         for (k,o) in self.static_obstacles.items():
             newo = o.to_frame(frame,current_pose,start_pose_abs)
             newstatic_obstacles[k] = newo
-        newconnections = []
-        for c in self.connections:
-            newc = c.to_frame(self.frame,frame,current_pose,start_pose_abs)
-            newconnections.append(newc)
-        return replace(self, frame = frame, curves = newcurves, lanes = newlanes, regions = newregions, signs = newsigns, static_obstacles = newstatic_obstacles, connections=newconnections)
-
-    def get_current_lane(self, state : VehicleState):
+        res = replace(self, frame = frame, curves = curves, lanes = lanes, regions = regions, signs = newsigns, static_obstacles = newstatic_obstacles, connections=connections)
+        #results with the same lanes share their lane index
+        res.__dict__['_shared_cache'] = cached[3]
+        return res
+
+    def geometry(self) -> RoadgraphGeometry:
+        """Returns the points of the curves, lanes, regions, and connections
+        as arrays, rebuilding them if any entry of those containers has been
+        added, removed, or replaced.  Call invalidate_geometry after modifying
+        the entries themselves in place."""
+        containers = (self.curves,self.lanes,self.regions,self.connections)
+        cache = self.__dict__.get('_geometry')
+        if cache is None or not all(_same_entries(c,e) for c,e in zip(containers,cache[0])):
+            cache = (tuple(_entries(c) for c in containers),RoadgraphGeometry(self))
+            self.__dict__['_geometry'] = cache
+        return cache[1]
+
+    def invalidate_geometry(self) -> None:
+        self.__dict__.pop('_geometry',None)
+        self.__dict__.pop('_frame_cache',None)
+
+    def __getstate__(self):
+        #the caches are rebuilt on demand, so don't pickle or copy them
+        state = self.__dict__.copy()
+        for k in ['_frame_cache','_geometry','_shared_cache','_lane_index']:
+            state.pop(k,None)
+        return state
+
+    def lane_index(self) -> LaneIndex:
+        """Returns the spatial index over the lane centerlines, building it
+        if a lane has been added, removed, or replaced.  Call
+        invalidate_lane_index after modifying a lane in place."""
+        store = self.__dict__.get('_shared_cache',self.__dict__)
+        cache = store.get('_lane_index')
+        if cache is None or not _same_entries(self.lanes,cache[0]):
+            cache = (_entries(self.lanes),LaneIndex(self.lanes))
+            store['_lane_index'] = cache
+        return cache[1]
+
+    def invalidate_lane_index(self) -> None:
+        self.__dict__.get('_shared_cache',self.__dict__).pop('_lane_index',None)
+
+    def nearest_lanes(self, point, k : int = 1) -> List[Tuple[str,float,float]]:
+        """Returns up to k (lane, distance, arc length) tuples for the lanes
+        whose centerlines are nearest to an (x,y) or (x,y,z) point, sorted
+        by distance.  The arc length is that of the closest point along the
+        lane's centerline."""
+        return self.lane_index().nearest(point,k)
+
+    def get_current_lane(self, state : VehicleState, previous_lane : Optional[str] = None, hysteresis : float = 0.0) -> Optional[str]:
+        """Returns the lane whose centerline is nearest to the vehicle.
+
+        If previous_lane is given, it's checked first and kept unless another
+        lane is more than `hysteresis` m closer.
+        """
         vehicle_point = (state.pose.x, state.pose.y, state.pose.z if state.pose.z is not None else 0)
-
-        closest_lane = None
-        smallest_dist = float('inf')
-        
-        for lane_label in self.lanes:
-            lane = self.lanes[lane_label]
-
-            if lane.center is None:
-                # compute the center line if it's not provided
-                left = lane.left.segments
-                right = lane.right.segments
-
-                center = []
-                for l_seg, r_seg in zip(left, right):
-                    center_seg = []
-                    for lp, rp in zip(l_seg, r_seg):
-                        this_point = ((lp[0] + rp[0]) / 2, (lp[1] + rp[1]) / 2, (lp[2] + rp[2]) / 2)
-                        center_seg.append(this_point)
-                    center.append(center_seg)
-                
-                lane.center = RoadgraphCurve(type=RoadgraphCurveEnum.LANE_BOUNDARY, segments=center, crossable=True)
-
-            else: 
-                center = lane.center.segments
-
-            for seg in center:
-                for i in range(len(seg)-1):
-                    dist, _ = point_segment_distance(vehicle_point, seg[i], seg[i+1])
-
-                    if dist < smallest_dist:
-                        smallest_dist = dist
-                        closest_lane = lane_label
-                        break
-                    
-                if closest_lane == lane_label:
+        index = self.lane_index()
+        if previous_lane is not None and previous_lane in index.lane_segments:
+            prev_dist,_ = index.lane_distance(vehicle_point,previous_lane)
+            #only lanes closer than the previous one need to be considered
+            nearest = index.nearest(vehicle_point,1,max_distance=prev_dist)
+            if len(nearest) == 0 or prev_dist <= nearest[0][1] + hysteresis:
+                return previous_lane
+            return nearest[0][0]
+        nearest = index.nearest(vehicle_point,1)
+        return nearest[0][0] if len(nearest) > 0 else None
+
+
+class LaneIndex:
+    """A spatial index over the centerline segments of a set of lanes, for
+    finding the lanes nearest to a point.  Built by Roadgraph.lane_index().
+
+    Points are compared in 3D; 2D centerline points and queries get z=0.
+    """
+    def __init__(self, lanes : Dict[str,RoadgraphLane]):
+        self.lane_names = []
+        self.lane_segments = dict()     # type: Dict[str,np.ndarray]
+        a,b,seg_lane,seg_start = [],[],[],[]
+        nseg = 0
+        for name,lane in lanes.items():
+            if lane.center is None and (lane.left is None or lane.right is None):
+                continue
+            first = nseg
+            s = 0.0
+            for piece in lane.centerline().segments:
+                pts = np.array([_point3(p) for p in piece]).reshape(-1,3)
+                if len(pts) < 2:
+                    continue
+                lens = np.linalg.norm(np.diff(pts,axis=0),axis=1)
+                a.append(pts[:-1])
+                b.append(pts[1:])
+                seg_start.append(s + np.concatenate(([0.0],np.cumsum(lens[:-1]))))
+                s += float(lens.sum())
+                seg_lane.append(np.full(len(pts)-1,len(self.lane_names)))
+                nseg += len(pts)-1
+            if nseg > first:
+                self.lane_segments[name] = np.arange(first,nseg)
+                self.lane_names.append(name)
+        self.index = None
+        if len(a) > 0:
+            self.index = SegmentIndex.from_segments(np.concatenate(a),np.concatenate(b))
+            self.seg_lane = np.concatenate(seg_lane)
+            self.seg_start = np.concatenate(seg_start)
+
+    def _arc_length(self, seg : np.ndarray, u : np.ndarray) -> np.ndarray:
+        return self.seg_start[seg] + u*np.linalg.norm(self.index.b[seg]-self.index.a[seg],axis=-1)
+
+    def lane_distance(self, point, lane : str) -> Tuple[float,float]:
+        """Returns the (distance, arc length) of the closest point on a
+        lane's centerline."""
+        seg = self.lane_segments[lane]
+        d,u = self.index.project(_point3(point),seg)
+        i = int(np.argmin(d))
+        return float(d[i]),float(self._arc_length(seg[i],u[i]))
+
+    def nearest(self, point, k : int = 1, max_distance : Optional[float] = None) -> List[Tuple[str,float,float]]:
+        """Returns up to k (lane, distance, arc length) tuples for the nearest
+        lanes, sorted by distance.  If max_distance is given, only lanes at
+        most that far away are returned."""
+        if self.index is None or k <= 0:
+            return []
+        x = _point3(point)
+        bound = max_distance
+        if bound is None:
+            #find candidate segments on at least k lanes; the k'th nearest of
+            #those lanes bounds the distance to the k'th nearest lane
+            m = 8*k
+            while True:
+                seg = np.unique(self.index.nearest_segments(x,m))
+                lanes = np.unique(self.seg_lane[seg])
+                if len(lanes) >= k or m >= len(self.index.samples):
                     break
+                m *= 4
+            d,_ = self.index.project(x,seg)
+            lane_dists = np.full(len(self.lane_names),np.inf)
+            np.minimum.at(lane_dists,self.seg_lane[seg],d)
+            bound = float(np.sort(lane_dists)[min(k,len(lanes))-1])
+        seg = self.index.segments_within(x,bound)
+        if len(seg) == 0:
+            return []
+        d,u = self.index.project(x,seg)
+        lanes = self.seg_lane[seg]
+        #the closest segment of each lane, then the k closest lanes
+        order = np.lexsort((seg,d,lanes))
+        first = np.ones(len(order),dtype=bool)
+        first[1:] = lanes[order[1:]] != lanes[order[:-1]]
+        best = order[first]
+        best = best[np.lexsort((lanes[best],d[best]))][:k]
+        if max_distance is not None:
+            best = best[d[best] <= max_distance]
+        s = self._arc_length(seg[best],u[best])
+        return [(self.lane_names[l],float(di),float(si)) for l,di,si in zip(lanes[best],d[best],s)]
+
+
+def _entries(container) -> tuple:
+    #holds on to the entries themselves, so that new ones can't get the same
+    #ids once the old ones are freed
+    if isinstance(container,dict):
+        return (tuple(container),tuple(container.values()))
+    return (None,tuple(container))
+
+
+def _same_entries(container, entries : tuple) -> bool:
+    """Returns whether a dict or list still holds exactly the given entries
+    (as returned by _entries), with the values compared by identity."""
+    keys,values = entries
+    if len(container) != len(values):
+        return False
+    if isinstance(container,dict):
+        return tuple(container) == keys and all(map(operator.is_,container.values(),values))
+    return all(map(operator.is_,container,values))
+
+
+def _point3(p) -> Tuple[float,float,float]:
+    return (p[0],p[1],p[2] if len(p) > 2 and p[2] is not None else 0.0)
+
+
+class RoadgraphGeometry:
+    """The points of a roadgraph's curves, lanes, regions, and connections,
+    gathered into an array of 2D points and an array of 3D points so they
+    can all be converted to another frame at once.  Built by
+    Roadgraph.geometry().
+    """
+    def __init__(self, roadgraph : Roadgraph):
+        #the entities at build time, so the points can be put back even if
+        #lanes are given centerlines later
+        self.curves = list(roadgraph.curves.items())
+        self.lanes = [(k,l,(l.left,l.right,l.center,l.begin,l.end)) for k,l in roadgraph.lanes.items()]
+        self.regions = list(roadgraph.regions.items())
+        self.connections = list(roadgraph.connections)
+        self.pieces = []        # type: List[Tuple[int,int,int]]
+        points = ([],[])
+        def add(piece):
+            d = len(piece[0]) if len(piece) > 0 else 2
+            if d not in [2,3]:
+                raise ValueError("Must provide 2D or 3D points")
+            self.pieces.append((d-2,len(points[d-2]),len(piece)))
+            points[d-2].extend(piece)
+        for k,c in self.curves:
+            for seg in c.segments:
+                add(seg)
+        for k,l,lane_curves in self.lanes:
+            for c in lane_curves:
+                if c is not None:
+                    for seg in c.segments:
+                        add(seg)
+        for k,r in self.regions:
+            add(r.outline)
+        for c in self.connections:
+            add(c.location)
+        self.points = (np.array(points[0],dtype=float).reshape(-1,2),np.array(points[1],dtype=float).reshape(-1,3))
+
+    def to_frame(self, conv : FrameConverter) -> Tuple[Dict[str,RoadgraphCurve],Dict[str,RoadgraphLane],Dict[str,RoadgraphRegion],List[RoadgraphConnection]]:
+        """Returns the curves, lanes, regions, and connections converted to
+        the converter's target frame."""
+        converted = [conv.points(p).tolist() if len(p) > 0 else [] for p in self.points]
+        pieces = iter(self.pieces)
+        def take():
+            d,start,count = next(pieces)
+            return [tuple(p) for p in converted[d][start:start+count]]
+        def curve(c):
+            return replace(c,segments=[take() for seg in c.segments]) if c is not None else None
+        curves = {k:curve(c) for k,c in self.curves}
+        lanes = dict()
+        for k,l,lane_curves in self.lanes:
+            left,right,center,begin,end = [curve(c) for c in lane_curves]
+            lanes[k] = replace(l,left=left,right=right,center=center,begin=begin,end=end)
+        regions = {k:replace(r,outline=take()) for k,r in self.regions}
+        connections = [replace(c,location=take()) for c in self.connections]
+        return curves,lanes,regions,connections
 
-        return closest_lane
 
 
 class RoadgraphNetwork(Roadgraph):
     """Stores all of the items within a Roadgraph but also allows for fast
     lookup of connections. This is used in routing.
-    
-    NOT TESTED YET.
     """
     def __init__(self, roadgraph = None):
         if roadgraph is not None:
-            Roadgraph.__init__(self,**asdict(roadgraph))
+            Roadgraph.__init__(self,**{f.name:getattr(roadgraph,f.name) for f in fields(Roadgraph)})
         else:
             Roadgraph.__init__(self,ObjectFrameEnum.GLOBAL)
         
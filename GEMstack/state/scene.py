@@ -1,9 +1,9 @@
 from __future__ import annotations
 from dataclasses import dataclass, field, replace
 from ..utils.serialization import register
-from .physical_object import ObjectFrameEnum,ObjectPose
+from .physical_object import ObjectFrameEnum,ObjectPose,convert_poses
 from .vehicle import VehicleState
-from .agent import AgentState
+from .agent import AgentState,agents_to_frame
 from .sign import Sign
 from .roadgraph import Roadgraph
 from .environment import EnvironmentState
@@ -40,10 +40,12 @@ class SceneState:
 
     @staticmethod
     def zero():
-        return SceneState(0.0,VehicleState.zero(),Roadgraph.zero(),EnvironmentState(),None,{},{})
+        return SceneState(0.0,VehicleState.zero(),Roadgraph.zero(),EnvironmentState(),None,{},{},None)
 
     def to_frame(self, frame : ObjectFrameEnum, current_pose = None, start_pose_abs = None) -> SceneState:
+        agents = agents_to_frame(list(self.agents.values()),frame,current_pose,start_pose_abs)
+        obstacle_poses = convert_poses([o.pose for o in self.obstacles.values()],frame,current_pose,start_pose_abs)
         return replace(self, vehicle=self.vehicle.to_frame(frame,current_pose,start_pose_abs),
             roadgraph=self.roadgraph.to_frame(frame,current_pose,start_pose_abs),
-            agents={k:v.to_frame(frame,current_pose,start_pose_abs) for k,v in self.agents.items()},
-            obstacles={k:v.to_frame(frame,current_pose,start_pose_abs) for k,v in self.obstacles.items()})
\ No newline at end of file
+            agents=dict(zip(self.agents.keys(),agents)),
+            obstacles={k:replace(o,pose=p) for (k,o),p in zip(self.obstacles.items(),obstacle_poses)})
\ No newline at end of file
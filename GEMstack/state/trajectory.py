@@ -2,20 +2,63 @@ from __future__ import annotations
 from dataclasses import dataclass,replace
 from ..utils.serialization import register
 from ..mathutils import transforms,collisions
-from .physical_object import ObjectFrameEnum, convert_point
+from ..mathutils.segment_index import SegmentIndex,project_segments
+from .physical_object import ObjectFrameEnum, convert_point, convert_points
 import math
+import bisect
+import numpy as np
 from typing import List,Tuple,Optional,Union
 
 @dataclass
 @register
 class Path:
-    """An untimed, piecewise linear path."""
+    """An untimed, piecewise linear path.
+
+    The points are also kept as a NumPy array, along with the segment lengths
+    and cumulative arc length, which are computed on first use and cached
+    until `points` is replaced or changes length.  Call :meth:`invalidate`
+    after modifying points in place.
+
+    Closest-point queries on paths with at least INDEX_MIN_POINTS points use
+    a spatial index over the segments, built on first use.
+    """
     frame : ObjectFrameEnum
     points : List[List[float]]
 
+    INDEX_MIN_POINTS = 200
+
+    def invalidate(self) -> None:
+        """Clears the cached arrays.  Call this after modifying points in
+        place."""
+        self.__dict__.pop('_arrays',None)
+        self.__dict__.pop('_segment_index',None)
+
+    def arrays(self) -> Tuple[np.ndarray,np.ndarray,np.ndarray]:
+        """Returns the points as an n x d array, the n-1 segment lengths, and
+        the cumulative arc length at each of the n points."""
+        cache = self.__dict__.get('_arrays')
+        #the cache holds on to the points list itself, so that a new list can't
+        #get the same id once the old one is freed
+        if cache is None or cache[0] is not self.points or cache[1] != len(self.points):
+            pts = np.asarray(self.points,dtype=float).reshape(len(self.points),-1)
+            seglens = np.linalg.norm(np.diff(pts,axis=0),axis=1)
+            cumlens = np.concatenate(([0.0],np.cumsum(seglens)))
+            cache = (self.points,len(self.points),pts,seglens,cumlens)
+            self.__dict__['_arrays'] = cache
+        return cache[2:]
+
+    def segment_index(self) -> SegmentIndex:
+        """Returns the spatial index over the segments, building it if the
+        points have changed."""
+        cache = self.__dict__.get('_segment_index')
+        if cache is None or cache[0] is not self.points or cache[1] != len(self.points):
+            cache = (self.points,len(self.points),SegmentIndex(self.arrays()[0]))
+            self.__dict__['_segment_index'] = cache
+        return cache[2]
+
     def to_frame(self, frame : ObjectFrameEnum, current_pose = None, start_pose_abs =  None) -> Path:
         """Converts the route to a different frame."""
-        new_points = [convert_point(p,self.frame,frame,current_pose,start_pose_abs) for p in self.points]
+        new_points = convert_points(self.points,self.frame,frame,current_pose,start_pose_abs)
         return replace(self,frame=frame,points=new_points)
 
     def domain(self) -> Tuple[float,float]:
@@ -34,10 +77,25 @@ class Path:
         if u < 0: u = 0
         return ind,u
 
-    def eval(self, u : float) -> List[float]:
+    def parameters_to_indices(self, us : np.ndarray) -> Tuple[np.ndarray,np.ndarray]:
+        """Batched version of :meth:`parameter_to_index`, returning arrays
+        of edge indices and edge parameters."""
+        us = np.asarray(us,dtype=float)
+        if len(self.points) < 2:
+            return np.zeros(us.shape,dtype=int),np.zeros(us.shape)
+        ind = np.clip(np.floor(us),0,len(self.points)-2).astype(int)
+        return ind,np.clip(us-ind,0.0,1.0)
+
+    def eval(self, u : Union[float,np.ndarray]) -> Union[List[float],np.ndarray]:
         """Evaluates the path at a given parameter.  The integer part of u
         indicates the segment, and the fractional part indicates the progress
-        along the segment"""
+        along the segment.
+
+        If u is an array or list of parameters, returns an array with one
+        point per row."""
+        if np.ndim(u) > 0:
+            ind,s = self.parameters_to_indices(u)
+            return self._eval_indices(ind,s)
         if len(self.points) < 2:
             return self.points[0]
         ind,u = self.parameter_to_index(u)
@@ -45,6 +103,12 @@ class Path:
         p2 = self.points[ind+1]
         return transforms.vector_madd(p1,transforms.vector_sub(p2,p1),u)
 
+    def _eval_indices(self, ind : np.ndarray, s : np.ndarray) -> np.ndarray:
+        pts = self.arrays()[0]
+        if len(pts) < 2:
+            return np.repeat(pts[:1],len(ind),axis=0)
+        return pts[ind] + (pts[ind+1]-pts[ind])*s[:,np.newaxis]
+
     def eval_derivative(self, u : float) -> List[float]:
         """Evaluates the derivative at a given parameter.  The integer part of 
         u indicates the segment, and the fractional part indicates the progress
@@ -61,25 +125,23 @@ class Path:
 
     def length(self):
         """Returns the length of the path."""
-        l = 0.0
-        for i in range(len(self.points)-1):
-            l += transforms.vector_dist(self.points[i],self.points[i+1])
-        return l
+        if len(self.points) < 2:
+            return 0.0
+        return float(self.arrays()[2][-1])
 
     def arc_length_parameterize(self, speed = 1.0) -> Trajectory:
         """Returns a new path that is parameterized by arc length."""
-        times = [0.0]
-        points = [self.points[0]]
-        for i in range(len(self.points)-1):
-            p1 = self.points[i]
-            p2 = self.points[i+1]
-            d = transforms.vector_dist(p1,p2)
-            if d > 0:
-                points.append(p2)
-                times.append(times[-1] + d/speed)
+        pts,seglens,cumlens = self.arrays()
+        #drop repeated points
+        keep = [0] + (np.nonzero(seglens > 0)[0]+1).tolist()
+        points = [self.points[i] for i in keep]
+        times = (cumlens[keep]/speed).tolist()
         # check whether self has attribute yaws
         if hasattr(self, 'yaws'):
-            return Trajectory(frame=self.frame,points=points,times=times,yaws=self.yaws)
+            yaws = self.yaws
+            if yaws is not None and len(yaws) == len(self.points):
+                yaws = [yaws[i] for i in keep]
+            return Trajectory(frame=self.frame,points=points,times=times,yaws=yaws)
         return Trajectory(frame=self.frame,points=points,times=times)
 
     def closest_point(self, x : List[float], edges = True) -> Tuple[float,float]:
@@ -89,22 +151,18 @@ class Path:
         
         Returns (distance, closest_parameter)
         """
-        best_dist = float('inf')
-        best_point = None
-        for i,p in enumerate(self.points):
-            if edges and i > 0: 
-                p1 = self.points[i-1]
-                p2 = p
-                dist,u = transforms.point_segment_distance(x,p1,p2)
-                if dist < best_dist:
-                    best_dist = dist
-                    best_point = i-1+u
-            else:
-                dist = transforms.vector_dist(p,x)
-                if dist < best_dist:
-                    best_dist = dist
-                    best_point = i
-        return best_dist,best_point
+        if edges and len(self.points) >= self.INDEX_MIN_POINTS:
+            return self.segment_index().closest_point(x)
+        return self._closest_point(x,0,len(self.points)-1,edges)
+
+    def closest_points(self, xs : np.ndarray, edges = True) -> Tuple[np.ndarray,np.ndarray]:
+        """Batched version of :meth:`closest_point` for an m x d array of
+        points.  Returns arrays of m distances and m parameters."""
+        xs = np.asarray(xs,dtype=float)
+        if edges and len(self.points) >= 2:
+            return self.segment_index().closest_points(xs)
+        res = [self._closest_point(x,0,len(self.points)-1,edges) for x in xs]
+        return np.array([r[0] for r in res]),np.array([r[1] for r in res],dtype=float)
 
     def closest_point_local(self, x : List[float], param_range=Tuple[float,float], edges = True) -> Tuple[float,float]:
         """Returns the closest point on the path to the given point within
@@ -115,31 +173,56 @@ class Path:
         
         Returns (distance, closest_parameter)
         """
-        best_dist = float('inf')
         param_range = [max(param_range[0],0),min(param_range[1],len(self.points))]
         imin = int(math.floor(param_range[0]))
         imax = int(math.floor(param_range[1]))
         if imax == len(self.points):
             imax -= 1
-        
-        umin = param_range[0] - imin
-        umax = param_range[1] - imax
-        best_point = None
-        for i in range(imin,imax+1):
-            p = self.points[i]
-            if edges and i > 0: 
-                p1 = self.points[i-1]
-                p2 = p
-                dist,u = transforms.point_segment_distance(x,p1,p2)
-                if dist < best_dist:
-                    best_dist = dist
-                    best_point = i-1+u
-            else:
-                dist = transforms.vector_dist(p,x)
-                if dist < best_dist:
-                    best_dist = dist
-                    best_point = i
-        return best_dist,best_point
+        return self._closest_point(x,imin,imax,edges)
+
+    def track_closest_point(self, x : List[float], prev_param : Optional[float] = None,
+                            lookbehind = 1.0, lookahead = 5.0, reset_distance : Optional[float] = None) -> Tuple[float,float]:
+        """Returns the closest point to x, warm-started from the parameter
+        prev_param returned by the previous call.
+
+        Searches [prev_param-lookbehind, prev_param+lookahead], and keeps
+        stepping the window forward while the closest point is at its end and
+        getting closer.  Falls back to a global search if prev_param is None
+        or if the result is further than reset_distance from x.
+
+        Returns (distance, closest_parameter)
+        """
+        if prev_param is None or len(self.points) < 2:
+            return Path.closest_point(self,x)
+        last = len(self.points)-1
+        hi = prev_param+lookahead
+        best = Path.closest_point_local(self,x,[prev_param-lookbehind,hi])
+        while best[1] is not None and math.floor(hi) < last and best[1] >= math.floor(hi) - 1e-9:
+            lo = math.floor(hi)
+            hi = lo + max(lookahead,1.0)
+            res = Path.closest_point_local(self,x,[lo,hi])
+            if res[0] >= best[0]:
+                break
+            best = res
+        if best[1] is None or (reset_distance is not None and best[0] > reset_distance):
+            return Path.closest_point(self,x)
+        return best
+
+    def _closest_point(self, x : List[float], imin : int, imax : int, edges : bool) -> Tuple[float,float]:
+        """Closest point to vertices imin...imax, or if edges=True, to the
+        edges between them."""
+        if imax < imin:
+            return float('inf'),None
+        pts = self.arrays()[0]
+        x = np.asarray(x,dtype=float)
+        if not edges or imax == 0:
+            dists = np.linalg.norm(pts[imin:imax+1]-x,axis=1)
+            i = int(np.argmin(dists))
+            return float(dists[i]),imin+i
+        imin = max(imin,1)
+        dists,u = project_segments(x,pts[imin-1:imax],pts[imin:imax+1])
+        i = int(np.argmin(dists))
+        return float(dists[i]),imin-1+i+float(u[i])
 
     def get_dims(self, dims : List[int]) -> Path:
         """Returns a new path with only the given dimensions."""
@@ -157,6 +240,7 @@ class Path:
                 raise ValueError("Invalid length of values to append")
             for p,v in zip(self.points,value):
                 p.append(v)
+        self.invalidate()
     
     def trim(self, start : float, end : float) -> Path:
         """Returns a copy of this path but trimmed to the given parameter range."""
@@ -178,18 +262,42 @@ class Trajectory(Path):
         """Returns the time parameter domain"""
         return (self.times[0],self.times[-1])
 
+    def time_array(self) -> np.ndarray:
+        """Returns the times as an array, cached like :meth:`arrays`."""
+        cache = self.__dict__.get('_time_array')
+        if cache is None or cache[0] is not self.times or cache[1] != len(self.times):
+            cache = (self.times,len(self.times),np.asarray(self.times,dtype=float))
+            self.__dict__['_time_array'] = cache
+        return cache[2]
+
+    def invalidate(self) -> None:
+        Path.invalidate(self)
+        self.__dict__.pop('_time_array',None)
+
     def time_to_index(self, t : float) -> Tuple[int,float]:
         """Converts a time to an (edge index, edge parameter) tuple."""
         if len(self.points) < 2:
             return 0,0.0
-        ind = 0
-        while ind < len(self.times) and self.times[ind] < t:
-            ind += 1
+        #first index with times[ind] >= t
+        ind = bisect.bisect_left(self.times,t)
         if ind == 0: return 0,0.0
         if ind >= len(self.times): return len(self.points)-2,1.0
         u = (t - self.times[ind-1])/(self.times[ind] - self.times[ind-1])
         return ind-1,u
     
+    def times_to_indices(self, ts : np.ndarray) -> Tuple[np.ndarray,np.ndarray]:
+        """Batched version of :meth:`time_to_index`, returning arrays of
+        edge indices and edge parameters."""
+        ts = np.asarray(ts,dtype=float)
+        if len(self.points) < 2:
+            return np.zeros(ts.shape,dtype=int),np.zeros(ts.shape)
+        times = self.time_array()
+        ind = np.searchsorted(times,ts,side='left')
+        edge = np.clip(ind-1,0,len(times)-2)
+        u = (ts - times[edge])/(times[edge+1]-times[edge])
+        u = np.where(ind == 0,0.0,np.where(ind >= len(times),1.0,u))
+        return edge,u
+
     def time_to_parameter(self, t : float) -> float:
         """Converts a time to a parameter."""
         ind,u = self.time_to_index(t)
@@ -207,8 +315,14 @@ class Trajectory(Path):
         if u < 0: u = 0
         return self.times[ind] + u*(self.times[ind+1]-self.times[ind])
 
-    def eval(self, t : float) -> List[float]:
-        """Evaluates the trajectory at a given time."""
+    def eval(self, t : Union[float,np.ndarray]) -> Union[List[float],np.ndarray]:
+        """Evaluates the trajectory at a given time.
+
+        If t is an array or list of times, returns an array with one point
+        per row."""
+        if np.ndim(t) > 0:
+            ind,u = self.times_to_indices(t)
+            return self._eval_indices(ind,u)
         if len(self.points) < 2:
             return self.points[0]
         ind,u = self.time_to_index(t)
@@ -278,6 +392,31 @@ class Trajectory(Path):
         distance, closest_index = Path.closest_point_local(self,x,param_range,edges)
         closest_time = self.parameter_to_time(closest_index)
         return distance, closest_time
+
+    def closest_points(self, xs : np.ndarray, edges = True) -> Tuple[np.ndarray,np.ndarray]:
+        """Batched version of :meth:`closest_point`.  Returns arrays of
+        distances and closest times."""
+        distances, params = Path.closest_points(self,xs,edges)
+        if len(self.points) < 2:
+            return distances, np.full(len(params),self.times[0])
+        ind,u = self.parameters_to_indices(params)
+        times = self.time_array()
+        return distances, times[ind] + u*(times[ind+1]-times[ind])
+
+    def track_closest_point(self, x : List[float], prev_time : Optional[float] = None,
+                            lookbehind = 1.0, lookahead = 5.0, reset_distance : Optional[float] = None) -> Tuple[float,float]:
+        """Like Path.track_closest_point, but with times rather than
+        parameters.
+
+        Returns (distance, closest_time)
+        """
+        if prev_time is None:
+            return self.closest_point(x)
+        prev_param = self.time_to_parameter(prev_time)
+        lookbehind = prev_param - self.time_to_parameter(prev_time-lookbehind)
+        lookahead = self.time_to_parameter(prev_time+lookahead) - prev_param
+        distance, closest_index = Path.track_closest_point(self,x,prev_param,lookbehind,lookahead,reset_distance)
+        return distance, self.parameter_to_time(closest_index)
     
     def trim(self, start : float, end : float) -> Trajectory:
         """Returns a copy of this trajectory but trimmed to the given time range."""
@@ -0,0 +1,87 @@
+import numpy as np
+import math
+from typing import Dict
+
+class LatencyHistogram:
+    """A fixed-memory histogram of durations in the style of HdrHistogram.
+
+    Values are bucketed log-linearly: each power of 2 between `lowest` and
+    `highest` is divided into `sub_buckets` equal buckets, so the relative
+    error of a reported percentile is at most 1/sub_buckets.  Values outside
+    the range are clamped into the first / last bucket, but the exact min,
+    max, and mean are always tracked.
+
+    Usage::
+
+        hist = LatencyHistogram()
+        hist.record(0.0123)
+        print(hist.percentile(99))
+
+    Args:
+        lowest (float): the smallest duration that can be resolved, in s.
+        highest (float): the largest duration that can be resolved, in s.
+        sub_buckets (int): number of buckets per power of 2.
+    """
+    def __init__(self, lowest : float = 1e-6, highest : float = 100.0, sub_buckets : int = 64):
+        self.lowest = lowest
+        self.highest = highest
+        self.sub_buckets = sub_buckets
+        self.num_octaves = int(math.ceil(math.log2(highest/lowest)))
+        self.counts = np.zeros(self.num_octaves*sub_buckets+1,dtype=np.int64)
+        self.reset()
+
+    def reset(self) -> None:
+        """Clears all recorded values."""
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def _index(self, value : float) -> int:
+        if value < self.lowest:
+            return 0
+        mantissa,exponent = math.frexp(value/self.lowest)   #value/lowest = mantissa*2^exponent, 0.5 <= mantissa < 1
+        octave = exponent-1
+        if octave >= self.num_octaves:
+            return len(self.counts)-1
+        return 1 + octave*self.sub_buckets + int((mantissa*2-1)*self.sub_buckets)
+
+    def _value(self, index : int) -> float:
+        """Returns the upper edge of the given bucket"""
+        if index == 0:
+            return self.lowest
+        octave,sub = divmod(index-1,self.sub_buckets)
+        return self.lowest*2**octave*(1.0 + (sub+1)/self.sub_buckets)
+
+    def record(self, value : float) -> None:
+        """Records a duration, in s."""
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def percentile(self, p : float) -> float:
+        """Returns the duration below which p percent of the recorded values
+        lie, to within the bucket resolution."""
+        if self.count == 0:
+            return 0.0
+        target = max(int(math.ceil(p*0.01*self.count)),1)
+        index = int(np.searchsorted(np.cumsum(self.counts),target))
+        return min(max(self._value(index),self.min),self.max)
+
+    def summary(self) -> Dict[str,float]:
+        """Returns a dict of count, mean, min, p50, p90, p99, and max."""
+        return {'count':self.count,
+                'mean':self.mean(),
+                'min':self.min if self.count > 0 else 0.0,
+                'p50':self.percentile(50),
+                'p90':self.percentile(90),
+                'p99':self.percentile(99),
+                'max':self.max}
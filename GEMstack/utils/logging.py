@@ -1,7 +1,16 @@
 from .serialization import deserialize,serialize,deserialize_collection,serialize_collection
+from dataclasses import fields as dataclass_fields
 import json
-from typing import Union,Tuple
+import struct
+import zlib
+import bisect
+import os
+import numpy as np
+from typing import Union,Tuple,List,Optional
 
+# A state format message containing this key is a keyframe, i.e., it contains
+# all of the logged items.  The value is the state time.
+KEYFRAME_KEY = '_keyframe'
 class Logfile:
     """A log file of serializable collections that can be read or written.
 
@@ -10,8 +19,11 @@ class Logfile:
     
     The second is a state format, where each line is a dictionary of the form
     ``{ITEM1:VAL, ITEM2:VAL, ITEM1_update_time:t, ITEM2_update_time:t}``.
+
+    When reading, `items` optionally restricts the items restored by
+    :meth:`seek`.
     """
-    def __init__(self, filename : str, delta_format: bool, mode='w'):
+    def __init__(self, filename : str, delta_format: bool, mode='w', items : List[str] = None):
         self.filename = filename
         try:
             self.file = open(filename,mode)
@@ -28,6 +40,9 @@ class Logfile:
         self.next_item_time = None
         self.start_time = None
         self.time_index = None
+        self.keyframe_index = None   # type: Optional[List[Tuple[float,int]]]
+        self.offset_index = None     # type: Optional[dict]
+        self.items = None if items is None else set(items)
     
     def __nonzero__(self):
         return self.file is not None and not self.eof 
@@ -47,6 +62,25 @@ class Logfile:
         """
         if self.mode != 'w':
             raise RuntimeError("Logfile is not open for writing")
+        self._write(self._make_message(message,fields,t))
+
+    def encode(self, message, fields=None, t : float = None) -> dict:
+        """Converts a message, as given to :meth:`log`, to the JSON-compatible
+        dict that :meth:`log_encoded` writes.  The result shares no objects
+        with the message, so the message may be modified afterwards, e.g.,
+        while the write is pending on another thread."""
+        message = self._make_message(message,fields,t)
+        if not isinstance(message,dict):
+            message = dict((f.name,getattr(message,f.name)) for f in dataclass_fields(message))
+        return serialize_collection(message,dict)
+
+    def log_encoded(self, message : dict) -> None:
+        """Logs a message returned by :meth:`encode`."""
+        if self.mode != 'w':
+            raise RuntimeError("Logfile is not open for writing")
+        self._write(message)
+
+    def _make_message(self, message, fields=None, t : float = None):
         if fields is not None:
             if isinstance(message,dict):
                 new_message = {k:message[k] for k in fields}
@@ -73,11 +107,15 @@ class Logfile:
                 if not isinstance(message,dict):
                     message = serialize(message,dict)['data']
                 message['time'] = t
-                
-        if isinstance(message,dict):
-            self.file.write(serialize_collection(message))
-        else:
-            self.file.write(serialize(message)['data'])
+        return message
+
+    def _write(self, message) -> None:
+        if not isinstance(message,dict):
+            message = dict((f.name,getattr(message,f.name)) for f in dataclass_fields(message))
+        elif KEYFRAME_KEY in message:
+            #keyframes are found by their prefix, see keyframes()
+            message = {KEYFRAME_KEY:message[KEYFRAME_KEY],**message}
+        self.file.write(serialize_collection(message))
         self.file.write('\n')
     
     def read(self,
@@ -130,6 +168,8 @@ class Logfile:
             self.start_time = self.next_item_time
             self.last_read_time = self.start_time
             self.time_index = self.start_time
+        if self.cumulative_item is None:
+            self.cumulative_item = {}
         next_t = 0
         if duration_to_advance is not None:
             if duration_to_advance < 0:
@@ -149,6 +189,7 @@ class Logfile:
         while self.next_item_time < next_t:
             self.last_read_time = self.next_item_time
             msgs.append(self.next_item)
+            self._accumulate(self.next_item)
             try:
                 self._read_next()
             except IOError:
@@ -166,16 +207,11 @@ class Logfile:
         if line == '':
             raise IOError("End of log file")
         msg = deserialize_collection(line[:-1])
-        if self.cumulative_item is None:
-            self.cumulative_item = {}
         if self.delta_format:
             #assumed to be of the form {'time':t,ITEM1:{...},ITEM2:{...}}
             assert 'time' in msg, "Invalid message read from log file"
             self.next_item = msg
             self.next_item_time = msg['time']
-            for o in msg:
-                if o != 'time':
-                    self.cumulative_item[o] = msg[o]
         else:
             #assumed to be state dictionaries of the form {ITEM1:VAL, ITEM2:VAL, ITEM1_update_time:t, ITEM2_update_time:t}
             self.next_item = msg
@@ -186,8 +222,451 @@ class Logfile:
                         self.next_item_time = v
                     else:
                         self.next_item_time = max(self.next_item_time,v)
+
+    def _accumulate(self, msg : dict) -> None:
+        if self.cumulative_item is None:
+            self.cumulative_item = {}
+        for o,v in msg.items():
+            if o != 'time' and o != KEYFRAME_KEY:
                 self.cumulative_item[o] = v
 
+    def keyframes(self) -> List[Tuple[float,int]]:
+        """Returns the (time, file offset) of each keyframe of a state format
+        log.  The lines are scanned without being decoded, and the result is
+        cached."""
+        if self.keyframe_index is None:
+            prefix = ('{"%s": ' % KEYFRAME_KEY).encode('utf-8')
+            index = []
+            offset = 0
+            with open(self.filename,'rb') as f:
+                for line in f:
+                    if line.startswith(prefix):
+                        end = line.find(b',',len(prefix))
+                        if end < 0:
+                            end = line.find(b'}',len(prefix))
+                        index.append((float(line[len(prefix):end]),offset))
+                    offset += len(line)
+            self.keyframe_index = index
+        return self.keyframe_index
+
+    def index_filename(self) -> str:
+        return self.filename + '.index.npz'
+
+    def offsets(self) -> dict:
+        """Returns an index of the log with the time and file offset of each
+        line, and the lines at which each item is set.  The result is a dict
+        with keys 'times', 'offsets', and 'items' (a dict from item to an
+        array of line numbers).
+
+        The index is built on first use, which takes one pass over the log,
+        and is saved in a sidecar file (see :meth:`index_filename`) that is
+        reused as long as the log's size doesn't change.
+        """
+        if self.offset_index is not None:
+            return self.offset_index
+        size = os.path.getsize(self.filename)
+        fn = self.index_filename()
+        if os.path.exists(fn):
+            try:
+                data = np.load(fn)
+                if int(data['size']) == size:
+                    self.offset_index = {'times':data['times'],'offsets':data['offsets'],
+                                         'items':dict((k[5:],data[k]) for k in data.files if k.startswith('item:'))}
+                    return self.offset_index
+            except (IOError,ValueError,KeyError):
+                pass
+        times = []
+        offsets = []
+        item_lines = dict()
+        offset = 0
+        with open(self.filename,'rb') as f:
+            for line in f:
+                if line.strip():
+                    msg = json.loads(line)
+                    if self.delta_format:
+                        times.append(msg['time'])
+                    else:
+                        times.append(max((v for k,v in msg.items() if k.endswith('_update_time') and v is not None),default=0.0))
+                    for k in msg:
+                        if k != 'time' and k != KEYFRAME_KEY:
+                            item_lines.setdefault(k,[]).append(len(offsets))
+                    offsets.append(offset)
+                offset += len(line)
+        self.offset_index = {'times':np.array(times,dtype=np.float64),
+                             'offsets':np.array(offsets,dtype=np.int64),
+                             'items':dict((k,np.array(v,dtype=np.int64)) for k,v in item_lines.items())}
+        arrays = dict(('item:'+k,v) for k,v in self.offset_index['items'].items())
+        try:
+            with open(fn,'wb') as f:
+                np.savez(f,size=size,times=self.offset_index['times'],offsets=self.offset_index['offsets'],**arrays)
+        except IOError:
+            #read-only log folder, keep the index in memory
+            pass
+        return self.offset_index
+
+    def time_range(self) -> Tuple[float,float]:
+        """Returns the times of the first and last messages in the log."""
+        times = self.offsets()['times']
+        if len(times) == 0:
+            return (0.0,0.0)
+        return (float(times[0]),float(times.max()))
+
+    def seek(self, t : float) -> dict:
+        """Positions the reader so that the next item read is the first one
+        at time >= t, and rebuilds the cumulative item as if the log had been
+        read up to t.  Returns a copy of the cumulative item, i.e., the items
+        as of time t.
+
+        Uses the offset index (see :meth:`offsets`) to decode only the lines
+        that last set each item, unless it hasn't been built yet and this is
+        a state format log with keyframes.  In that case, reading starts at
+        the last keyframe before t (see :meth:`keyframes`).
+        """
+        if self.mode != 'r':
+            raise RuntimeError("Logfile is not open for reading")
+        if self.start_time is None:
+            self.file.seek(0)
+            try:
+                self._read_next()
+                self.start_time = self.next_item_time
+            except IOError:
+                self.start_time = t
+        self.last_read_time = t
+        self.time_index = t
+        self.eof = False
+        self.cumulative_item = {}
+        if self.offset_index is None and not os.path.exists(self.index_filename()) and not self.delta_format and len(self.keyframes()) > 0:
+            return self._seek_keyframe(t)
+        index = self.offsets()
+        #times may be out of order in state format logs
+        line = int(np.searchsorted(np.maximum.accumulate(index['times']),t,side='left'))
+        by_line = dict()
+        for k,lines in index['items'].items():
+            if self.items is not None and (k[:-len('_update_time')] if k.endswith('_update_time') else k) not in self.items:
+                continue
+            i = int(np.searchsorted(lines,line,side='left'))-1
+            if i >= 0:
+                by_line.setdefault(int(lines[i]),[]).append(k)
+        for l,items in sorted(by_line.items()):
+            self.file.seek(int(index['offsets'][l]))
+            self._read_next()
+            for k in items:
+                self.cumulative_item[k] = self.next_item[k]
+        if line < len(index['offsets']):
+            self.file.seek(int(index['offsets'][line]))
+            self._read_next()
+        else:
+            self.file.seek(0,2)
+            self.eof = True
+            self.next_item = None
+            self.next_item_time = float('inf')
+        return dict(self.cumulative_item)
+
+    def _seek_keyframe(self, t : float) -> dict:
+        keyframes = self.keyframes()
+        k = bisect.bisect_left([kt for kt,offset in keyframes],t)-1
+        self.file.seek(keyframes[k][1] if k >= 0 else 0)
+        while True:
+            try:
+                self._read_next()
+            except IOError:
+                self.eof = True
+                self.next_item = None
+                self.next_item_time = float('inf')
+                return dict(self.cumulative_item)
+            if self.next_item_time >= t:
+                return dict(self.cumulative_item)
+            self._accumulate(self.next_item)
+
     def close(self):
         """Cleanly closes the log file."""
-        self.file.close()
\ No newline at end of file
+        self.file.close()
+
+
+BINARY_LOG_MAGIC = b'GEMLOG01'
+BINARY_LOG_FOOTER_MAGIC = b'GEMLOGIX'
+
+class BinaryLogfile(Logfile):
+    """A log file in a chunked, columnar binary format, with the same
+    interface as :class:`Logfile`.
+
+    Messages are buffered into chunks of `chunk_size` rows.  Within a chunk,
+    the row times are stored as a float64 array and each item is stored as a
+    separate column of (row, value) pairs, optionally zlib-compressed, so a
+    reader only decodes the items it asks for.  Each chunk header also
+    records the most recent earlier chunk containing each item, which lets
+    :meth:`seek` rebuild the cumulative item without reading the whole log.
+    When the file is closed, an index of chunk offsets and time ranges is
+    appended as a footer.  Files without a footer, e.g., after a crash, are
+    indexed by scanning the chunk headers.
+
+    Layout::
+
+        MAGIC
+        chunk*:  u32 header length, JSON header, time column, item columns
+        footer:  JSON index, u64 index offset, FOOTER_MAGIC
+
+    Args:
+        filename (str): the file to open.
+        delta_format (bool): as in Logfile.
+        mode (str): 'w' or 'r'.
+        chunk_size (int): rows per chunk, when writing.
+        compress (bool): whether to compress the item columns, when writing.
+        items (list of str, optional): when reading, only these items are
+            decoded.  If None, all items are decoded.
+    """
+    def __init__(self, filename : str, delta_format : bool, mode='w', chunk_size : int = 256, compress : bool = True, items : List[str] = None):
+        Logfile.__init__(self, filename, delta_format, mode+'b')
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.items = None if items is None else set(items)
+        self.chunks = []          # type: List[dict]
+        if mode == 'w':
+            self.rows = []
+            self.last_chunk_with_item = dict()
+            if self.file is not None:
+                self.file.write(BINARY_LOG_MAGIC)
+        elif self.file is not None:
+            if self.file.read(len(BINARY_LOG_MAGIC)) != BINARY_LOG_MAGIC:
+                raise IOError("{} is not a binary log file".format(filename))
+            self._read_index()
+            self.chunk_start_times = [c['t0'] for c in self.chunks]
+            self.chunk_end_times = [c['t1'] for c in self.chunks]
+            self.current_chunk = None  # type: Optional[Tuple[int,np.ndarray,List[dict]]]
+            self.next_row = (0,0)
+
+    def _message_time(self, message : dict) -> float:
+        if self.delta_format:
+            return message['time']
+        times = [v for k,v in message.items() if k.endswith('_update_time') and v is not None]
+        return max(times) if len(times) > 0 else 0.0
+
+    def _write(self, message) -> None:
+        if not isinstance(message,dict):
+            message = dict((f.name,getattr(message,f.name)) for f in dataclass_fields(message))
+        self.rows.append((self._message_time(message),message))
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the buffered rows as a chunk."""
+        if self.mode != 'w' or len(self.rows) == 0:
+            return
+        times = np.array([t for t,msg in self.rows],dtype=np.float64)
+        columns = dict()
+        for i,(t,msg) in enumerate(self.rows):
+            for k,v in msg.items():
+                if k == 'time':
+                    continue
+                if k not in columns:
+                    columns[k] = ([],[])
+                columns[k][0].append(i)
+                columns[k][1].append(v)
+        blobs = [times.tobytes()]
+        column_info = dict()
+        for k,(rows,values) in columns.items():
+            blob = serialize_collection({'rows':rows,'values':values}).encode('utf-8')
+            if self.compress:
+                blob = zlib.compress(blob,1)
+            column_info[k] = len(blob)
+            blobs.append(blob)
+        header = {'n':len(self.rows),
+                  'compressed':self.compress,
+                  'columns':column_info,
+                  'previous':dict(self.last_chunk_with_item)}
+        header_bytes = json.dumps(header).encode('utf-8')
+        offset = self.file.tell()
+        self.file.write(struct.pack('<I',len(header_bytes)))
+        self.file.write(header_bytes)
+        for blob in blobs:
+            self.file.write(blob)
+        for k in columns:
+            self.last_chunk_with_item[k] = len(self.chunks)
+        self.chunks.append({'offset':offset,'t0':float(times[0]),'t1':float(times[-1]),'n':len(self.rows)})
+        self.rows = []
+
+    def close(self):
+        """Writes any buffered rows and the index, and closes the file."""
+        if self.file is None:
+            return
+        if self.mode == 'w':
+            self.flush()
+            index_offset = self.file.tell()
+            index = {'delta_format':self.delta_format,'chunks':self.chunks}
+            self.file.write(json.dumps(index).encode('utf-8'))
+            self.file.write(struct.pack('<Q',index_offset))
+            self.file.write(BINARY_LOG_FOOTER_MAGIC)
+        self.file.close()
+        self.file = None
+
+    def _read_chunk_header(self, offset : int) -> Tuple[dict,int]:
+        """Returns the header of the chunk at offset and the offset of its
+        data."""
+        self.file.seek(offset)
+        header_len = struct.unpack('<I',self.file.read(4))[0]
+        header = json.loads(self.file.read(header_len).decode('utf-8'))
+        return header,offset+4+header_len
+
+    def _read_index(self) -> None:
+        self.file.seek(0,2)
+        size = self.file.tell()
+        tail = len(BINARY_LOG_FOOTER_MAGIC)+8
+        if size >= len(BINARY_LOG_MAGIC)+tail:
+            self.file.seek(size-tail)
+            index_offset = struct.unpack('<Q',self.file.read(8))[0]
+            if self.file.read(len(BINARY_LOG_FOOTER_MAGIC)) == BINARY_LOG_FOOTER_MAGIC:
+                self.file.seek(index_offset)
+                index = json.loads(self.file.read(size-tail-index_offset).decode('utf-8'))
+                self.chunks = index['chunks']
+                return
+        #no footer, scan the chunk headers
+        print("WARNING: binary log file",self.filename,"has no index, scanning")
+        offset = len(BINARY_LOG_MAGIC)
+        while offset + 4 <= size:
+            try:
+                header,data_offset = self._read_chunk_header(offset)
+            except (struct.error,ValueError):
+                break
+            end = data_offset + 8*header['n'] + sum(header['columns'].values())
+            if end > size:
+                break
+            self.file.seek(data_offset)
+            times = np.frombuffer(self.file.read(8*header['n']),dtype=np.float64)
+            self.chunks.append({'offset':offset,'t0':float(times[0]),'t1':float(times[-1]),'n':header['n']})
+            offset = end
+
+    def _load_chunk(self, index : int, items : Optional[set] = None) -> Tuple[np.ndarray,dict,dict]:
+        """Reads a chunk, returning the row times, a dict from item to
+        (rows, values) columns, and the chunk header."""
+        header,offset = self._read_chunk_header(self.chunks[index]['offset'])
+        self.file.seek(offset)
+        times = np.frombuffer(self.file.read(8*header['n']),dtype=np.float64)
+        offset += 8*header['n']
+        columns = dict()
+        for k,length in header['columns'].items():
+            if items is None or k in items:
+                self.file.seek(offset)
+                blob = self.file.read(length)
+                if header['compressed']:
+                    blob = zlib.decompress(blob)
+                column = deserialize_collection(blob.decode('utf-8'))
+                columns[k] = (column['rows'],column['values'])
+            offset += length
+        return times,columns,header
+
+    def _set_chunk(self, index : int) -> None:
+        times,columns,header = self._load_chunk(index,self.items)
+        rows = [dict() for i in range(len(times))]
+        for k,(row_indices,values) in columns.items():
+            for i,v in zip(row_indices,values):
+                rows[i][k] = v
+        if self.delta_format:
+            for i,t in enumerate(times):
+                rows[i]['time'] = float(t)
+        self.current_chunk = (index,times,rows,header)
+
+    def _read_next(self):
+        chunk,row = self.next_row
+        if chunk >= len(self.chunks):
+            raise IOError("End of log file")
+        if self.current_chunk is None or self.current_chunk[0] != chunk:
+            self._set_chunk(chunk)
+        _,times,rows,_ = self.current_chunk
+        msg = rows[row]
+        self.next_item = msg
+        self.next_item_time = float(times[row])
+        row += 1
+        self.next_row = (chunk,row) if row < len(rows) else (chunk+1,0)
+
+    def time_range(self) -> Tuple[float,float]:
+        """Returns the times of the first and last messages in the log."""
+        if len(self.chunks) == 0:
+            return (0.0,0.0)
+        return (self.chunks[0]['t0'],self.chunks[-1]['t1'])
+
+    def seek(self, t : float) -> dict:
+        """Positions the reader so that the next item read is the first one
+        at time >= t, and rebuilds the cumulative item as if the log had been
+        read up to t.  Returns a copy of the cumulative item, i.e., the items
+        as of time t.  Takes O(log n) in the number of chunks, plus the time
+        to decode one chunk per item."""
+        if self.mode != 'r':
+            raise RuntimeError("Logfile is not open for reading")
+        chunk = bisect.bisect_left(self.chunk_end_times,t)
+        self.cumulative_item = {}
+        if self.start_time is None:
+            self.start_time = self.chunks[0]['t0'] if len(self.chunks) > 0 else t
+        self.last_read_time = t
+        self.time_index = t
+        if chunk >= len(self.chunks):
+            previous = dict(self.last_chunk_with_items())
+            row = 0
+        else:
+            self._set_chunk(chunk)
+            _,times,rows,header = self.current_chunk
+            row = int(np.searchsorted(times,t,side='left'))
+            for msg in rows[:row]:
+                self._accumulate(msg)
+            previous = header['previous']
+        #items not updated in this chunk before t are found in earlier chunks
+        by_chunk = dict()
+        for k,c in previous.items():
+            if k not in self.cumulative_item and k != KEYFRAME_KEY and (self.items is None or k in self.items):
+                by_chunk.setdefault(c,set()).add(k)
+        for c,items in by_chunk.items():
+            for k,(row_indices,values) in self._load_chunk(c,items)[1].items():
+                self.cumulative_item[k] = values[-1]
+        self.next_row = (chunk,row)
+        self.eof = False
+        try:
+            self._read_next()
+        except IOError:
+            self.eof = True
+            self.next_item = None
+            self.next_item_time = float('inf')
+        return dict(self.cumulative_item)
+
+    def last_chunk_with_items(self) -> dict:
+        """Returns a dict giving the last chunk containing each item."""
+        if len(self.chunks) == 0:
+            return {}
+        header,_ = self._read_chunk_header(self.chunks[-1]['offset'])
+        res = dict(header['previous'])
+        for k in header['columns']:
+            res[k] = len(self.chunks)-1
+        return res
+
+
+def open_logfile(filename : str, delta_format : bool, mode='w', **kwargs) -> Logfile:
+    """Opens a BinaryLogfile if filename ends in .glog, otherwise a Logfile.
+    Extra keyword arguments are passed to BinaryLogfile, and `items` is also
+    passed to Logfile."""
+    if filename.endswith('.glog'):
+        return BinaryLogfile(filename,delta_format,mode,**kwargs)
+    return Logfile(filename,delta_format,mode,kwargs.get('items',None))
+
+
+def convert_logfile(src : str, dest : str, delta_format : bool, **kwargs) -> int:
+    """Converts a log file between the JSON and binary formats, chosen by
+    extension.  Returns the number of messages converted."""
+    reader = open_logfile(src,delta_format,'r')
+    writer = open_logfile(dest,delta_format,'w',**kwargs)
+    if isinstance(reader,BinaryLogfile):
+        reader.seek(reader.time_range()[0])
+    else:
+        try:
+            reader._read_next()
+        except IOError:
+            reader.eof = True
+    count = 0
+    while not reader.eof:
+        writer._write(reader.next_item)
+        count += 1
+        try:
+            reader._read_next()
+        except IOError:
+            reader.eof = True
+    reader.close()
+    writer.close()
+    return count
@@ -30,6 +30,9 @@ class TimedLooper:
             Set this to 0 to disable warnings.
         name (str, optional): a descriptive name to be used in the warning
             string.
+        wake (threading.Event, optional): if given, setting this event ends
+            the current sleep early, and the following iterations are timed
+            from the wake-up.
 
     Warning: DO NOT attempt to save some time and call the TimedLooper()
     constructor as the condition of your while loop!  I.e., do not do this::
@@ -39,7 +42,7 @@ class TimedLooper:
 
     """
 
-    def __init__(self, dt=None, rate=None, warning_frequency="auto", name=None):
+    def __init__(self, dt=None, rate=None, warning_frequency="auto", name=None, wake=None):
         self.dt = dt
         if dt is None:
             if rate is None:
@@ -61,6 +64,7 @@ class TimedLooper:
         self._tlast = None
         self._tnext = None
         self._exit = False
+        self.wake = wake
 
     def stop(self):
         self._exit = True
@@ -116,7 +120,11 @@ class TimedLooper:
                     tnow,
                 )
             self._iters += 1
-            time.sleep(self._tnext - tnow)
+            if self.wake is None:
+                time.sleep(self._tnext - tnow)
+            elif self.wake.wait(self._tnext - tnow):
+                self.wake.clear()
+                self._tnext = time.time()
             self._tlast = time.time()
             return True
 
@@ -134,6 +142,72 @@ class TimedLooper:
         print(s)
 
 
+class VirtualLooper:
+    """A drop-in replacement for TimedLooper that runs on a virtual clock.
+    Rather than sleeping, each iteration calls ``advance(dt)`` so that a
+    simulation can step forward by dt, and the loop runs as fast as the CPU
+    allows.  Useful for deterministic testing and benchmarking.
+
+    Usage::
+
+        looper = VirtualLooper(dt=0.01, advance=sim.advance, duration=10.0)
+        while looper:
+            ... do stuff ...
+
+    Args:
+        dt (float, optional): the virtual time between loops (in seconds)
+        rate (float, optional): the number of times per virtual second to run
+            this loop (in Hz).  One of dt or rate must be specified.
+        advance (callable, optional): called with dt before every iteration
+            except the first.
+        duration (float, optional): if given, the loop stops once this much
+            virtual time has elapsed.
+        name (str, optional): a descriptive name.
+    """
+
+    def __init__(self, dt=None, rate=None, advance=None, duration=None, name=None):
+        self.dt = dt
+        if dt is None:
+            if rate is None:
+                raise AttributeError("One of dt or rate must be specified")
+            self.dt = 1.0 / rate
+        if self.dt <= 0:
+            raise ValueError("dt must be positive")
+        self.advance = advance
+        self.duration = duration
+        self.name = name
+        self._iters = 0
+        self._time = 0.0
+        self._exit = False
+
+    def stop(self):
+        self._exit = True
+
+    def __nonzero__(self):
+        return self.__bool__()
+
+    def __bool__(self):
+        if self._exit:
+            return False
+        if self._iters > 0:
+            if self.duration is not None and self._time + self.dt > self.duration + 1e-9:
+                self._exit = True
+                return False
+            if self.advance is not None:
+                self.advance(self.dt)
+            self._time += self.dt
+        self._iters += 1
+        return True
+
+    def time_elapsed(self):
+        """Returns the total virtual time elapsed from the start, in seconds"""
+        return self._time
+
+    def iters(self):
+        """Returns the total number of iters run"""
+        return self._iters
+
+
 class TimedLooperAsync:
     """A class to easily control how timed loops are run.  This is more
     accurate than asyncio.sleep(dt) and also maintains information about
@@ -0,0 +1,197 @@
+"""Append-only, memory-mapped recordings of array-valued sensor readings,
+e.g., point clouds and images, with a per-sensor time index.
+
+Each sensor is recorded to its own folder::
+
+    index.bin        one INDEX_DTYPE record per frame
+    chunk_0000.bin   raw frame bytes, back to back
+    chunk_0001.bin
+    ...
+
+Chunk files are preallocated, memory-mapped, and filled by copying each
+frame's bytes into the map, then truncated to their used size when closed.
+Index records are appended after the frame's bytes have been copied, so a
+recording cut off by a crash is readable up to the last complete record.
+
+:class:`SensorLogReader` maps the chunk files read-only and returns frames as
+NumPy views of the maps, so reading a frame doesn't copy it.
+"""
+
+import os
+import mmap
+import threading
+import numpy as np
+from typing import Dict,List,Optional,Iterator,Tuple
+
+MAX_DIMS = 4
+INDEX_DTYPE = np.dtype([('t','<f8'),
+                        ('chunk','<u4'),
+                        ('ndim','<u4'),
+                        ('offset','<u8'),
+                        ('nbytes','<u8'),
+                        ('shape','<u8',(MAX_DIMS,)),
+                        ('dtype','S8')])
+#frames start on multiples of this many bytes
+ALIGNMENT = 64
+
+def chunk_filename(folder : str, chunk : int) -> str:
+    return os.path.join(folder,'chunk_%04d.bin'%chunk)
+
+def index_filename(folder : str) -> str:
+    return os.path.join(folder,'index.bin')
+
+
+class SensorLogWriter:
+    """Records frames of one sensor to a folder.  Safe to call from sensor
+    callback threads.
+
+    Args:
+        folder (str): the folder to write to.  Created if it doesn't exist.
+        chunk_bytes (int): the size of each chunk file.  Frames larger than
+            this are written to a chunk of their own.
+    """
+    def __init__(self, folder : str, chunk_bytes : int = 256*1024*1024):
+        os.makedirs(folder,exist_ok=True)
+        self.folder = folder
+        self.chunk_bytes = chunk_bytes
+        self.chunk = -1
+        self.file = None
+        self.map = None           # type: Optional[mmap.mmap]
+        self.cursor = 0
+        self.capacity = 0
+        self.index = open(index_filename(folder),'wb')
+        self.frames = 0
+        self.bytes_written = 0
+        self.lock = threading.Lock()
+
+    def _next_chunk(self, min_bytes : int) -> None:
+        self._close_chunk()
+        self.chunk += 1
+        self.capacity = max(self.chunk_bytes,min_bytes)
+        self.file = open(chunk_filename(self.folder,self.chunk),'w+b')
+        self.file.truncate(self.capacity)
+        self.map = mmap.mmap(self.file.fileno(),self.capacity)
+        self.cursor = 0
+
+    def _close_chunk(self) -> None:
+        if self.map is None:
+            return
+        self.map.flush()
+        self.map.close()
+        self.map = None
+        self.file.truncate(self.cursor)
+        self.file.close()
+        self.file = None
+
+    def write(self, t : float, frame : np.ndarray) -> None:
+        """Appends a frame recorded at time t."""
+        frame = np.ascontiguousarray(frame)
+        if frame.ndim > MAX_DIMS:
+            raise ValueError("Can only record arrays with up to {} dimensions".format(MAX_DIMS))
+        if frame.dtype.hasobject:
+            raise ValueError("Can't record arrays of objects")
+        record = np.zeros(1,dtype=INDEX_DTYPE)
+        record['t'] = t
+        record['ndim'] = frame.ndim
+        record['nbytes'] = frame.nbytes
+        record['shape'][0,:frame.ndim] = frame.shape
+        record['dtype'] = frame.dtype.str
+        with self.lock:
+            offset = -(-self.cursor // ALIGNMENT) * ALIGNMENT
+            if self.map is None or offset + frame.nbytes > self.capacity:
+                self._next_chunk(frame.nbytes)
+                offset = 0
+            dest = np.frombuffer(self.map,dtype=np.uint8,count=frame.nbytes,offset=offset)
+            dest[:] = frame.reshape(-1).view(np.uint8)
+            del dest
+            self.cursor = offset + frame.nbytes
+            record['chunk'] = self.chunk
+            record['offset'] = offset
+            self.index.write(record.tobytes())
+            self.index.flush()
+            self.frames += 1
+            self.bytes_written += frame.nbytes
+
+    def close(self) -> None:
+        with self.lock:
+            self._close_chunk()
+            if self.index is not None:
+                self.index.close()
+                self.index = None
+
+
+class SensorLogReader:
+    """Reads the frames of one sensor recorded by SensorLogWriter.
+
+    Frames are returned as read-only NumPy views of the memory-mapped chunk
+    files.  Copy a frame if it needs to outlive the reader or be modified.
+    """
+    def __init__(self, folder : str):
+        self.folder = folder
+        with open(index_filename(folder),'rb') as f:
+            data = f.read()
+        #ignore a partially written last record
+        n = len(data) // INDEX_DTYPE.itemsize
+        self.index = np.frombuffer(data,dtype=INDEX_DTYPE,count=n)
+        self.times = self.index['t']
+        self.maps = dict()        # type: Dict[int,mmap.mmap]
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def time_range(self) -> Tuple[float,float]:
+        """Returns the times of the first and last frames."""
+        if len(self.index) == 0:
+            return (0.0,0.0)
+        return (float(self.times[0]),float(self.times[-1]))
+
+    def _map(self, chunk : int) -> mmap.mmap:
+        if chunk not in self.maps:
+            with open(chunk_filename(self.folder,chunk),'rb') as f:
+                self.maps[chunk] = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        return self.maps[chunk]
+
+    def frame(self, i : int) -> np.ndarray:
+        """Returns the i'th frame."""
+        record = self.index[i]
+        dtype = np.dtype(record['dtype'].decode('ascii'))
+        shape = tuple(int(d) for d in record['shape'][:record['ndim']])
+        return np.frombuffer(self._map(int(record['chunk'])),dtype=dtype,count=int(record['nbytes'])//dtype.itemsize,
+                             offset=int(record['offset'])).reshape(shape)
+
+    def index_at(self, t : float) -> int:
+        """Returns the index of the last frame at or before time t, or -1 if
+        there is none."""
+        return int(np.searchsorted(self.times,t,side='right'))-1
+
+    def at(self, t : float) -> Optional[np.ndarray]:
+        """Returns the last frame at or before time t, or None if there is
+        none."""
+        i = self.index_at(t)
+        return self.frame(i) if i >= 0 else None
+
+    def frames(self, t0 : float = -float('inf'), t1 : float = float('inf')) -> Iterator[Tuple[float,np.ndarray]]:
+        """Iterates over (time, frame) pairs with t0 <= time < t1."""
+        start = int(np.searchsorted(self.times,t0,side='left'))
+        end = int(np.searchsorted(self.times,t1,side='left'))
+        for i in range(start,end):
+            yield float(self.times[i]),self.frame(i)
+
+    def close(self) -> None:
+        for m in self.maps.values():
+            try:
+                m.close()
+            except BufferError:
+                #frames still refer to the map; it's closed when they're freed
+                pass
+        self.maps = dict()
+
+
+def open_sensor_log(folder : str) -> Dict[str,SensorLogReader]:
+    """Returns readers for all sensors recorded in a folder, i.e., all
+    subfolders containing an index, indexed by sensor name."""
+    res = dict()
+    for name in sorted(os.listdir(folder)):
+        if os.path.exists(index_filename(os.path.join(folder,name))):
+            res[name] = SensorLogReader(os.path.join(folder,name))
+    return res
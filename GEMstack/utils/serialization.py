@@ -1,8 +1,11 @@
 import dacite
-from dataclasses import dataclass, is_dataclass, asdict
+from dataclasses import dataclass, is_dataclass, asdict, fields, MISSING
 import json
 from enum import Enum
 import typing
+import copy
+import sys
+import numpy as np
 
 REGISTRY = dict()
 
@@ -84,7 +87,7 @@ def serialize(obj, format=str):
     if not is_dataclass(obj):
         raise ValueError("Provided object of class {} which is not a dataclass".format(obj.__class__.__name__))
     
-    values = asdict(obj, dict_factory=_custom_asdict_factory)
+    values = encoder(obj.__class__)(obj)
     frame = {'type':obj.__class__.__SERIALIZATION_NAME__,'data':values}
     if obj.__class__.__SERIALIZATION_VERSION__:
         frame['version'] = obj.__class__.__SERIALIZATION_VERSION__
@@ -103,7 +106,7 @@ def deserialize(data):
         raise IOError("Class of type {} not found in registry".format(name))
     if version not in REGISTRY[name]:
         raise IOError("Version {} of type {} not found in registry".format(version,name))
-    return dacite.from_dict(REGISTRY[name][version],data, config=dacite.Config(cast=[Enum,tuple,typing.Tuple]))
+    return decoder(REGISTRY[name][version])(data)
  
  
 def deserialize_raw(data) -> tuple:
@@ -164,6 +167,261 @@ def deserialize_collection(data):
     return _recurse(frame)
 
 
+# Compiled encoders / decoders.
+#
+# For each dataclass, we generate the source of a function that converts an
+# instance to a dict of JSON-compatible values, and one that converts such a
+# dict back to an instance, specialized to the field types.  They produce the
+# same JSON as asdict() and accept the same data as dacite.from_dict().
+# Functions are compiled on first use rather than in register(), since type
+# hints may refer to classes that are not yet defined at registration time.
+# If a class's type hints can't be resolved or use unsupported types, the
+# class falls back to asdict / dacite.
+
+_ENCODERS = dict()   # type: typing.Dict[type,typing.Callable]
+_DECODERS = dict()   # type: typing.Dict[type,typing.Callable]
+_PRIMITIVES = (int,float,str,bool,type(None))
+_DACITE_CONFIG = dacite.Config(cast=[Enum,tuple,typing.Tuple])
+
+
+def _encode_value(v):
+    """Encodes a value of unknown type, following asdict()."""
+    if isinstance(v,_PRIMITIVES):
+        return v
+    if isinstance(v,Enum):
+        return v.value
+    if is_dataclass(v) and not isinstance(v,type):
+        return encoder(type(v))(v)
+    if isinstance(v,np.ndarray):
+        return v.tolist()
+    if isinstance(v,np.generic):
+        return v.item()
+    if isinstance(v,list):
+        return [_encode_value(x) for x in v]
+    if isinstance(v,tuple):
+        return tuple(_encode_value(x) for x in v)
+    if isinstance(v,dict):
+        return dict((_encode_value(k),_encode_value(x)) for k,x in v.items())
+    return copy.deepcopy(v)
+
+
+def _encode_floats(v):
+    """Fast path for lists / arrays of numbers."""
+    if isinstance(v,np.ndarray):
+        return v.tolist()
+    return list(v)
+
+
+def _encode_float_rows(v):
+    """Fast path for lists of lists / 2D arrays of numbers."""
+    if isinstance(v,np.ndarray):
+        return v.tolist()
+    return [x.tolist() if isinstance(x,np.ndarray) else list(x) for x in v]
+
+
+def _is_primitive(t) -> bool:
+    if typing.get_origin(t) is typing.Union:
+        return all(_is_primitive(a) for a in typing.get_args(t))
+    return t in _PRIMITIVES or t is typing.Any
+
+
+def _is_number_list(t) -> bool:
+    args = typing.get_args(t)
+    if typing.get_origin(t) is list and len(args)==1:
+        if args[0] in (int,float):
+            return True
+        return _is_number_list(args[0])
+    return False
+
+
+def _optional_arg(t):
+    """If t is Optional[X], returns X.  Otherwise returns None."""
+    if typing.get_origin(t) is typing.Union:
+        args = [a for a in typing.get_args(t) if a is not type(None)]
+        if len(args) == 1 and len(typing.get_args(t)) == 2:
+            return args[0]
+    return None
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _encode_expr(t, v : str, env : dict) -> str:
+    """Returns an expression encoding the variable v of type t."""
+    arg = _optional_arg(t)
+    if arg is not None:
+        t = arg
+    if _is_primitive(t):
+        return v
+    return "None if {v} is None else ({e})".format(v=v,e=_encode_expr_not_none(t,v,env))
+
+
+def _encode_expr_not_none(t, v : str, env : dict) -> str:
+    if t is np.ndarray:
+        return "{v}.tolist() if isinstance({v},ndarray) else _encode_value({v})".format(v=v)
+    if _is_number_list(t):
+        arg = typing.get_args(t)[0]
+        if arg in (int,float):
+            return "_encode_floats({})".format(v)
+        if typing.get_args(arg)[0] in (int,float):
+            return "_encode_float_rows({})".format(v)
+        return "{v}.tolist() if isinstance({v},ndarray) else _encode_value({v})".format(v=v)
+    if isinstance(t,type) and issubclass(t,Enum):
+        return "{v}.value if isinstance({v},Enum) else {v}".format(v=v)
+    if isinstance(t,type) and is_dataclass(t):
+        name = "_enc_{}".format(len(env))
+        env[name] = _LazyEncoder(t)
+        return "{n}({v}) if type({v}) is {n}.klass else _encode_value({v})".format(n=name,v=v)
+    #lists, dicts, unions, etc.
+    return "_encode_value({})".format(v)
+
+
+def _decode_expr(t, v : str, env : dict, depth : int = 0) -> str:
+    """Returns an expression decoding the variable v into type t."""
+    arg = _optional_arg(t)
+    if arg is not None:
+        t = arg
+    if _is_primitive(t):
+        return v
+    #fields are sometimes None even if not declared Optional
+    return "None if {v} is None else ({e})".format(v=v,e=_decode_expr_not_none(t,v,env,depth))
+
+
+def _decode_expr_not_none(t, v : str, env : dict, depth : int) -> str:
+    if t is np.ndarray:
+        return "asarray({})".format(v)
+    origin = typing.get_origin(t)
+    args = typing.get_args(t)
+    x = "x{}".format(depth)
+    if t is list or (origin is list and _is_primitive(args[0])):
+        return "list({})".format(v)
+    if origin is list:
+        return "[{e} for {x} in {v}]".format(e=_decode_expr(args[0],x,env,depth+1),x=x,v=v)
+    if t is tuple or origin is tuple:
+        if len(args) == 0 or all(_is_primitive(a) or a is Ellipsis for a in args):
+            return "tuple({})".format(v)
+        if len(args) == 2 and args[1] is Ellipsis:
+            return "tuple({e} for {x} in {v})".format(e=_decode_expr(args[0],x,env,depth+1),x=x,v=v)
+        items = ",".join(_decode_expr(a,"{}[{}]".format(v,i),env,depth+1) for i,a in enumerate(args))
+        return "({},)".format(items)
+    if t is dict or (origin is dict and _is_primitive(args[1])):
+        return "dict({})".format(v)
+    if origin is dict:
+        k = "k{}".format(depth)
+        return "dict(({k},{e}) for {k},{x} in {v}.items())".format(k=k,e=_decode_expr(args[1],x,env,depth+1),x=x,v=v)
+    if isinstance(t,type) and issubclass(t,Enum):
+        name = "_enum_{}".format(len(env))
+        env[name] = t
+        return "{n}({v})".format(n=name,v=v)
+    if isinstance(t,type) and is_dataclass(t):
+        name = "_dec_{}".format(len(env))
+        env[name] = _LazyDecoder(t)
+        return "{n}({v})".format(n=name,v=v)
+    raise _Unsupported(str(t))
+
+
+class _LazyEncoder:
+    """Looks up the encoder of a class on first call, which allows recursive
+    types."""
+    def __init__(self, klass):
+        self.klass = klass
+        self.func = None
+    def __call__(self, obj):
+        if self.func is None:
+            self.func = encoder(self.klass)
+        return self.func(obj)
+
+
+class _LazyDecoder:
+    def __init__(self, klass):
+        self.klass = klass
+        self.func = None
+    def __call__(self, data):
+        if self.func is None:
+            self.func = decoder(self.klass)
+        return self.func(data)
+
+
+def _type_hints(klass) -> dict:
+    """Returns the resolved type hints of klass.  Hints that can't be
+    resolved are treated as Any."""
+    try:
+        return typing.get_type_hints(klass)
+    except Exception:
+        pass
+    hints = dict()
+    for base in reversed(klass.__mro__):
+        module = sys.modules.get(base.__module__)
+        globalns = module.__dict__ if module is not None else {}
+        for name,hint in base.__dict__.get('__annotations__',{}).items():
+            if isinstance(hint,str):
+                try:
+                    hint = eval(hint,globalns,dict(vars(base)))
+                except Exception:
+                    hint = typing.Any
+            hints[name] = hint
+    return hints
+
+
+def _compile(source : str, name : str, env : dict):
+    env.update({'_encode_value':_encode_value,'_encode_floats':_encode_floats,'_encode_float_rows':_encode_float_rows,'ndarray':np.ndarray,'asarray':np.asarray,'Enum':Enum})
+    exec(source,env)
+    return env[name]
+
+
+def encoder(klass) -> typing.Callable:
+    """Returns a function that converts an instance of the dataclass klass
+    to a dict of JSON-compatible values, compiling it if necessary."""
+    func = _ENCODERS.get(klass)
+    if func is not None:
+        return func
+    try:
+        hints = _type_hints(klass)
+        env = dict()
+        items = []
+        for f in fields(klass):
+            items.append("{!r}:{}".format(f.name,_encode_expr(hints.get(f.name,typing.Any),"obj."+f.name,env)))
+        source = "def encode(obj):\n    return {{{}}}\n".format(",\n        ".join(items))
+        func = _compile(source,'encode',env)
+    except _Unsupported:
+        func = lambda obj: asdict(obj, dict_factory=_custom_asdict_factory)
+    _ENCODERS[klass] = func
+    return func
+
+
+def decoder(klass) -> typing.Callable:
+    """Returns a function that converts a dict produced by the encoder back
+    to an instance of the dataclass klass, compiling it if necessary."""
+    func = _DECODERS.get(klass)
+    if func is not None:
+        return func
+    try:
+        hints = _type_hints(klass)
+        env = {'_klass':klass}
+        required = []
+        optional = []
+        for f in fields(klass):
+            if not f.init:
+                continue
+            expr = _decode_expr(hints.get(f.name,typing.Any),"v",env)
+            if f.default is MISSING and f.default_factory is MISSING:
+                required.append("    v = data[{n!r}]\n    kwargs[{n!r}] = {e}\n".format(n=f.name,e=expr))
+            else:
+                optional.append("    if {n!r} in data:\n        v = data[{n!r}]\n        kwargs[{n!r}] = {e}\n".format(n=f.name,e=expr))
+        source = "def decode(data):\n    kwargs = {}\n" + "".join(required) + "".join(optional) + "    return _klass(**kwargs)\n"
+        compiled = _compile(source,'decode',env)
+        def func(data, compiled=compiled):
+            try:
+                return compiled(data)
+            except KeyError as e:
+                raise dacite.MissingValueError(e.args[0]) from None
+    except _Unsupported:
+        func = lambda data: dacite.from_dict(klass, data, config=_DACITE_CONFIG)
+    _DECODERS[klass] = func
+    return func
+
+
 def load(file):
     """Loads a JSON file containing serialized data into a registered class."""
     return deserialize(file.read())
@@ -0,0 +1,75 @@
+"""Microbenchmarks for the batched collision predicates in
+GEMstack.mathutils.collisions.
+
+Compares each NumPy kernel against calling the equivalent shapely-based
+helper once per point / polygon, checks that the results agree, and prints
+the time per call for both.
+
+Usage::
+
+    python testing/benchmark_collisions.py
+    python testing/benchmark_collisions.py --n=10000 --repeats=20
+"""
+
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from GEMstack.mathutils import collisions
+import numpy as np
+import argparse
+import time
+
+def random_rectangles(rng, n, size=20.0):
+    centers = rng.uniform(0,size,(n,2))
+    dims = rng.uniform(0.5,5.0,(n,2))
+    angles = rng.uniform(0,2*np.pi,n)
+    corners = np.array([[-1,-1],[1,-1],[1,1],[-1,1]])*0.5
+    local = corners[np.newaxis,:,:]*dims[:,np.newaxis,:]
+    c,s = np.cos(angles)[:,np.newaxis],np.sin(angles)[:,np.newaxis]
+    return np.stack((c*local[...,0] - s*local[...,1],s*local[...,0] + c*local[...,1]),axis=-1) + centers[:,np.newaxis,:]
+
+def timeit(fn, repeats):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        res = fn()
+    return (time.perf_counter()-t0)/repeats,res
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched collision predicates against shapely.")
+    parser.add_argument("--n", type=int, default=1000, help="Points / polygons per call.")
+    parser.add_argument("--repeats", type=int, default=10, help="Calls to time.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    polygon = random_rectangles(rng,1)[0]
+    polygons = random_rectangles(rng,args.n)
+    points = rng.uniform(0,20,(args.n,2))
+    cases = [
+        ('points_in_polygon',
+            lambda: [collisions.point_in_polygon_2d(p,polygon) for p in points],
+            lambda: collisions.points_in_polygon_2d(points,polygon)),
+        ('points_polygon_distance',
+            lambda: [collisions.point_polygon_distance_2d(p,polygon) for p in points],
+            lambda: collisions.points_polygon_distance_2d(points,polygon)),
+        ('polygons_intersect_polygon',
+            lambda: [collisions.polygon_intersects_polygon_2d(polygon,p) for p in polygons],
+            lambda: collisions.polygons_intersect_polygon_2d(polygon,polygons)),
+        ('polygons_polygon_distance',
+            lambda: [collisions.polygon_polygon_distance_2d(polygon,p) for p in polygons],
+            lambda: collisions.polygons_polygon_distance_2d(polygon,polygons)),
+    ]
+    print("%-28s %10s %10s %8s  (n=%d)" % ('predicate','shapely ms','numpy ms','speedup',args.n))
+    ok = True
+    for name,reference,batched in cases:
+        t_ref,res_ref = timeit(reference,args.repeats)
+        t_np,res_np = timeit(batched,args.repeats)
+        agree = np.allclose(np.asarray(res_ref,dtype=float),np.asarray(res_np,dtype=float),atol=1e-9)
+        ok = ok and agree
+        print("%-28s %10.3f %10.3f %7.1fx%s" % (name,t_ref*1000,t_np*1000,t_ref/t_np,'' if agree else '  MISMATCH'))
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    exit(main())
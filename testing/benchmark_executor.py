@@ -0,0 +1,139 @@
+"""Benchmarks the executor on a virtual clock.
+
+Drives ExecutorBase.run against GEMDoubleIntegratorSimulationInterface with
+a VirtualLooper in place of TimedLooper, so the state estimation -> planning
+-> tracking pipeline runs as fast as the CPU allows.  Reports ticks per
+second and per-component update cost.  No vehicle or ROS install is needed.
+
+Usage::
+
+    python testing/benchmark_executor.py              # run and print results
+    python testing/benchmark_executor.py --record     # save results as the new baseline
+    python testing/benchmark_executor.py --check      # fail if slower than the baseline
+    python testing/benchmark_executor.py --check --tolerance=0.3 --duration=30
+
+The baseline is stored in testing/benchmark_executor_baseline.json.  Numbers
+are machine-dependent, so re-record the baseline when changing machines.
+"""
+
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from GEMstack.utils import settings,config
+from GEMstack.utils.loops import VirtualLooper
+from GEMstack.onboard.execution import execution
+from GEMstack.onboard.execution.execution import ExecutorBase,load_computation_graph
+from GEMstack.onboard.interface.gem_simulator import GEMDoubleIntegratorSimulationInterface
+import json
+import time
+
+BASELINE_FILE = os.path.join(os.path.split(__file__)[0],'benchmark_executor_baseline.json')
+
+RUN_CONFIG = {
+    'recovery': {
+        'planning': {
+            'trajectory_tracking': {'type':'recovery.StopTrajectoryTracker','print':False},
+        },
+    },
+    'drive': {
+        'perception': {
+            'state_estimation': {'type':'OmniscientStateEstimator','print':False},
+            'perception_normalization': {'type':'StandardPerceptionNormalizer','print':False},
+        },
+        'planning': {
+            'route_planning': {'type':'StaticRoutePlanner','args':['GEMstack/knowledge/routes/xyhead_highbay_backlot_p.csv'],'print':False},
+            'motion_planning': {'type':'RouteToTrajectoryPlanner','args':[None],'print':False},
+            'trajectory_tracking': {'type':'pure_pursuit.PurePursuitTrajectoryTracker','args':{'desired_speed':2.5},'print':False},
+        },
+    },
+    'computation_graph': config.load_config_recursive('GEMstack/knowledge/defaults/computation_graph.yaml'),
+}
+
+
+class VirtualClockExecutor(ExecutorBase):
+    """Runs the main loop on a virtual clock for the given duration of
+    simulated time, stepping the simulator between ticks."""
+    def __init__(self, vehicle_interface : GEMDoubleIntegratorSimulationInterface, duration : float):
+        ExecutorBase.__init__(self,vehicle_interface)
+        self.duration = duration
+        self.ticks = 0
+
+    def make_looper(self, dt : float, name : str):
+        looper = VirtualLooper(dt,advance=self.vehicle_interface.advance,duration=self.duration,name=name)
+        self.loopers.append(looper)
+        return looper
+
+    def run(self):
+        self.loopers = []
+        ExecutorBase.run(self)
+        self.ticks = sum(l.iters() for l in self.loopers)
+
+
+def run_benchmark(duration : float = 20.0) -> dict:
+    """Runs the drive pipeline for `duration` seconds of simulated time and
+    returns a dict of results."""
+    settings.set('run',RUN_CONFIG,leaf_only=False)
+    load_computation_graph()
+    execution.EXECUTION_VERBOSITY = 0
+    vehicle_interface = GEMDoubleIntegratorSimulationInterface('scenes/xyhead_demo.yaml')
+    executor = VirtualClockExecutor(vehicle_interface,duration)
+    for name in ['drive','recovery']:
+        pipeline = [{},{},{}]
+        for i,(stage,parent) in enumerate([('perception','GEMstack.onboard.perception'),('planning','GEMstack.onboard.planning'),('other','GEMstack.onboard.other')]):
+            for k,v in RUN_CONFIG[name].get(stage,{}).items():
+                pipeline[i][k] = executor.make_component(v,k,parent,{'vehicle_interface':vehicle_interface})
+        executor.add_pipeline(name,*pipeline)
+    t0 = time.perf_counter()
+    executor.run()
+    elapsed = time.perf_counter() - t0
+    components = dict()
+    for k,s in executor.timing_stats().items():
+        w = s['wall_time']
+        if w['count'] == 0: continue
+        components[k] = {'count':w['count'],'mean_ms':w['mean']*1000,'p50_ms':w['p50']*1000,'p99_ms':w['p99']*1000}
+    return {'duration':duration,
+            'ticks':executor.ticks,
+            'elapsed':elapsed,
+            'ticks_per_second':executor.ticks/elapsed,
+            'components':components}
+
+
+def print_results(results : dict, baseline : dict = None):
+    print("Simulated {:.1f}s in {:.3f}s: {} ticks, {:.1f} ticks/s".format(results['duration'],results['elapsed'],results['ticks'],results['ticks_per_second']))
+    if baseline is not None:
+        print("Baseline: {:.1f} ticks/s ({:+.1f}%)".format(baseline['ticks_per_second'],100*(results['ticks_per_second']/baseline['ticks_per_second']-1)))
+    print("{:<30} {:>7} {:>9} {:>9} {:>9}".format("Component (ms)","count","mean","p50","p99"))
+    for k,c in results['components'].items():
+        print("{:<30} {:>7} {:>9.3f} {:>9.3f} {:>9.3f}".format(k,c['count'],c['mean_ms'],c['p50_ms'],c['p99_ms']))
+
+
+if __name__=='__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmarks the executor on a virtual clock')
+    parser.add_argument('--duration',type=float,default=20.0,help='simulated time, in s')
+    parser.add_argument('--record',action='store_true',help='save the results as the new baseline')
+    parser.add_argument('--check',action='store_true',help='exit with an error if ticks/s drops below the baseline by more than the tolerance')
+    parser.add_argument('--tolerance',type=float,default=0.2,help='allowed fractional slowdown in --check mode')
+    args = parser.parse_args()
+    sys.argv = sys.argv[:1]  #otherwise settings will try to parse these arguments
+    baseline = None
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE,'r') as f:
+            baseline = json.load(f)
+    results = run_benchmark(args.duration)
+    print_results(results,baseline)
+    if args.record:
+        with open(BASELINE_FILE,'w') as f:
+            json.dump(results,f,indent=2)
+        print("Saved baseline to",BASELINE_FILE)
+    if args.check:
+        if baseline is None:
+            print("No baseline found in",BASELINE_FILE)
+            exit(1)
+        threshold = baseline['ticks_per_second']*(1.0-args.tolerance)
+        if results['ticks_per_second'] < threshold:
+            print("FAIL: {:.1f} ticks/s is below the threshold {:.1f}".format(results['ticks_per_second'],threshold))
+            exit(1)
+        print("PASS")
@@ -0,0 +1,82 @@
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from GEMstack.mathutils import collisions
+import shapely
+import numpy as np
+
+def random_box(rng, size=100.0):
+    x,y = rng.uniform(0,size,2)
+    w,h = rng.uniform(0.5,4.0,2)
+    return [(x,y),(x+w,y),(x+w,y+h),(x,y+h)]
+
+def brute_force_pairs(objects, margin, ignored):
+    names = sorted(objects.keys())
+    res = set()
+    for i,a in enumerate(names):
+        for b in names[i+1:]:
+            if (a,b) in ignored:
+                continue
+            if objects[a].distance(objects[b]) <= margin:
+                res.add((a,b))
+    return res
+
+def test_collision_detector():
+    rng = np.random.default_rng(0)
+    cd = collisions.CollisionDetector2D()
+    for i in range(200):
+        cd.add_polygon('box%03d'%i,random_box(rng))
+    cd.add_circle('circle',(50,50),5.0)
+    cd.add_line('line',[(0,0),(100,100)])
+    cd.ignore_collisions('line','circle')
+    for step in range(4):
+        for margin in [0.0,1.0]:
+            pairs = set(cd.items_colliding(margin=margin))
+            assert pairs == brute_force_pairs(cd.objects,margin,cd.ignored_pairs)
+        hits = set(cd.items_colliding('circle'))
+        assert hits == set(p for p in brute_force_pairs(cd.objects,0.0,cd.ignored_pairs) if 'circle' in p)
+        query = random_box(rng,50.0)
+        found = set(cd.items_intersecting_polygon(query,margin=0.5))
+        assert found == set(n for n,o in cd.objects.items() if o.distance(shapely.Polygon(query)) <= 0.5)
+        assert set(cd.items_containing((50,50))) == set(n for n,o in cd.objects.items() if o.contains(shapely.Point(50,50)))
+        assert set(cd.items_within_box((0,0),(50,50))) == set(n for n,o in cd.objects.items() if shapely.box(0,0,50,50).contains(o))
+        assert abs(cd.distance('circle') - min(cd.objects['circle'].distance(o) for n,o in cd.objects.items() if n not in ['circle','line'])) < 1e-9
+        #move some objects and remove others, with and without rebuilding the tree
+        for i in rng.choice(200,5 if step % 2 == 0 else 60,replace=False):
+            name = 'box%03d'%i
+            if name in cd.objects:
+                cd.update_polygon(name,random_box(rng))
+        cd.remove('box%03d'%(step*7))
+        cd.update_circle('circle',tuple(rng.uniform(0,100,2)),rng.uniform(1,10))
+    assert 'box000' not in set(cd.candidates('circle',margin=200.0))
+
+def random_rectangle(rng):
+    x,y = rng.uniform(0,20,2)
+    l,w = rng.uniform(0.5,5,2)
+    th = rng.uniform(0,2*np.pi)
+    R = np.array([[np.cos(th),-np.sin(th)],[np.sin(th),np.cos(th)]])
+    return (np.array([[-l,-w],[l,-w],[l,w],[-l,w]])*0.5).dot(R.T) + [x,y]
+
+def test_batched_predicates():
+    rng = np.random.default_rng(1)
+    A = random_rectangle(rng)
+    Bs = [random_rectangle(rng) for i in range(500)]
+    Bs.append([(0,0),(1,0),(0,1)])     #fewer vertices
+    assert list(collisions.polygons_intersect_polygon_2d(A,Bs)) == [collisions.polygon_intersects_polygon_2d(A,B) for B in Bs]
+    assert np.allclose(collisions.polygons_polygon_distance_2d(A,Bs),[collisions.polygon_polygon_distance_2d(A,B) for B in Bs])
+    As = [random_rectangle(rng) for B in Bs]
+    assert list(collisions.polygon_pairs_intersect_2d(As,Bs)) == [collisions.polygon_intersects_polygon_2d(A,B) for A,B in zip(As,Bs)]
+    pts = rng.uniform(0,20,(1000,2))
+    L = [(0,0),(10,0),(10,3),(3,3),(3,10),(0,10)]   #not convex
+    for poly in [A,L]:
+        assert list(collisions.points_in_polygon_2d(pts,poly)) == [collisions.point_in_polygon_2d(p,poly) for p in pts]
+        assert np.allclose(collisions.points_polygon_distance_2d(pts,poly),[collisions.point_polygon_distance_2d(p,poly) for p in pts])
+    #points on the boundary aren't contained
+    square = [(0,0),(1,0),(1,1),(0,1)]
+    assert list(collisions.points_in_polygon_2d([(0,0),(0.5,0),(0.5,0.5),(1,0.5)],square)) == [False,False,True,False]
+
+if __name__=='__main__':
+    test_collision_detector()
+    test_batched_predicates()
@@ -0,0 +1,161 @@
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from GEMstack.utils import settings,config
+from GEMstack.onboard.component import Component
+from GEMstack.onboard.execution import execution
+from GEMstack.onboard.execution.execution import ComponentExecutor,ExecutorBase,OutputRingBuffer,component_dependencies
+from GEMstack.state import AllState
+
+class DummyComponent(Component):
+    def __init__(self, inputs, outputs, value=None):
+        self.inputs = inputs
+        self.outputs = outputs
+        self.value = value
+    def state_inputs(self):
+        return self.inputs
+    def state_outputs(self):
+        return self.outputs
+    def update(self, *args):
+        print("updating",self.outputs)
+        return self.value
+
+def test_component_dependencies():
+    components = {'a':ComponentExecutor(DummyComponent([],['vehicle'])),
+                  'b':ComponentExecutor(DummyComponent(['vehicle'],['roadgraph'])),
+                  'c':ComponentExecutor(DummyComponent(['vehicle'],['agents'])),
+                  'd':ComponentExecutor(DummyComponent(['all'],['trajectory']))}
+    deps = component_dependencies(components,['a','b','c','d'])
+    assert deps['a'] == set()
+    assert deps['b'] == {'a'}
+    assert deps['c'] == {'a'}
+    assert deps['d'] == {'a','b','c'}
+
+def test_parallel_update():
+    order = execution.COMPONENT_ORDER
+    execution.COMPONENT_ORDER = ['state_estimation','roadgraph_update','agent_detection']
+    try:
+        components = {'state_estimation':ComponentExecutor(DummyComponent([],['vehicle_lane'],'lane1')),
+                      'roadgraph_update':ComponentExecutor(DummyComponent(['vehicle_lane'],['relations'],[])),
+                      'agent_detection':ComponentExecutor(DummyComponent(['vehicle_lane'],['agents'],{}))}
+        for c in components.values():
+            c.print_stdout = False
+        executor = ExecutorBase(None)
+        executor.set_parallel(3)
+        from concurrent.futures import ThreadPoolExecutor
+        executor.thread_pool = ThreadPoolExecutor(3)
+        state = AllState.zero()
+        state.t = 1.0
+        executor.update_components(components,state)
+        #the dependencies are recomputed when a component is replaced
+        components['roadgraph_update'] = ComponentExecutor(DummyComponent([],['relations'],[]))
+        components['roadgraph_update'].print_stdout = False
+        executor.update_components(components,state)
+        assert executor.dependencies[id(components)][2]['roadgraph_update'] == set()
+        executor.thread_pool.shutdown()
+    finally:
+        execution.COMPONENT_ORDER = order
+    assert state.vehicle_lane == 'lane1'
+    assert state.relations == []
+    assert state.agents == {}
+
+def test_output_ring_buffer():
+    buf = OutputRingBuffer(16)
+    buf.write("hello\n")
+    assert buf.drain() == "hello\n"
+    assert buf.drain() == ""
+    buf.write("0123456789")
+    buf.write("abcdefghij")
+    assert buf.drain() == "[... 4 bytes of output dropped ...]\n456789abcdefghij"
+    buf.write("x"*20)
+    assert buf.drain() == "[... 4 bytes of output dropped ...]\n" + "x"*16
+
+def test_triggered_update():
+    c = ComponentExecutor(DummyComponent(['vehicle_lane'],['relations'],[]))
+    c.print_stdout = False
+    c.triggers = ['vehicle_lane','front_camera']
+    c.sensor_arrivals = {'front_camera':0}
+    state = AllState.zero()
+    assert c.update(0.0,state)
+    assert not c.update(1.0,state)
+    state.vehicle_lane = 'lane1'
+    assert c.update(2.0,state)
+    assert not c.update(3.0,state)
+    c.sensor_arrivals['front_camera'] += 1
+    assert c.update(4.0,state)
+    #rate limits still apply
+    c.dt = 1.0
+    c.sensor_arrivals['front_camera'] += 1
+    assert c.update(5.0,state)
+    c.sensor_arrivals['front_camera'] += 1
+    assert not c.update(5.5,state)
+    assert c.update(6.0,state)
+
+class FakeVehicleInterface:
+    def __init__(self):
+        self.callbacks = dict()
+    def sensors(self):
+        return ['front_camera','top_lidar']
+    def subscribe_sensor(self, name, callback, type = None):
+        self.callbacks[name] = callback
+
+def test_sensor_arrivals():
+    vehicle_interface = FakeVehicleInterface()
+    subscribe_sensor = vehicle_interface.subscribe_sensor
+    executor = ExecutorBase(vehicle_interface)
+    #nothing is wrapped until a sensor triggers a component
+    assert vehicle_interface.subscribe_sensor == subscribe_sensor
+    executor.track_sensor_arrivals(['vehicle_lane'])
+    assert vehicle_interface.subscribe_sensor == subscribe_sensor and not executor.trigger_sensors
+    executor.track_sensor_arrivals(['vehicle_lane','front_camera'])
+    assert executor.trigger_sensors == {'front_camera'}
+    readings = []
+    vehicle_interface.subscribe_sensor('front_camera',readings.append)
+    vehicle_interface.subscribe_sensor('top_lidar',readings.append)
+    #only the trigger sensor's callback is wrapped
+    assert vehicle_interface.callbacks['top_lidar'] == readings.append
+    vehicle_interface.callbacks['top_lidar'](1)
+    assert executor.sensor_arrivals == {'front_camera':0} and not executor.trigger_event.is_set()
+    vehicle_interface.callbacks['front_camera'](2)
+    assert readings == [1,2]
+    assert executor.sensor_arrivals == {'front_camera':1} and executor.trigger_event.is_set()
+
+def test_lazy_pipeline():
+    #the computation graph settings and globals are shared with the other tests
+    old_run = settings.settings().get('run',None)
+    old_graph = execution.COMPONENTS,execution.COMPONENT_ORDER,execution.COMPONENT_SETTINGS
+    try:
+        settings.set('run',{'computation_graph':config.load_config_recursive('GEMstack/knowledge/defaults/computation_graph.yaml')},leaf_only=False)
+        execution.load_computation_graph()
+        executor = ExecutorBase(None)
+        num_profiled = len(execution.STARTUP_PROFILE)
+        made = []
+        def factory():
+            made.append(True)
+            c = executor.make_component('recovery.StopTrajectoryTracker','trajectory_tracking','GEMstack.onboard.planning',{'vehicle_interface':None})
+            return {},{'trajectory_tracking':c},{}
+        executor.add_lazy_pipeline('stop',factory,['trajectory_tracking'])
+        assert 'stop' not in executor.pipelines and not made
+        assert executor.load_pipeline('stop')
+        assert executor.load_pipeline('stop')
+        assert len(made) == 1
+        assert not executor.load_pipeline('missing')
+        profile = execution.STARTUP_PROFILE[num_profiled:]
+        assert len(profile) == 1 and profile[0]['class'] == 'StopTrajectoryTracker'
+        assert ('GEMstack.onboard.planning.recovery','StopTrajectoryTracker') in execution.COMPONENT_CLASSES
+    finally:
+        if old_run is None:
+            del settings.settings()['run']
+        else:
+            settings.set('run',old_run,leaf_only=False)
+        execution.COMPONENTS,execution.COMPONENT_ORDER,execution.COMPONENT_SETTINGS = old_graph
+
+if __name__=='__main__':
+    test_component_dependencies()
+    test_parallel_update()
+    test_output_ring_buffer()
+    test_triggered_update()
+    test_sensor_arrivals()
+    test_lazy_pipeline()
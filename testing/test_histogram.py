@@ -0,0 +1,23 @@
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from GEMstack.utils.histogram import LatencyHistogram
+import numpy as np
+
+def test_histogram():
+    hist = LatencyHistogram()
+    values = np.random.RandomState(0).exponential(0.01,size=10000)
+    for v in values:
+        hist.record(v)
+    assert hist.count == len(values)
+    assert hist.max == values.max()
+    for p in [50,90,99]:
+        exact = np.percentile(values,p)
+        approx = hist.percentile(p)
+        assert abs(approx - exact) <= exact*2.0/hist.sub_buckets, (p,exact,approx)
+    print(hist.summary())
+
+if __name__=='__main__':
+    test_histogram()
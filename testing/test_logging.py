@@ -0,0 +1,243 @@
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from GEMstack.utils.logging import Logfile,BinaryLogfile,convert_logfile,KEYFRAME_KEY
+from GEMstack.utils.logging import open_logfile
+from GEMstack.utils.sensor_log import SensorLogWriter,open_sensor_log
+import numpy as np
+from GEMstack.onboard.execution.logging import LogWriter,AllStateLogger,VehicleBehaviorLogger,LogReplay
+from GEMstack.state import ObjectPose,ObjectFrameEnum,AllState
+import tempfile
+import threading
+
+def test_binary_logfile():
+    folder = tempfile.mkdtemp()
+    fn = os.path.join(folder,'behavior.glog')
+    log = BinaryLogfile(fn,delta_format=True,mode='w',chunk_size=8)
+    for i in range(100):
+        msg = {'speed':float(i)}
+        if i % 10 == 0:
+            msg['pose'] = ObjectPose(frame=ObjectFrameEnum.START,t=float(i),x=float(i),y=0.0)
+        log.log(msg,list(msg.keys()),t=float(i))
+    log.close()
+
+    log = BinaryLogfile(fn,delta_format=True,mode='r')
+    assert log.time_range() == (0.0,99.0)
+    cumulative,msgs = log.read(duration_from_start=25.5,cumulative=True)
+    assert len(msgs) == 26
+    assert msgs[-1]['speed'] == 25.0
+    assert cumulative['pose'].x == 20.0
+
+    #seek backwards and forwards, restoring items last set in earlier chunks
+    for t in [75.0,3.0,42.0]:
+        log.seek(t)
+        assert log.next_item_time == t
+        assert log.cumulative_item['pose'].x == 10*(t//10)
+        msgs = log.read(duration_to_advance=2.0)
+        assert [m['time'] for m in msgs] == [t,t+1]
+    log.close()
+
+    #only decode the requested items
+    log = BinaryLogfile(fn,delta_format=True,mode='r',items=['pose'])
+    log.seek(55.0)
+    assert set(log.cumulative_item.keys()) == {'pose'}
+    log.close()
+
+    #round trip through JSON
+    json_fn = os.path.join(folder,'behavior.json')
+    assert convert_logfile(fn,json_fn,True) == 100
+    log = Logfile(json_fn,delta_format=True,mode='r')
+    cumulative,msgs = log.read(absolute_time=1000.0,cumulative=True)
+    assert len(msgs) == 100 and cumulative['pose'].x == 90.0
+
+def test_log_writer():
+    folder = tempfile.mkdtemp()
+    fn = os.path.join(folder,'behavior.json')
+    log = Logfile(fn,delta_format=True,mode='w')
+    writer = LogWriter(max_queue=4,fsync_interval=0.01)
+    writer.start()
+    for i in range(100):
+        writer.submit(log.log,{'speed':float(i)},None,float(i),file=log.file)
+    writer.submit(writer.sync_and_close,log.file,log.close,droppable=False)
+    writer.stop()
+    stats = writer.stats()
+    assert stats['jobs'] == 101 and stats['dropped'] == 0
+    assert stats['max_queue_depth'] <= 4
+    assert stats['bytes_written'] == os.path.getsize(fn)
+    log = Logfile(fn,delta_format=True,mode='r')
+    msgs = log.read(duration_from_start=1000.0)
+    assert [m['speed'] for m in msgs] == [float(i) for i in range(100)]
+
+    #when the writer is stalled, debug writes are dropped and others displace them
+    gate = threading.Event()
+    written = []
+    writer = LogWriter(max_queue=2,policy='drop_debug')
+    writer.start()
+    writer.submit(gate.wait)
+    while writer.queue_depth() > 0: pass
+    assert writer.submit(written.append,'debug1',debug=True)
+    assert writer.submit(written.append,'debug2',debug=True)
+    assert not writer.submit(written.append,'debug3',debug=True)
+    assert writer.submit(written.append,'data')
+    for i in range(5):
+        writer.submit(written.append,'meta%d'%i,key='meta')
+    gate.set()
+    writer.stop()
+    assert written == ['data','meta4']
+    assert writer.stats()['dropped'] == 3
+
+def test_log_after_modify():
+    #the pipeline modifies state items in place after they are logged, while
+    #the writes are still pending
+    folder = tempfile.mkdtemp()
+    for ext in ['.json','.glog']:
+        gate = threading.Event()
+        writer = LogWriter()
+        writer.start()
+        writer.submit(gate.wait)
+        state_fn = os.path.join(folder,'state'+ext)
+        logger = AllStateLogger(['vehicle'],None,state_fn,writer=writer)
+        state = AllState.zero()
+        state.vehicle.pose = ObjectPose(frame=ObjectFrameEnum.ABSOLUTE_CARTESIAN,t=0.0,x=1.0,y=2.0)
+        logger.update(state)
+        state.vehicle.pose.x = 5.0
+        class FakeInterface:
+            last_command = {'accelerator_pedal_position':0.5}
+            last_reading = None
+        interface = FakeInterface()
+        behavior_fn = os.path.join(folder,'behavior'+ext)
+        behavior = VehicleBehaviorLogger(open_logfile(behavior_fn,delta_format=True,mode='w'),interface,writer=writer)
+        behavior.update(state)
+        interface.last_command['accelerator_pedal_position'] = 0.0
+        gate.set()
+        logger.cleanup()
+        writer.submit(writer.sync_and_close,behavior.behavior_log.file,behavior.behavior_log.close,droppable=False)
+        writer.stop()
+        log = open_logfile(state_fn,delta_format=False,mode='r')
+        assert log.read(duration_from_start=100.0)[0]['vehicle'].pose.x == 1.0
+        log.close()
+        log = open_logfile(behavior_fn,delta_format=True,mode='r')
+        assert log.read(duration_from_start=100.0)[0]['vehicle_interface_command']['accelerator_pedal_position'] == 0.5
+        log.close()
+
+def test_state_keyframes():
+    folder = tempfile.mkdtemp()
+    for ext in ['.json','.glog']:
+        fn = os.path.join(folder,'state'+ext)
+        logger = AllStateLogger(['vehicle_lane','route','parking_slot'],None,fn,keyframe_interval=2.0)
+        state = AllState.zero()
+        for i in range(50):
+            state.t = i*0.1
+            if i % 3 == 0:
+                state.vehicle_lane = 'lane%d'%i
+                state.vehicle_lane_update_time = state.t
+            if i == 7:
+                state.parking_slot = ObjectPose(frame=ObjectFrameEnum.START,t=state.t,x=1.0,y=2.0)
+            logger.update(state.snapshot())
+        logger.cleanup()
+
+        log = open_logfile(fn,delta_format=False,mode='r')
+        lines = log.read(duration_from_start=100.0)
+        keyframes = [m for m in lines if KEYFRAME_KEY in m]
+        assert [m[KEYFRAME_KEY] for m in keyframes] == [0.0,2.0,4.0]
+        assert all('route' in m for m in keyframes)
+        assert all(set(m.keys()) == {'vehicle_lane','vehicle_lane_update_time'} for m in lines if KEYFRAME_KEY not in m and 'parking_slot' not in m)
+        assert len(lines) == 17 + 2 + 1
+        if ext == '.json':
+            assert [kt for kt,offset in log.keyframes()] == [0.0,2.0,4.0]
+        for t in [4.35,0.75,2.0]:
+            items = log.seek(t)
+            lane = max(i for i in range(0,50,3) if i*0.1 < t)
+            assert items['vehicle_lane'] == 'lane%d'%lane
+            assert items['parking_slot'].x == 1.0
+            assert items['route'] is None
+        log.close()
+
+class FakeClock:
+    def __init__(self):
+        self.t = 1000.0
+    def time(self):
+        return self.t
+
+def test_log_replay():
+    folder = tempfile.mkdtemp()
+    fn = os.path.join(folder,'behavior.json')
+    log = Logfile(fn,delta_format=True,mode='w')
+    for i in range(1000):
+        msg = {'speed':float(i)}
+        if i % 100 == 0:
+            msg['pose'] = ObjectPose(frame=ObjectFrameEnum.START,t=float(i),x=float(i),y=0.0)
+        log.log(msg,None,t=100.0+i*0.1)
+    log.close()
+
+    log = Logfile(fn,delta_format=True,mode='r')
+    assert log.time_range() == (100.0,199.9)
+    assert os.path.exists(log.index_filename())
+    items = log.seek(150.0)
+    assert items['speed'] == 499.0 and items['pose'].x == 400.0
+    assert [m['speed'] for m in log.read(duration_to_advance=0.25)] == [500.0,501.0,502.0]
+    items = log.seek(120.05)
+    assert items['speed'] == 200.0 and items['pose'].x == 200.0
+    log.close()
+    #the sidecar index is reused
+    log = Logfile(fn,delta_format=True,mode='r',items=['pose'])
+    assert log.offsets()['offsets'][1] == len(open(fn).readline())
+    items = log.seek(150.0)
+    assert list(items.keys()) == ['pose'] and items['pose'].x == 400.0
+    log.close()
+
+    clock = FakeClock()
+    replay = LogReplay(clock,['speed','pose'],fn,speed_multiplier=2.0,start=40.0,end=45.0)
+    speed,pose = replay.update()
+    assert speed == 399.0 and pose.x == 300.0
+    clock.t += 1.0
+    speed,pose = replay.update()
+    assert speed == 419.0 and pose.x == 400.0
+    clock.t += 10.0
+    speed,pose = replay.update()
+    assert speed == 449.0
+    assert replay.update() is None
+    replay.cleanup()
+
+    replay = LogReplay(clock,['speed'],fn,speed_multiplier=float('inf'),end=1.0)
+    assert [replay.update() for i in range(12)] == [float(i) for i in range(10)] + [None,None]
+    replay.cleanup()
+
+def test_sensor_log():
+    folder = tempfile.mkdtemp()
+    lidar = SensorLogWriter(os.path.join(folder,'top_lidar'),chunk_bytes=4096)
+    camera = SensorLogWriter(os.path.join(folder,'front_camera'),chunk_bytes=4096)
+    for i in range(20):
+        lidar.write(i*0.1,np.full((10+i,3),i,dtype=np.float32))
+        if i % 2 == 0:
+            camera.write(i*0.1,np.full((16,16,3),i,dtype=np.uint8))
+    lidar.close()
+    #simulate a crash while writing the camera's index
+    camera.index.write(b'partial')
+    camera.index.flush()
+
+    readers = open_sensor_log(folder)
+    assert sorted(readers.keys()) == ['front_camera','top_lidar']
+    points = readers['top_lidar']
+    assert len(points) == 20 and points.time_range() == (0.0,1.9000000000000001)
+    assert len(os.listdir(os.path.join(folder,'top_lidar'))) > 2
+    frame = points.frame(15)
+    assert frame.shape == (25,3) and frame.dtype == np.float32 and (frame == 15).all()
+    #frames are read-only views of the file
+    assert not frame.flags.owndata and not frame.flags.writeable
+    assert points.at(0.55)[0,0] == 5 and points.at(-1.0) is None
+    assert [t for t,f in points.frames(0.5,0.8)] == [0.5,0.6000000000000001,0.7000000000000001]
+    image = readers['front_camera'].at(1.0)
+    assert image.shape == (16,16,3) and image[0,0,0] == 10
+    assert len(readers['front_camera']) == 10
+    camera.close()
+
+if __name__=='__main__':
+    test_binary_logfile()
+    test_log_writer()
+    test_log_after_modify()
+    test_state_keyframes()
+    test_log_replay()
+    test_sensor_log()
@@ -0,0 +1,188 @@
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import numpy as np
+import time
+from types import SimpleNamespace
+from GEMstack.onboard.component import Component
+from GEMstack.onboard.execution.multiprocess_execution import MPComponentExecutor,SharedMemoryRing,SharedMemoryMessage
+
+class EchoComponent(Component):
+    """Returns views of its input arrays."""
+    def state_inputs(self):
+        return ['big','small']
+    def state_outputs(self):
+        return ['big','head','small']
+    def rate(self):
+        return None
+    def update(self, big, small):
+        return big[::2],big[:10],small
+
+class BusyComponent(Component):
+    """Spends some CPU time in each update."""
+    def state_inputs(self):
+        return ['big']
+    def state_outputs(self):
+        return ['small']
+    def rate(self):
+        return None
+    def update(self, big):
+        t0 = time.thread_time()
+        while time.thread_time() - t0 < 0.02:
+            pass
+        return big[:10].copy()
+
+class RecordingQueue:
+    """Records each output and the input ring's released position when it is
+    sent."""
+    def __init__(self, in_ring, out_ring):
+        self.in_ring = in_ring
+        self.out_ring = out_ring
+        self.items = []
+    def put(self, item):
+        released = self.in_ring.released.value
+        if isinstance(item,tuple):
+            #(cpu time, outputs)
+            item = item[1]
+        if isinstance(item,SharedMemoryMessage):
+            #arrays that are still in the message are sent as-is
+            sent = [a.flags.owndata for a in item.payload if isinstance(a,np.ndarray)]
+            item = self.out_ring.decode(item,copy_arrays=True)
+            self.items.append((item,released,sent))
+        else:
+            self.items.append((item,released,None))
+
+def test_ring_wraparound():
+    ring = SharedMemoryRing(1024)
+    try:
+        offsets = []
+        for i in range(20):
+            a = np.full(40,i,dtype=float)
+            msg = ring.encode([a],min_bytes=0)
+            assert isinstance(msg,SharedMemoryMessage)
+            offsets.append(msg.payload[0].offset)
+            b = ring.decode(msg)[0]
+            assert (b == i).all()
+            ring.release(msg)
+        #the 320 byte arrays wrap around every 3 messages, skipping the tail
+        assert offsets[:4] == [0,320,640,0]
+        assert max(offsets) + 320 <= 1024
+    finally:
+        ring.close()
+
+def test_ring_full():
+    ring = SharedMemoryRing(1024)
+    try:
+        msgs = [ring.encode([np.full(40,i,dtype=float)],min_bytes=0) for i in range(3)]
+        assert all(isinstance(msg,SharedMemoryMessage) for msg in msgs)
+        #falls back to sending the arrays themselves
+        a = [np.full(40,3,dtype=float)]
+        assert ring.encode(a,min_bytes=0) is a
+        #releasing the first message frees its space only
+        ring.release(msgs[0])
+        msg = ring.encode(a,min_bytes=0)
+        assert isinstance(msg,SharedMemoryMessage) and msg.payload[0].offset == 0
+        assert ring.encode(a,min_bytes=0) is a
+        #copy_arrays releases the message
+        for i,m in enumerate(msgs[1:]):
+            assert (ring.decode(m,copy_arrays=True)[0] == i+1).all()
+        assert (ring.decode(msg,copy_arrays=True)[0] == 3).all()
+        assert ring.released.value == ring.written.value
+    finally:
+        ring.close()
+
+def test_ring_detach():
+    ring = SharedMemoryRing(1024)
+    try:
+        msg = ring.encode([np.arange(10.0),np.arange(2.0)],min_bytes=64)
+        view,small = ring.decode(msg)
+        res = ring.detach((view[1:],small))
+        assert res[1] is small
+        assert not np.may_share_memory(res[0],view)
+        ring.release(msg)
+        ring.encode([np.zeros(10)],min_bytes=0)
+        assert (res[0] == np.arange(1.0,10.0)).all()
+        del view
+    finally:
+        ring.close()
+
+def test_release_order():
+    #run the subprocess loop in this process on queued messages
+    import queue
+    import signal
+    in_ring = SharedMemoryRing(1024*1024)
+    out_ring = SharedMemoryRing(1024*1024)
+    inputs = queue.Queue()
+    msgs = [in_ring.encode((np.full(200000,i,dtype=np.uint8),np.full(10,i))) for i in range(2)]
+    for msg in msgs:
+        inputs.put(msg)
+    inputs.put('stop')
+    outputs = RecordingQueue(in_ring,out_ring)
+    handler = signal.getsignal(signal.SIGINT)
+    try:
+        MPComponentExecutor._run(None,EchoComponent(),inputs,outputs,{},in_ring,out_ring)
+    finally:
+        signal.signal(signal.SIGINT,handler)
+        in_ring.close()
+        out_ring.close()
+    assert outputs.items[0][0] == 'initialized'
+    #each input is released only when the next one arrives
+    assert [released for item,released,sent in outputs.items[1:]] == [0,msgs[0].end]
+    for i,((big,head,small),released,sent) in enumerate(outputs.items[1:]):
+        #the small view of the input was copied before it was sent
+        assert sent == [True,True]
+        assert big.shape == (100000,) and (big == i).all()
+        assert (head == i).all() and (small == i).all()
+
+def test_pipelined_updates():
+    #inputs are sent without waiting for outputs
+    executor = MPComponentExecutor(EchoComponent(),shared_memory_size=1024*1024)
+    executor.print_stdout = False
+    executor.start()
+    try:
+        n = 8
+        outputs = []
+        for i in range(n):
+            res = executor.do_update(0.0,np.full(200000,i,dtype=np.uint8),np.full(10,i))
+            if res is not None:
+                outputs.append(res)
+        #read the rest without sending more inputs
+        while len(outputs) < n:
+            cpu_time,res = executor._out_queue.get(timeout=5.0)
+            if isinstance(res,SharedMemoryMessage):
+                res = executor._out_ring.decode(res,copy_arrays=True)
+            outputs.append(res)
+        for i,(big,head,small) in enumerate(outputs):
+            assert big.shape == (100000,)
+            assert (big == i).all() and (head == i).all() and (small == i).all()
+    finally:
+        executor.stop()
+
+def test_cpu_time():
+    #the CPU time is that of the update in the subprocess
+    executor = MPComponentExecutor(BusyComponent())
+    executor.print_stdout = False
+    executor.start()
+    try:
+        state = SimpleNamespace(big=np.zeros(100))
+        for i in range(500):
+            executor.update_now(0.0,state)
+            if hasattr(state,'small'):
+                break
+            time.sleep(0.01)
+        assert hasattr(state,'small')
+        cpu_time = executor.timing_stats()['cpu_time']
+        assert cpu_time['count'] == 1 and cpu_time['max'] >= 0.02
+        assert executor.timing_stats()['wall_time']['count'] == i+1
+    finally:
+        executor.stop()
+
+if __name__=='__main__':
+    test_ring_wraparound()
+    test_ring_full()
+    test_ring_detach()
+    test_release_order()
+    test_pipelined_updates()
+    test_cpu_time()
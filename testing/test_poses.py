@@ -4,10 +4,11 @@ import os
 sys.path.append(os.getcwd())
 
 from GEMstack.state import PhysicalObject,ObjectPose,ObjectFrameEnum
-from GEMstack.state.physical_object import _get_frame_chain
+from GEMstack.state.physical_object import _get_frame_chain,get_frame_converter,convert_points,convert_poses
 from GEMstack.mathutils import transforms
 import math
 import time
+import numpy as np
 
 def test_poses():
     print(math.degrees(transforms.heading_to_yaw(0.0)),'== 90')
@@ -55,5 +56,87 @@ def test_poses():
     test_pose_start.to_frame(ObjectFrameEnum.ABSOLUTE_CARTESIAN,current_pose=current_pose_abs,start_pose_abs=start_pose_abs)
     print("TODO: make this more comprehensive")
 
+def reference_to_frame(pose, frame, current_pose, start_pose_abs):
+    #converts by walking the frame chain one pose at a time
+    xyhead = (pose.x,pose.y,pose.yaw)
+    z = pose.z
+    for (f,p,dir) in _get_frame_chain(pose.frame,frame,current_pose,start_pose_abs)[1:]:
+        xyhead = p.apply_xyhead(xyhead) if dir == 1 else p.apply_inv_xyhead(xyhead)
+        z += p.z*dir
+    return xyhead,z
+
+def test_frame_converter():
+    start_pose_abs = ObjectPose(frame=ObjectFrameEnum.ABSOLUTE_CARTESIAN,t=1000.0,x=30.0,y=20.0,z=1.0,yaw=0.5)
+    current_poses = [ObjectPose(frame=ObjectFrameEnum.ABSOLUTE_CARTESIAN,t=1055.0,x=60.0,y=25.0,z=2.0,yaw=1.5),
+                     ObjectPose(frame=ObjectFrameEnum.START,t=55.0,x=60.0,y=25.0,z=0.5,yaw=-2.0)]
+    frames = [ObjectFrameEnum.START,ObjectFrameEnum.CURRENT,ObjectFrameEnum.ABSOLUTE_CARTESIAN]
+    rng = np.random.default_rng(0)
+    for current_pose in current_poses:
+        for source in frames:
+            poses = [ObjectPose(frame=source,t=float(t),x=float(x),y=float(y),z=float(z),yaw=float(yaw)) for (t,x,y,z,yaw) in rng.normal(size=(10,5))*10]
+            for target in frames:
+                converted = convert_poses(poses,target,current_pose,start_pose_abs)
+                for p,q in zip(poses,converted):
+                    assert q.frame == target
+                    if source == target:
+                        assert q == p
+                        continue
+                    (x,y,yaw),z = reference_to_frame(p,target,current_pose,start_pose_abs)
+                    assert np.allclose([q.x,q.y,q.z],[x,y,z])
+                    assert abs(math.remainder(q.yaw-yaw,2*math.pi)) < 1e-9
+                    assert 0 <= q.yaw < 2*math.pi
+                    q1 = p.to_frame(target,current_pose,start_pose_abs)
+                    assert np.allclose([q1.t,q1.x,q1.y,q1.z,q1.yaw],[q.t,q.x,q.y,q.z,q.yaw])
+                #3D points use the full rotation of each pose
+                pts = rng.normal(size=(5,3))
+                res = convert_points(pts,source,target,current_pose,start_pose_abs)
+                for pt,r in zip(pts,res):
+                    for (f,pose,dir) in _get_frame_chain(source,target,current_pose,start_pose_abs)[1:]:
+                        pt = pose.apply(pt) if dir == 1 else pose.apply_inv(pt)
+                    assert np.allclose(pt,r)
+    #converters are cached by the values of the reference poses
+    conv = get_frame_converter(ObjectFrameEnum.CURRENT,ObjectFrameEnum.START,current_poses[1],start_pose_abs)
+    assert conv is get_frame_converter(ObjectFrameEnum.CURRENT,ObjectFrameEnum.START,current_poses[1],start_pose_abs)
+    current_poses[1].x += 1.0
+    assert conv is not get_frame_converter(ObjectFrameEnum.CURRENT,ObjectFrameEnum.START,current_poses[1],start_pose_abs)
+
+def test_geodetic():
+    olat,olon = 40.09286250064475,-88.23565755734872
+    rng = np.random.default_rng(1)
+    lat = olat + rng.normal(size=100)*0.01
+    lon = olon + rng.normal(size=100)*0.01
+    x,y = transforms.lat_lon_to_xy(lat,lon,olat,olon)
+    assert x.shape == (100,)
+    for i in range(0,100,10):
+        xi,yi = transforms.lat_lon_to_xy(lat[i],lon[i],olat,olon)
+        assert abs(xi-x[i]) < 1e-9 and abs(yi-y[i]) < 1e-9
+    lat_back,lon_back = transforms.xy_to_lat_lon(x,y,olat,olon)
+    assert np.allclose(lat_back,lat,atol=1e-12) and np.allclose(lon_back,lon,atol=1e-12)
+    #one degree of latitude is about 111 km
+    assert abs(transforms.lat_lon_to_xy(olat+1.0,olon,olat,olon)[1] - 111030) < 100
+    #the same series as alvinxy's mdeglon
+    for la in [0.0,20.0,olat,60.0,80.0]:
+        r = math.radians(la)
+        mdeglon = 111415.13*math.cos(r) - 94.55*math.cos(3.0*r) + 0.12*math.cos(5.0*r)
+        assert abs(transforms.LocalTangentPlane(la,olon).m_per_deg_lon - mdeglon) < 1e-6
+    #poses and points through a GLOBAL frame
+    start_pose_global = ObjectPose(frame=ObjectFrameEnum.GLOBAL,t=0.0,x=olon,y=olat,yaw=math.radians(30.0))
+    poses = [ObjectPose(frame=ObjectFrameEnum.GLOBAL,t=1.0,x=float(lo),y=float(la),yaw=1.0) for la,lo in zip(lat,lon)]
+    converted = convert_poses(poses,ObjectFrameEnum.START,start_pose_abs=start_pose_global)
+    for p,q in zip(poses,converted):
+        x,y,yaw = start_pose_global.apply_inv_xyhead((p.x,p.y,p.yaw))
+        assert np.allclose([q.x,q.y],[x,y])
+        assert abs(math.remainder(q.yaw-yaw,2*math.pi)) < 1e-9
+    back = convert_poses(converted,ObjectFrameEnum.GLOBAL,start_pose_abs=start_pose_global)
+    assert np.allclose([(p.x,p.y,p.yaw) for p in back],[(p.x,p.y,p.yaw) for p in poses])
+    try:
+        import alvinxy.alvinxy
+    except ImportError:
+        print("alvinxy not installed, skipping cross-check")
+        return
+    assert transforms.geodetic_cross_check(lat,lon,olat,olon) < 1e-6
+
 if __name__=='__main__':
-    test_poses()
\ No newline at end of file
+    test_poses()
+    test_frame_converter()
+    test_geodetic()
\ No newline at end of file
@@ -0,0 +1,78 @@
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from GEMstack.state import AllState,AgentState,AgentEnum,AgentAttributesFlag,ObjectPose,ObjectFrameEnum
+from GEMstack.knowledge.predicates.predicate import *
+from GEMstack.knowledge.predicates.agent_count import AgentCountPredicate
+
+class CountingPredicate(PredicateBase):
+    """Returns the vehicle's x coordinate and counts its calls."""
+    calls = 0
+
+    def __init__(self, declare_inputs = True):
+        self.declare_inputs = declare_inputs
+
+    def args(self):
+        return [self.declare_inputs]
+
+    def value_type(self):
+        return float
+
+    def inputs(self):
+        return ['vehicle'] if self.declare_inputs else None
+
+    def value(self, state):
+        CountingPredicate.calls += 1
+        return state.vehicle.pose.x
+
+def test_evaluator():
+    state = AllState.zero()
+    x = CountingPredicate()
+    count = AgentCountPredicate()
+    preds = {'far':LTPredicate(10.0,x),
+             'far_and_empty':and_(LTPredicate(10.0,CountingPredicate()),EqPredicate(AgentCountPredicate(),0)),
+             'near_or_busy':or_(not_(LTPredicate(10.0,x)),not_(EqPredicate(count,0))),
+             'undeclared':EqPredicate(CountingPredicate(False),0.0)}
+    evaluator = PredicateEvaluator(preds)
+    #x, count, 10 < x, count == 0, and, two nots, or, undeclared, == 0.0
+    assert len(evaluator.nodes) == 10
+    def reference():
+        return dict((k,p.value(state)) for k,p in preds.items())
+
+    ref = reference()
+    CountingPredicate.calls = 0
+    assert evaluator.evaluate(state) == ref
+    #the shared x is evaluated once, along with the undeclared one
+    assert CountingPredicate.calls == 2
+    assert evaluator.evaluate(state) == ref
+    assert CountingPredicate.calls == 2
+    #unrelated items only re-evaluate predicates that may read anything
+    state.t = 1.0
+    assert evaluator.evaluate(state) == ref
+    assert CountingPredicate.calls == 3
+    calls = evaluator.evaluations
+    state.agents = {'ped':AgentState(pose=ObjectPose(ObjectFrameEnum.START,0,1,1),dimensions=(1,1,2),outline=None,type=AgentEnum.PEDESTRIAN,activity=None,velocity=(0,0,0),yaw_rate=0,attributes=AgentAttributesFlag.DEFAULT)}
+    ref = reference()
+    CountingPredicate.calls = 0
+    assert evaluator.evaluate(state) == ref
+    assert ref['near_or_busy'] and not ref['far_and_empty']
+    #the agent count isn't needed yet, since and / or short-circuit
+    assert CountingPredicate.calls == 1 and evaluator.evaluations == calls + 1
+    state.vehicle.pose.x = 20.0
+    state.touch('vehicle')
+    calls = evaluator.evaluations
+    assert evaluator.evaluate(state) == reference()
+    assert evaluator.evaluations == calls + 3
+    assert evaluator.value('far',state.snapshot())
+    #a new predicate shares nodes with the existing ones
+    n = len(evaluator.nodes)
+    assert evaluator.value(not_(EqPredicate(AgentCountPredicate(),0)),state)
+    assert len(evaluator.nodes) == n
+    #a different state
+    evaluator.reset()
+    assert evaluator.evaluate(AllState.zero())['far'] == False
+
+if __name__=='__main__':
+    test_evaluator()
@@ -0,0 +1,234 @@
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from GEMstack.state import ObjectPose,ObjectFrameEnum,VehicleState
+from GEMstack.state.roadgraph import Roadgraph,RoadgraphLane,RoadgraphCurve,RoadgraphCurveEnum,RoadgraphConnection,RoadgraphConnectionEnum,RoadgraphNetwork,RoadgraphRegion,RoadgraphRegionEnum
+from GEMstack.mathutils import transforms
+from GEMstack.mathutils.graph_search import shortest_path
+from GEMstack.onboard.planning.lane_routing import LaneRouter
+import numpy as np
+import tempfile
+import pickle
+
+def make_roadgraph(rng, nlanes=150):
+    lanes = dict()
+    for i in range(nlanes):
+        start = rng.uniform(0,500,2)
+        steps = rng.normal(size=(rng.integers(3,12),2))*5 + rng.normal(size=2)*5
+        pts = np.vstack((start,start+np.cumsum(steps,axis=0)))
+        center = [[(x,y,0.0) for x,y in pts[:len(pts)//2+1]],[(x,y,0.0) for x,y in pts[len(pts)//2+1:]]]
+        if i % 3 == 0:
+            #no centerline, just boundaries
+            left = [[(x,y+1.5,0.0) for x,y,z in seg] for seg in center]
+            right = [[(x,y-1.5,0.0) for x,y,z in seg] for seg in center]
+            lanes['lane%d'%i] = RoadgraphLane(left=RoadgraphCurve(RoadgraphCurveEnum.LANE_BOUNDARY,left),
+                                              right=RoadgraphCurve(RoadgraphCurveEnum.LANE_BOUNDARY,right))
+        else:
+            lanes['lane%d'%i] = RoadgraphLane(center=RoadgraphCurve(RoadgraphCurveEnum.LANE_BOUNDARY,center))
+    return Roadgraph(ObjectFrameEnum.START,lanes=lanes)
+
+def brute_force_lane_distances(roadgraph, point):
+    res = []
+    for name,lane in roadgraph.lanes.items():
+        best = (float('inf'),None)
+        s = 0.0
+        for seg in lane.centerline().segments:
+            for a,b in zip(seg[:-1],seg[1:]):
+                d,u = transforms.point_segment_distance(point,a,b)
+                if d < best[0]:
+                    best = (d,s + u*transforms.vector_dist(a,b))
+                s += transforms.vector_dist(a,b)
+        res.append((best[0],name,best[1]))
+    return sorted(res)
+
+def test_nearest_lanes():
+    rng = np.random.default_rng(0)
+    roadgraph = make_roadgraph(rng)
+    for point in rng.uniform(0,500,(30,2)):
+        point = (point[0],point[1],0.0)
+        ref = brute_force_lane_distances(roadgraph,point)
+        res = roadgraph.nearest_lanes(point,k=5)
+        assert [r[0] for r in res] == [r[1] for r in ref[:5]]
+        assert np.allclose([r[1] for r in res],[r[0] for r in ref[:5]])
+        assert np.allclose([r[2] for r in res],[r[2] for r in ref[:5]])
+        vehicle = VehicleState.zero()
+        vehicle.pose = ObjectPose(ObjectFrameEnum.START,0.0,point[0],point[1])
+        assert roadgraph.get_current_lane(vehicle) == ref[0][1]
+        #the previous lane is kept unless another is more than the hysteresis closer
+        second = ref[1][1]
+        assert roadgraph.get_current_lane(vehicle,second,hysteresis=ref[1][0]-ref[0][0]+1e-6) == second
+        assert roadgraph.get_current_lane(vehicle,second,hysteresis=0.0) == ref[0][1]
+    #the index is rebuilt when lanes are added
+    roadgraph.lanes['new'] = RoadgraphLane(center=RoadgraphCurve(RoadgraphCurveEnum.LANE_BOUNDARY,[[(1000.0,1000.0,0.0),(1010.0,1000.0,0.0)]]))
+    assert roadgraph.nearest_lanes((1005.0,1001.0))[0][0] == 'new'
+    assert np.allclose(roadgraph.nearest_lanes((1005.0,1001.0))[0][1:],(1.0,5.0))
+    #and when the lanes are replaced by others of the same number
+    roadgraph = Roadgraph(ObjectFrameEnum.START,lanes={'a':make_lane((0,0),(10,0))})
+    for k in range(1,100):
+        roadgraph.nearest_lanes((0.0,0.0))
+        roadgraph.lanes = None
+        lanes = dict()
+        lanes['a'] = make_lane((0,k),(10,k))
+        roadgraph.lanes = lanes
+        assert np.isclose(roadgraph.nearest_lanes((0.0,0.0))[0][1],k)
+        assert roadgraph.geometry().lanes[0][1] is lanes['a']
+    #and when an entry is replaced
+    roadgraph.lanes['a'] = make_lane((0,-3),(10,-3))
+    assert np.isclose(roadgraph.nearest_lanes((0.0,0.0))[0][1],3.0)
+    assert roadgraph.geometry().lanes[0][1] is roadgraph.lanes['a']
+    roadgraph.lanes['b'] = roadgraph.lanes.pop('a')
+    assert roadgraph.nearest_lanes((0.0,0.0))[0][0] == 'b'
+    #the index isn't pickled
+    size = len(pickle.dumps(Roadgraph(ObjectFrameEnum.START,lanes=dict(roadgraph.lanes))))
+    assert len(pickle.dumps(roadgraph)) == size
+
+def make_lane(*pts):
+    return RoadgraphLane(center=RoadgraphCurve(RoadgraphCurveEnum.LANE_BOUNDARY,[[(x,y,0.0) for x,y in pts]]))
+
+def test_lane_routing():
+    lanes = {'a':make_lane((0,0),(100,0)),
+             'a_left':make_lane((0,3.5),(100,3.5)),
+             'b':make_lane((100,0),(200,0)),
+             'turn':make_lane((100,3.5),(110,13.5)),
+             'c':make_lane((110,13.5),(110,100))}
+    connections = [RoadgraphConnection(RoadgraphConnectionEnum.ADJACENT,'a','a_left'),
+                   RoadgraphConnection(RoadgraphConnectionEnum.CONTINUES,'a','b'),
+                   RoadgraphConnection(RoadgraphConnectionEnum.LEFT_TURN,'a_left','turn'),
+                   RoadgraphConnection(RoadgraphConnectionEnum.CONTINUES,'turn','c')]
+    network = RoadgraphNetwork(Roadgraph(ObjectFrameEnum.START,lanes=lanes,connections=connections))
+    assert network.continuations('a') == ['b']
+    assert network.left_adjacent('a') is None     #no left boundary
+    router = LaneRouter(network,{'ADJACENT':5.0})
+    cost,pieces = router.shortest_route((10,0),(60,0.5))
+    assert pieces == [('a',10.0,60.0)] and abs(cost-50.0) < 1e-9
+    assert router.shortest_route((60,0),(10,0)) == (float('inf'),[])
+    assert router.route((60,0),(10,0)) is None
+    cost,pieces = router.shortest_route((10,0),(111,50))
+    assert [p[0] for p in pieces] == ['a','a_left','turn','c']
+    #lane change penalty + 10 m diagonal, the rest of the way along the lanes, and the turn penalty
+    lane_change = np.hypot(10.0,3.5) - 10.0
+    assert abs(cost - (90 + 5.0 + lane_change + np.hypot(10,10) + 5.0 + 36.5)) < 1e-6
+    route = router.route((10,0),(111,50))
+    assert route.frame == ObjectFrameEnum.START
+    assert route.lanes == ['a','a_left','turn','c']
+    assert np.allclose(route.points[0],(10,0)) and np.allclose(route.points[-1],(110,50))
+    assert abs(route.length() - sum(p[2]-p[1] for p in pieces) - np.hypot(10.0,3.5)) < 1e-6
+    with tempfile.TemporaryDirectory() as folder:
+        contracted = LaneRouter(network,{'ADJACENT':5.0},contract=True,cache_folder=folder)
+        assert len(os.listdir(folder)) == 1
+        #lane changes anywhere along a cost the same, so only compare lanes
+        c,p = contracted.shortest_route((10,0),(111,50))
+        assert abs(c - cost) < 1e-6 and [q[0] for q in p] == [q[0] for q in pieces]
+
+def make_grid_network(rng, n=6, spacing=50.0):
+    """Two-way streets on an n x n grid, with some lanes missing."""
+    lanes = dict()
+    ends = dict()
+    starts = dict()
+    for i in range(n):
+        for j in range(n):
+            for di,dj in [(1,0),(0,1),(-1,0),(0,-1)]:
+                if not (0 <= i+di < n and 0 <= j+dj < n) or rng.uniform() < 0.1:
+                    continue
+                #drive on the right, with some wiggle in the middle
+                off = np.array([dj,-di])*2.0
+                a = np.array([i,j])*spacing + off
+                b = np.array([i+di,j+dj])*spacing + off
+                mid = (a+b)/2 + rng.normal(size=2)*3
+                name = '%d_%d_%d_%d'%(i,j,i+di,j+dj)
+                lanes[name] = make_lane(tuple(a),tuple(mid),tuple(b))
+                starts.setdefault((i,j),[]).append(name)
+                ends.setdefault((i+di,j+dj),[]).append(name)
+    connections = []
+    for p,names in ends.items():
+        for lane1 in names:
+            for lane2 in starts.get(p,[]):
+                if lane2.split('_')[2:] != lane1.split('_')[:2]:
+                    connections.append(RoadgraphConnection(RoadgraphConnectionEnum.CONTINUES,lane1,lane2))
+    return Roadgraph(ObjectFrameEnum.START,lanes=lanes,connections=connections)
+
+def test_lane_routing_grid():
+    rng = np.random.default_rng(1)
+    roadgraph = make_grid_network(rng)
+    router = LaneRouter(roadgraph)
+    with tempfile.TemporaryDirectory() as folder:
+        contracted = LaneRouter(roadgraph,contract=True,cache_folder=folder)
+        cached = LaneRouter(roadgraph,contract=True,cache_folder=folder)
+        g = router.lane_graph
+        for k in range(50):
+            start,goal = rng.uniform(0,250,(2,2))
+            cost,pieces = router.shortest_route(start,goal)
+            lane0,s0 = router.snap(start)
+            lane1,s1 = router.snap(goal)
+            #Dijkstra without a heuristic
+            i = int(np.searchsorted(g.lane_positions[lane0],s0))
+            j = int(np.searchsorted(g.lane_positions[lane1],s1,side='right'))-1
+            ref,_ = shortest_path(g.graph,{g.lane_first_node[lane0]+i:g.lane_positions[lane0][i]-s0},
+                                  {g.lane_first_node[lane1]+j:s1-g.lane_positions[lane1][j]})
+            if lane0 == lane1 and s1 >= s0:
+                ref = min(ref,s1-s0)
+            assert cost == ref or abs(cost - ref) < 1e-6
+            for other in (contracted,cached):
+                c,p = other.shortest_route(start,goal)
+                assert c == cost or abs(c - cost) < 1e-6
+            if len(pieces) > 0:
+                assert pieces[0][:2] == (lane0,s0) and pieces[-1][0] == lane1 and pieces[-1][2] == s1
+                #continuing costs the gap between the lanes at the intersection
+                gaps = [np.linalg.norm(g.lane_points(p[0],[p[2]])-g.lane_points(q[0],[q[1]])) for p,q in zip(pieces[:-1],pieces[1:])]
+                assert abs(sum(p[2]-p[1] for p in pieces) + sum(gaps) - cost) < 1e-6
+
+def test_to_frame():
+    rng = np.random.default_rng(2)
+    roadgraph = make_roadgraph(rng,nlanes=20)
+    roadgraph.frame = ObjectFrameEnum.ABSOLUTE_CARTESIAN
+    roadgraph.curves['curb'] = RoadgraphCurve(RoadgraphCurveEnum.CURB,[[(0.0,0.0),(5.0,1.0)]])
+    roadgraph.regions['lot'] = RoadgraphRegion(RoadgraphRegionEnum.PARKING_LOT,[(0.0,0.0),(10.0,0.0),(10.0,10.0)])
+    roadgraph.connections.append(RoadgraphConnection(RoadgraphConnectionEnum.CONTINUES,'lane1','lane2',location=[(1.0,2.0)]))
+    start = ObjectPose(ObjectFrameEnum.ABSOLUTE_CARTESIAN,0.0,100.0,50.0,yaw=0.3)
+    current = ObjectPose(ObjectFrameEnum.START,1.0,10.0,5.0,yaw=1.2)
+    for frame in [ObjectFrameEnum.START,ObjectFrameEnum.CURRENT,ObjectFrameEnum.ABSOLUTE_CARTESIAN]:
+        res = roadgraph.to_frame(frame,current,start)
+        assert res.frame == frame
+        for k,c in roadgraph.curves.items():
+            assert np.allclose(res.curves[k].polyline(),c.to_frame(roadgraph.frame,frame,current,start).polyline())
+        for k,l in roadgraph.lanes.items():
+            ref = l.to_frame(roadgraph.frame,frame,current,start)
+            for attr in ['left','right','center']:
+                if getattr(ref,attr) is not None:
+                    assert np.allclose(getattr(res.lanes[k],attr).polyline(),getattr(ref,attr).polyline())
+        assert np.allclose(res.regions['lot'].outline,roadgraph.regions['lot'].to_frame(roadgraph.frame,frame,current,start).outline)
+        assert np.allclose(res.connections[-1].location,roadgraph.connections[-1].to_frame(roadgraph.frame,frame,current,start).location)
+    #the last result is reused while the reference poses barely move
+    res = roadgraph.to_frame(ObjectFrameEnum.CURRENT,current,start)
+    res.lane_index()
+    moved = ObjectPose(ObjectFrameEnum.START,2.0,10.0+1e-5,5.0,yaw=1.2)
+    res2 = roadgraph.to_frame(ObjectFrameEnum.CURRENT,moved,start)
+    assert res2.lanes is res.lanes and res2.lane_index() is res.lane_index()
+    moved = ObjectPose(ObjectFrameEnum.START,2.0,11.0,5.0,yaw=1.2)
+    res3 = roadgraph.to_frame(ObjectFrameEnum.CURRENT,moved,start)
+    assert res3.lanes is not res.lanes and res3.lane_index() is not res.lane_index()
+    assert np.allclose(res3.curves['curb'].polyline(),roadgraph.curves['curb'].to_frame(roadgraph.frame,ObjectFrameEnum.CURRENT,moved,start).polyline())
+    #changes to the roadgraph are picked up
+    roadgraph.lanes['new'] = RoadgraphLane(center=RoadgraphCurve(RoadgraphCurveEnum.LANE_BOUNDARY,[[(0.0,0.0,0.0),(1.0,0.0,0.0)]]))
+    assert 'new' in roadgraph.to_frame(ObjectFrameEnum.CURRENT,moved,start).lanes
+    roadgraph.lanes['new'].center.segments[0][1] = (2.0,0.0,0.0)
+    roadgraph.invalidate_geometry()
+    new = roadgraph.to_frame(ObjectFrameEnum.ABSOLUTE_CARTESIAN,moved,start).lanes['new']
+    assert np.allclose(new.center.polyline(),[(0,0,0),(2,0,0)])
+    #the caches aren't pickled
+    roadgraph = make_roadgraph(rng,nlanes=20)
+    size = len(pickle.dumps(roadgraph))
+    res = roadgraph.to_frame(ObjectFrameEnum.CURRENT,current,start)
+    assert len(pickle.dumps(roadgraph)) == size
+    copy = pickle.loads(pickle.dumps(res))
+    assert copy == res and len(pickle.dumps(copy)) == len(pickle.dumps(res))
+    assert '_shared_cache' not in copy.__dict__
+    assert np.allclose(copy.to_frame(ObjectFrameEnum.START,current,start).lanes['lane1'].center.polyline(),roadgraph.lanes['lane1'].center.polyline())
+
+if __name__=='__main__':
+    test_nearest_lanes()
+    test_lane_routing()
+    test_lane_routing_grid()
+    test_to_frame()
@@ -0,0 +1,44 @@
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+import numpy as np
+from GEMstack.state import AllState,AgentState,AgentEnum,AgentAttributesFlag,ObjectPose,ObjectFrameEnum
+from GEMstack.onboard.planning.route_planning import SearchNavigationRoutePlanner
+
+def parking_state():
+    state = AllState.zero()
+    state.vehicle.pose = ObjectPose(ObjectFrameEnum.START,0,0,0,yaw=0)
+    state.start_vehicle_pose = ObjectPose(ObjectFrameEnum.START,0,0,0,yaw=0)
+    state.parking_slot = ObjectPose(ObjectFrameEnum.START,0,12,4,yaw=np.pi/2)
+    for i,x in enumerate([8.5,15.5]):
+        state.agents['car%d'%i] = AgentState(pose=ObjectPose(ObjectFrameEnum.START,0,x,4,yaw=np.pi/2),dimensions=(4,2,1.5),outline=None,type=AgentEnum.CAR,activity=None,velocity=(0,0,0),yaw_rate=0,attributes=AgentAttributesFlag.DEFAULT)
+    return state
+
+def test_footprints():
+    planner = SearchNavigationRoutePlanner()
+    vehicle = AllState.zero().vehicle
+    states = np.array([[0,0,0,1],[3,-2,1.0,1],[-1,5,-2.5,-1]])
+    for state,footprint in zip(states,planner.footprints(states)):
+        vehicle.pose = ObjectPose(ObjectFrameEnum.START,0,state[0],state[1],yaw=state[2])
+        obj = vehicle.to_object()
+        l,w,h = obj.dimensions
+        obj.dimensions = (l + 2*planner.LONGITUDINAL_DISTANCE_BUFFER, w + 2*planner.LATERAL_DISTANCE_BUFFER, h)
+        assert np.allclose(footprint,obj.polygon_parent())
+
+def test_batch_expansion():
+    routes = []
+    for batch in [False,True]:
+        np.random.seed(0)
+        planner = SearchNavigationRoutePlanner()
+        planner.batch_expansion = batch
+        routes.append(planner.update(parking_state()))
+    #the batched search expands the same children in the same order
+    assert np.allclose(routes[0].points,routes[1].points)
+    assert np.allclose(routes[0].yaws,routes[1].yaws)
+    assert np.linalg.norm(np.array(routes[1].points[-1]) - [12,4]) < 1.0
+
+if __name__=='__main__':
+    test_footprints()
+    test_batch_expansion()
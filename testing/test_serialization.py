@@ -4,7 +4,10 @@ import os
 sys.path.append(os.getcwd())
 
 from GEMstack.utils import serialization
-from GEMstack.state import PhysicalObject,ObjectPose,ObjectFrameEnum
+from GEMstack.state import PhysicalObject,ObjectPose,ObjectFrameEnum,Trajectory,AllState
+from dataclasses import asdict
+import dacite
+import numpy as np
 
 def test_serialization():
 	o = PhysicalObject(pose=ObjectPose(frame=ObjectFrameEnum.GLOBAL,t=0.0,x=2.0,y=4.0,yaw=0.5),
@@ -19,5 +22,19 @@ def test_serialization():
 	coll2 = serialization.deserialize_collection(serialization.serialize_collection(coll))
 	assert coll == coll2
 
+def test_compiled_serialization():
+	#compiled encoders / decoders match asdict / dacite
+	traj = Trajectory(frame=ObjectFrameEnum.START,points=[[float(i),2.0*i] for i in range(10)],times=[float(i) for i in range(10)])
+	data = serialization.encoder(Trajectory)(traj)
+	assert data == asdict(traj,dict_factory=serialization._custom_asdict_factory)
+	assert serialization.decoder(Trajectory)(data) == dacite.from_dict(Trajectory,data,config=serialization._DACITE_CONFIG)
+	#numpy arrays are written as lists
+	traj2 = Trajectory(frame=ObjectFrameEnum.START,points=np.array(traj.points),times=np.array(traj.times))
+	assert serialization.serialize(traj2) == serialization.serialize(traj)
+	#nested states round trip
+	state = AllState.zero()
+	assert serialization.deserialize(serialization.serialize(state)) == state
+
 if __name__=='__main__':
-	test_serialization()
\ No newline at end of file
+	test_serialization()
+	test_compiled_serialization()
\ No newline at end of file
@@ -0,0 +1,60 @@
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from GEMstack.state import AllState
+import pickle
+
+def test_snapshot():
+    state = AllState.zero()
+    g0 = state.generation
+    snap = state.snapshot()
+    assert state.snapshot() is snap
+    state.t = 1.0
+    state.vehicle_lane = 'lane1'
+    assert state.changed_since(g0) == ['t','vehicle_lane']
+    assert snap.t == 0 and snap.vehicle_lane is None
+    snap2 = state.snapshot()
+    assert snap2 is not snap
+    assert snap2.vehicle_lane == 'lane1'
+    assert snap2.changed_since(snap2.version('t')) == ['vehicle_lane']
+    try:
+        snap2.t = 2.0
+        assert False, "snapshot should be read-only"
+    except AttributeError:
+        pass
+    state.touch('mission')
+    assert state.changed_since(snap2.generation) == ['mission']
+    #snapshots can be copied to other processes and converted back to states
+    snap3 = pickle.loads(pickle.dumps(snap2))
+    assert snap3.to_state() == snap2.to_state()
+
+def test_parallel_versions():
+    #each assignment gets its own generation, even from parallel threads
+    from concurrent.futures import ThreadPoolExecutor
+    state = AllState.zero()
+    g0 = state.generation
+    def assign(name):
+        for i in range(2000):
+            setattr(state,name,i)
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(assign,['t','vehicle_lane','route','intent']))
+    assert state.generation == g0 + 8000
+    assert sorted(state.version(k) for k in ['t','vehicle_lane','route','intent'])[-1] == state.generation
+
+def test_normalizer_touch():
+    from GEMstack.state import ObjectPose,ObjectFrameEnum
+    from GEMstack.onboard.perception.perception_normalization import StandardPerceptionNormalizer
+    state = AllState.zero()
+    state.vehicle.pose = ObjectPose(ObjectFrameEnum.ABSOLUTE_CARTESIAN,0,1,2,yaw=0)
+    state.start_vehicle_pose = ObjectPose(ObjectFrameEnum.ABSOLUTE_CARTESIAN,0,1,1,yaw=0)
+    g = state.generation
+    StandardPerceptionNormalizer().update(state)
+    assert state.vehicle.pose.frame == ObjectFrameEnum.START
+    assert state.changed_since(g) == ['vehicle']
+
+if __name__=='__main__':
+    test_snapshot()
+    test_parallel_versions()
+    test_normalizer_touch()
@@ -0,0 +1,143 @@
+#needed to import GEMstack from top level directory
+import sys
+import os
+sys.path.append(os.getcwd())
+
+from GEMstack.state.trajectory import Path,Trajectory
+from GEMstack.state.physical_object import ObjectFrameEnum
+from GEMstack.mathutils import transforms
+import numpy as np
+import math
+
+def reference_closest_point(points, x, imin, imax, edges=True):
+    best_dist = float('inf')
+    best_point = None
+    for i in range(imin,imax+1):
+        if edges and i > 0:
+            dist,u = transforms.point_segment_distance(x,points[i-1],points[i])
+            if dist < best_dist:
+                best_dist,best_point = dist,i-1+u
+        else:
+            dist = transforms.vector_dist(points[i],x)
+            if dist < best_dist:
+                best_dist,best_point = dist,i
+    return best_dist,best_point
+
+def random_path(n, rng):
+    points = np.cumsum(rng.normal(size=(n,2))*3.0,axis=0).tolist()
+    points.insert(n//2,list(points[n//2]))   #repeated point
+    return Path(frame=ObjectFrameEnum.START,points=points)
+
+def test_path_closest_point():
+    rng = np.random.default_rng(0)
+    path = random_path(30,rng)
+    n = len(path.points)
+    for x in rng.normal(size=(50,2))*20:
+        for edges in [True,False]:
+            d,u = path.closest_point(x,edges)
+            dref,uref = reference_closest_point(path.points,x,0,n-1,edges)
+            assert abs(d-dref) < 1e-9
+            assert abs(u-uref) < 1e-9
+            #the reported parameter is where the closest point is
+            if edges:
+                assert abs(transforms.vector_dist(path.eval(u),x)-d) < 1e-9
+        lo = rng.uniform(-2,n)
+        hi = lo + rng.uniform(0,5)
+        d,u = path.closest_point_local(x,(lo,hi))
+        imin,imax = int(math.floor(max(lo,0))),min(int(math.floor(min(hi,n))),n-1)
+        dref,uref = reference_closest_point(path.points,x,imin,imax)
+        assert d == dref or abs(d-dref) < 1e-9
+        assert u == uref or abs(u-uref) < 1e-9
+
+def test_path_eval_batch():
+    rng = np.random.default_rng(1)
+    path = random_path(10,rng)
+    us = np.linspace(-1,len(path.points)+1,57)
+    res = path.eval(us)
+    assert res.shape == (len(us),2)
+    for u,p in zip(us,res):
+        assert np.allclose(path.eval(u),p)
+    assert abs(path.length() - sum(transforms.vector_dist(a,b) for a,b in zip(path.points[:-1],path.points[1:]))) < 1e-9
+
+def test_trajectory():
+    rng = np.random.default_rng(2)
+    path = random_path(10,rng)
+    traj = path.arc_length_parameterize(2.0)
+    assert len(traj.points) == len(path.points)-1
+    assert abs(traj.times[-1] - path.length()/2.0) < 1e-9
+    for i in range(len(traj.times)-1):
+        assert traj.times[i] < traj.times[i+1]
+    ts = np.linspace(-1,traj.times[-1]+1,83)
+    res = traj.eval(ts)
+    for t,p in zip(ts,res):
+        assert np.allclose(traj.eval(t),p)
+    for t in traj.times:
+        ind,u = traj.time_to_index(t)
+        assert np.allclose(traj.eval(t),traj.points[ind+(1 if u > 0.5 else 0)])
+    #cached arrays follow changes to the points
+    traj.points = traj.points + [[0.0,0.0]]
+    traj.times = traj.times + [traj.times[-1]+100.0]
+    assert np.allclose(traj.eval(np.array([traj.times[-1]])),[[0.0,0.0]])
+    traj.append_dim(1.0)
+    assert traj.eval(np.array([0.0])).shape == (1,3)
+
+def test_segment_index():
+    rng = np.random.default_rng(3)
+    path = random_path(500,rng)
+    path.points[100] = [path.points[99][0]+200.0,path.points[99][1]]   #a long segment
+    path.invalidate()
+    assert len(path.points) >= Path.INDEX_MIN_POINTS
+    xs = np.array(path.points)[rng.integers(0,len(path.points),100)] + rng.normal(size=(100,2))*10
+    ds,us = path.closest_points(xs)
+    for x,d,u in zip(xs,ds,us):
+        dref,uref = reference_closest_point(path.points,x,0,len(path.points)-1)
+        assert abs(d-dref) < 1e-9
+        assert abs(transforms.vector_dist(path.eval(u),x)-d) < 1e-9
+        assert path.closest_point(x) == (d,u)
+
+def test_replaced_points():
+    #a new list may get the id of a freed one, which must not reuse the cache
+    p = Path(frame=ObjectFrameEnum.START,points=[[0.0,0.0],[1.0,0.0]])
+    for k in range(2,200):
+        p.length()
+        p.points = None
+        b = [None,None]
+        b[0] = [0.0,0.0]
+        b[1] = [float(k),0.0]
+        p.points = b
+        assert p.length() == k
+    traj = Trajectory(frame=ObjectFrameEnum.START,points=[[0.0,0.0],[1.0,0.0]],times=[0.0,1.0])
+    for k in range(2,200):
+        traj.time_array()
+        traj.times = None
+        b = [None,None]
+        b[0] = 0.0
+        b[1] = float(k)
+        traj.times = b
+        assert traj.time_array()[1] == k
+
+def test_track_closest_point():
+    rng = np.random.default_rng(4)
+    s = np.linspace(0,100,300)
+    path = Path(frame=ObjectFrameEnum.START,points=np.stack((s,5*np.sin(s*0.2)),axis=1).tolist())
+    traj = path.arc_length_parameterize(2.0)
+    #drive along the trajectory faster than the lookahead window
+    t = None
+    for tq in np.linspace(0,traj.times[-1],40):
+        x = np.array(traj.eval(tq)) + rng.normal(size=2)*0.01
+        d,t = traj.track_closest_point(x,t,1.0,1.0)
+        dref,tref = traj.closest_point(x)
+        assert abs(d-dref) < 1e-9
+        assert abs(t-tref) < 1e-6
+    #jumping far away resets to a global search
+    x = np.array(path.points[0])
+    d,u = path.track_closest_point(x,len(path.points)-2,1.0,1.0,reset_distance=1.0)
+    assert d == path.closest_point(x)[0]
+
+if __name__=='__main__':
+    test_path_closest_point()
+    test_path_eval_batch()
+    test_trajectory()
+    test_segment_index()
+    test_replaced_points()
+    test_track_closest_point()